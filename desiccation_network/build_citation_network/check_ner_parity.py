@@ -0,0 +1,188 @@
+"""
+Checks how closely a CPU-optimised NER backend matches the stock TaxoNERD
+model on a random sample of papers, and how much faster it is. Optionally
+also checks how many species names are lost by skipping the papers the NER
+prefilter finds no candidates in.
+
+Author: Serena G. Lotreck
+"""
+import argparse
+from os.path import abspath
+import json
+import random
+import time
+from taxonerd import TaxoNERD
+from paper_store import load_papers
+from ner_backends import NER_BACKENDS, load_ner_model, compare_ner_outputs
+from classify_papers import (NER_MODEL, clean_input_data, get_unique_papers,
+                             get_species_names_batched, get_prefilter,
+                             prefilter_papers)
+
+
+def sample_papers(to_classify, sample_size, seed):
+    """
+    Get a random sample of papers to compare the backends on.
+
+    parameters:
+        to_classify, dict: keys are paper IDs, values are dict with title and
+            abstract
+        sample_size, int: number of papers to sample, all papers are used if
+            there are fewer than this
+        seed, int: random seed
+
+    returns:
+        sample, dict: sampled subset of to_classify, in the original order
+    """
+    if sample_size >= len(to_classify):
+        return to_classify
+    rng = random.Random(seed)
+    keep = set(rng.sample(list(to_classify.keys()), sample_size))
+
+    return {
+        paperId: paper_dict
+        for paperId, paper_dict in to_classify.items() if paperId in keep
+    }
+
+
+def time_backend(sample, backend, batch_size):
+    """
+    Run one backend over the sample.
+
+    parameters:
+        sample, dict: keys are paper IDs, values are dict with title and
+            abstract
+        backend, str: one of NER_BACKENDS
+        batch_size, int: number of texts to pass through the model at once
+
+    returns:
+        paper_spec_names, dict: keys are paper IDs, values are lists of species
+            names
+        elapsed, float: time in seconds to run NER, not including loading the
+            model
+    """
+    print(f'\nLoading {backend} model...')
+    taxonerd = TaxoNERD(prefer_gpu=False)
+    nlp = load_ner_model(taxonerd, NER_MODEL, backend)
+    print(f'Running {backend} model on {len(sample)} papers...')
+    start = time.perf_counter()
+    paper_spec_names = get_species_names_batched(sample, nlp, batch_size)
+    elapsed = time.perf_counter() - start
+    print(f'Time for {backend} model: {elapsed: .2f}')
+
+    return paper_spec_names, elapsed
+
+
+def get_prefilter_report(sample, stock_names, prefilter):
+    """
+    Measure the recall loss of the NER prefilter against full NER.
+
+    parameters:
+        sample, dict: keys are paper IDs, values are dict with title and
+            abstract
+        stock_names, dict: keys are paper IDs, values are lists of species
+            names from running the stock model on every paper
+        prefilter, TaxonPrefilter instance: prefilter to check
+
+    returns:
+        report, dict: compare_ner_outputs metrics for prefiltered NER against
+            full NER, plus the proportion of papers skipped and the number of
+            skipped papers that full NER found species in
+    """
+    _, skipped = prefilter_papers(sample, prefilter)
+    prefiltered_names = {
+        paperId: [] if paperId in skipped else names
+        for paperId, names in stock_names.items()
+    }
+    report = compare_ner_outputs(stock_names, prefiltered_names)
+    report['skipped_papers'] = (len(skipped) / len(sample)
+                                if len(sample) > 0 else 0.0)
+    report['skipped_papers_with_species'] = sum(
+        len(stock_names[paperId]) > 0 for paperId in skipped)
+
+    return report
+
+
+def main(search_result_path, report_path, backend, sample_size, seed,
+         batch_size, check_prefilter, generic_dict):
+
+    print('\nLoading citation data...')
+    search_results = load_papers(search_result_path)
+    try:
+        search_results[0]['paperId']
+        keyname = 'paperId'
+    except KeyError:
+        keyname = 'UID'
+    search_results = clean_input_data(search_results, keyname)
+
+    print('\nSampling papers...')
+    to_classify = get_unique_papers(search_results, keyname, False)
+    sample = sample_papers(to_classify, sample_size, seed)
+    print(f'Sampled {len(sample)} of {len(to_classify)} papers.')
+
+    stock_names, stock_time = time_backend(sample, 'stock', batch_size)
+    test_names, test_time = time_backend(sample, backend, batch_size)
+
+    print('\nComparing backends...')
+    report = compare_ner_outputs(stock_names, test_names)
+    report.update({
+        'backend': backend,
+        'seed': seed,
+        'stock_docs_per_sec': len(sample) / stock_time,
+        'backend_docs_per_sec': len(sample) / test_time,
+        'speedup': stock_time / test_time
+    })
+    if check_prefilter:
+        print('\nChecking prefilter...')
+        report['prefilter'] = get_prefilter_report(
+            sample, stock_names, get_prefilter(generic_dict))
+    for key, val in report.items():
+        print(f'{key}: {val}')
+    with open(report_path, 'w') as myf:
+        json.dump(report, myf, indent=4)
+    print(f'Parity report saved to {report_path}')
+
+    print('\nDone!')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Compare an NER backend to the stock model')
+
+    parser.add_argument('search_result_path',
+                        type=str,
+                        help='Output from pull_papers.py')
+    parser.add_argument('report_path',
+                        type=str,
+                        help='Path to save the parity report, extension is '
+                        '.json')
+    parser.add_argument('-backend', type=str, default='quantized',
+                        choices=[b for b in NER_BACKENDS if b != 'stock'],
+                        help='Backend to compare to the stock model')
+    parser.add_argument('-sample_size', type=int, default=500,
+                        help='Number of held-out papers to compare on')
+    parser.add_argument('-seed', type=int, default=1234,
+                        help='Random seed for sampling papers')
+    parser.add_argument('-batch_size', type=int, default=32,
+                        help='Number of titles/abstracts to pass through '
+                        'TaxoNERD at once')
+    parser.add_argument('-generic_dict', type=str, default='',
+                        help='Path to dictionary mapping general terms to '
+                        'life kingdoms, whose terms are used by the '
+                        'prefilter')
+    parser.add_argument('--prefilter', action='store_true',
+                        help='Also report the recall loss of the NER '
+                        'prefilter against full NER with the stock model')
+
+    args = parser.parse_args()
+
+    args.search_result_path = abspath(args.search_result_path)
+    args.report_path = abspath(args.report_path)
+    generic_dict = ''
+    if args.generic_dict != '':
+        with open(abspath(args.generic_dict)) as myf:
+            generic_dict = json.load(myf)
+
+    main(args.search_result_path, args.report_path, args.backend,
+         args.sample_size, args.seed, args.batch_size, args.prefilter,
+         generic_dict)
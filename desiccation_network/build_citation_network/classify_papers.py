@@ -4,20 +4,78 @@ Classifies nodes ina citation network by study organism.
 Author: Serena G. Lotreck
 """
 import argparse
-from os.path import abspath, splitext
-from os import listdir
+from os.path import abspath, splitext, isfile, dirname, join
+from multiprocessing import get_context, cpu_count
 import json
 import jsonlines
 from tqdm import tqdm
-from taxonerd import TaxoNERD
+from taxonerd import TaxoNERD, __version__ as taxonerd_version
 from taxonerd.linking.linking import EntityLinker
-import taxoniq
-from spacy.tokens import Span
+from spacy.tokens import Doc
+from spacy.vocab import Vocab
 from collections import Counter
-import networkx as nx
-import time
-import regex
 from math import ceil
+from result_cache import ResultCache, hash_text, hash_json
+from stage_manifest import StageManifest
+from graph_builder import CitationGraphBuilder
+from paper_store import PaperStore, PaperSubset, load_papers
+from run_profiler import RunProfiler
+from ner_backends import NER_BACKENDS, load_ner_model
+from network_io import NETWORK_EXTENSIONS
+from text_matchers import (FuzzyKingdomMatcher, TaxonPrefilter,
+                           DictionaryKingdomMatcher, read_common_names,
+                           AMBIGUOUS_COMMON_NAMES)
+from taxonomy_lookup import (KingdomResolver, lookup_scientific_names,
+                             get_taxonomy_version, NOT_TRACKED,
+                             NO_SUB_EUKARYOTA, NOT_FOUND, EMPTY_LINEAGE)
+
+# TaxoNERD model used for entity recognition
+NER_MODEL = 'en_core_eco_biobert'
+# Pipeline components that entity recognition doesn't depend on
+NER_DISABLE = ['tagger', 'attribute_ruler', 'lemmatizer', 'parser']
+# Pipeline components that entity linking doesn't depend on
+ENT_DOC_DISABLE = ['parser', 'ner']
+# Maximum number of characters of entity names to put in one doc for linking
+ENT_DOC_MAX_CHARS = 10000
+# TaxoNERD entity linker used to get NCBI Taxonomy IDs
+LINKER_NAME = 'ncbi_taxonomy'
+# Crop common names used to prefilter texts before NER and for dictionary
+# matching
+COMMON_NAME_CSV = join(dirname(abspath(__file__)), 'maps',
+                       'ag_plant_common_names.csv')
+# Entity linker loaded once in each linking worker process
+link_worker_linker = None
+
+
+def get_graph_builder(search_results, classified, keyname):
+    """
+    Add each paper and its references to a CitationGraphBuilder.
+
+    parameters:
+        search_results, list of dict: papers
+        classified, dict or None: keys are UID/paperIds, values are kingdoms.
+            If None, nodes don't get a study_system attribute
+        keyname, str: whether ot use 'UID' or 'paperId' to identify papers
+
+    returns:
+        builder, CitationGraphBuilder instance: nodes and edges of the network
+    """
+    def get_attrs(paper):
+        if classified is None:
+            return {'title': paper['title']}
+        return {
+            'title': paper['title'],
+            'study_system': classified[paper[keyname]]
+        }
+
+    builder = CitationGraphBuilder()
+    for paper in tqdm(search_results):
+        refs = [(p[keyname], get_attrs(p)) for p in paper['references']
+                if p[keyname] is not None]
+        builder.add_paper(paper[keyname], get_attrs(paper), refs)
+    builder.report_memory()
+
+    return builder
 
 
 def build_graph(search_results, classified, keyname):
@@ -32,27 +90,8 @@ def build_graph(search_results, classified, keyname):
     returns:
         citenet, MultiDiGraph: citation network
     """
-    nodes, edges = [], []
-    i = 0
-    for paper in tqdm(search_results):
-        org = classified[paper[keyname]]
-        citing = (paper[keyname], {
-            'title': paper['title'],
-            'study_system': org
-        })
-        cited = [(p[keyname], {
-            'title': p['title'],
-            'study_system': classified[p[keyname]]
-        }) for p in paper['references'] if p[keyname] is not None]
-        nodes.append(citing)
-        nodes.extend(cited)
-        edges.extend([(citing[0], p[0], num)
-                      for num, p in enumerate(cited, i)])
-        i += len(cited)
-
-    citenet = nx.MultiDiGraph()
-    _ = citenet.add_nodes_from(nodes)
-    _ = citenet.add_edges_from(edges)
+    builder = get_graph_builder(search_results, classified, keyname)
+    citenet = builder.to_networkx()
 
     return citenet
 
@@ -64,135 +103,279 @@ def fuzzy_match_kingdoms(paper_dict, generic_dict):
 
     parameters:
         paper_dict, dict: keys are "title" and "abstract"
-        generic_dict, dict: keys are generic terms, values are kingdom names
+        generic_dict, dict or FuzzyKingdomMatcher: keys are generic terms,
+            values are kingdom names. Pass a FuzzyKingdomMatcher to avoid
+            recompiling the term patterns for every paper
 
     returns:
         classes, list of str: kingdoms identified
     """
-    classes = []
-    for term, king in generic_dict.items():
+    if isinstance(generic_dict, FuzzyKingdomMatcher):
+        matcher = generic_dict
+    else:
+        matcher = FuzzyKingdomMatcher(generic_dict)
 
-        # Combine text to search
-        if paper_dict['abstract'] is not None:
-            text = paper_dict['title'] + ' ' + paper_dict['abstract']
-        else:
-            text = paper_dict['title']
+    classes = matcher.match(get_paper_text(paper_dict))
 
-        # Build the regex string
-        sub_len = len(term) // 3
-        spacejoined = "\s+".join(term.split())
-        reg = fr'\b({spacejoined}){{e<={sub_len}}}\b'
+    return classes
 
-        # Search in paper
-        matches = regex.search(reg, text, flags=regex.IGNORECASE)
 
-        # Map to classes
-        if matches is not None:
-            classes.append(king)
+def get_common_name_kingdoms(common_name_csv, cache_path=''):
+    """
+    Get the kingdom of each crop common name from its scientific name, using
+    the binomial if it's in the taxonomy and the genus otherwise. Some genus
+    names are shared between kingdoms (Morus is both mulberries and gannets),
+    and the csv only lists crops and mushrooms, so a genus that resolves to
+    an animal is ignored. Names that can't be resolved are assumed to be
+    plants.
 
-    return classes
+    parameters:
+        common_name_csv, str: path to csv with Common_name and
+            Scientific_name columns
+        cache_path, str: path to a database of cached results, or empty string
+
+    returns:
+        common_kingdoms, dict: keys are common names, values are kingdoms
+    """
+    common_names = read_common_names(common_name_csv)
+    sci_words = {
+        name: sci_name.replace(';', ' ').split()
+        for name, sci_name in common_names.items()
+    }
+    queries = {
+        name: (' '.join(words[:2]), words[0] if len(words) > 0 else '')
+        for name, words in sci_words.items()
+    }
+    tax_ids = lookup_scientific_names(
+        [q for binomial_genus in queries.values() for q in binomial_genus],
+        cache_path)
+    resolver = KingdomResolver(cache_path)
+    outcomes = resolver.resolve_many(
+        [tax_id for tax_id in tax_ids.values() if tax_id is not None])
+
+    common_kingdoms = {}
+    for name, (binomial, genus) in queries.items():
+        king = 'Plant'
+        if tax_ids[binomial] is not None:
+            outcome = outcomes[int(tax_ids[binomial])]
+            if outcome in KingdomResolver.defs.values():
+                king = outcome
+        elif tax_ids[genus] is not None:
+            outcome = outcomes[int(tax_ids[genus])]
+            if outcome in KingdomResolver.defs.values() and (outcome !=
+                                                             'Animal'):
+                king = outcome
+        common_kingdoms[name] = king
+
+    return common_kingdoms
+
+
+def get_dictionary_matcher(common_name_csv, generic_dict, cache_path=''):
+    """
+    Build a dictionary matcher from the crop common names and the exact
+    forms of the generic terms. Common names in AMBIGUOUS_COMMON_NAMES are
+    left out, and generic terms take precedence over common names.
+
+    parameters:
+        common_name_csv, str: path to csv with Common_name and
+            Scientific_name columns
+        generic_dict, dict or str: keys are generic terms for kingdoms, values
+            are kingdoms, or empty string to only use the common names
+        cache_path, str: path to a database of cached results, or empty string
+
+    returns:
+        matcher, DictionaryKingdomMatcher instance: matcher for all names
+    """
+    term_kingdoms = {
+        name: king
+        for name, king in get_common_name_kingdoms(common_name_csv,
+                                                   cache_path).items()
+        if name not in AMBIGUOUS_COMMON_NAMES
+    }
+    if generic_dict != '':
+        for term, king in generic_dict.items():
+            term_kingdoms.pop(term.casefold(), None)
+            term_kingdoms[term] = king
+
+    return DictionaryKingdomMatcher(term_kingdoms)
+
+
+def get_paper_evidence(spec_names, species_dict, paper_dict, generic_matcher,
+                       dictionary_matcher):
+    """
+    Collect the evidence for a paper's kingdom. The dictionary and fuzzy
+    matchers are only run if none of the paper's species map to a kingdom,
+    and each is run at most once.
+
+    parameters:
+        spec_names, list of str: species names found in the paper
+        species_dict, dict: keys are species names, values are kingdoms
+        paper_dict, dict: keys are "title" and "abstract"
+        generic_matcher, FuzzyKingdomMatcher instance or None: matcher for
+            generic terms
+        dictionary_matcher, DictionaryKingdomMatcher instance or None: matcher
+            for common names and exact generic terms
+
+    returns:
+        evidence, dict: "species" is a list of [name, kingdom] pairs, with
+            None for names that don't map to a kingdom; "dictionary" and
+            "fuzzy" are lists of [term, kingdom] pairs, or None if the matcher
+            wasn't run
+    """
+    evidence = {
+        'species': [[spec, species_dict.get(spec)] for spec in spec_names],
+        'dictionary': None,
+        'fuzzy': None
+    }
+    if any(king is not None for _, king in evidence['species']):
+        return evidence
+
+    text = get_paper_text(paper_dict)
+    if dictionary_matcher is not None:
+        evidence['dictionary'] = [[
+            term, dictionary_matcher.term_kingdoms[term]
+        ] for term in dictionary_matcher.find_terms(text)]
+        if len(evidence['dictionary']) > 0:
+            return evidence
+    if generic_matcher is not None:
+        evidence['fuzzy'] = [[term, generic_matcher.generic_dict[term]]
+                             for term in generic_matcher.find_terms(text)]
+
+    return evidence
+
+
+def vote_kingdom(evidence):
+    """
+    Get a paper's kingdom from its evidence. Species kingdoms are used if
+    there are any, then dictionary matches, then fuzzy matches. If the
+    kingdoms disagree, the most common one wins, and ties go to the kingdom
+    that was found first.
+
+    parameters:
+        evidence, dict: evidence record from get_paper_evidence
+
+    returns:
+        king, str: kingdom, or NOCLASS if there is no evidence
+    """
+    for source in ['species', 'dictionary', 'fuzzy']:
+        classes = [king for _, king in evidence[source] or []
+                   if king is not None]
+        if len(classes) > 0:
+            return Counter(classes).most_common(1)[0][0]
+
+    return 'NOCLASS'
+
+
+def revote_classifications(paper_evidence, vote=vote_kingdom):
+    """
+    Re-classify papers from saved evidence records without re-running any
+    matchers, e.g. to audit the classifications or try a different vote.
+
+    parameters:
+        paper_evidence, dict: keys are paper IDs, values are evidence records,
+            as saved in paper_evidence.json
+        vote, function: takes an evidence record and returns a kingdom
+
+    returns:
+        classified, dict: keys are paper IDs, values are kingdoms
+    """
+    return {
+        paperId: vote(evidence)
+        for paperId, evidence in paper_evidence.items()
+    }
 
 
 def map_paper_species(paper_spec_names, species_dict, generic_dict,
-                      to_classify):
+                      to_classify, dictionary_matcher=None,
+                      return_evidence=False):
     """
-    Get the kingdom classifications for each paper.
+    Get the kingdom classifications for each paper. Papers with no species
+    that map to a kingdom fall back on exact dictionary matches, if a
+    dictionary matcher is given, and then on fuzzy matches for generic terms,
+    if generic terms are given.
 
     parameters:
         paper_spec_names, dict: keys are paper ID's, values are lists of species
         species_dict, dict: keys are species names, values are kingdoms
-        generic_dict, dict: keys are generic descriptors of a kingdom, values
-            are kingdom names
+        generic_dict, dict or str: keys are generic descriptors of a kingdom,
+            values are kingdom names, or empty string to not fuzzy match
         to_classify, dict: keys are paper IDs, values are dict with title and
             abstract
+        dictionary_matcher, DictionaryKingdomMatcher instance or None: matcher
+            for common names and exact generic terms
+        return_evidence, bool: whether or not to also return the evidence
+            record for each paper
 
     returns:
         classified, dict: keys are paper ID's, values are kingdoms
+        paper_evidence, dict: keys are paper ID's, values are evidence records
+            from get_paper_evidence with the final kingdom added, only
+            returned if return_evidence is True
     """
-    # Map species classifications
-    classified = {}
-    species_missed = []
-    additional_papers_identified = 0
+    # Compile the generic term patterns once for all papers
+    if generic_dict != '':
+        generic_matcher = FuzzyKingdomMatcher(generic_dict)
+    else:
+        generic_matcher = None
+
+    paper_evidence = {}
     for paperId, spec_names in tqdm(paper_spec_names.items()):
-        classes = []
-        # Try either generic terms
-        if (len(spec_names) == 0) and (generic_dict != ''):
-            classes = fuzzy_match_kingdoms(to_classify[paperId], generic_dict)
-            if len(classes) != 0:
-                additional_papers_identified += 1
-        for i, spec in enumerate(spec_names):
-            try:
-                classes.append(species_dict[spec])
-            except:
-                species_missed.append(spec)
-                continue
-        if len(classes) == 1:
-            # If no disagreement, return
-            king = classes[0]
-        elif len(classes) > 1:
-            # If disagreement, return the most common class
-            # If there's a tie, this method will resort to the class that was
-            # inserted first in the Counter object
-            king = Counter(classes).most_common(1)[0][0]
-        else:
-            classes = fuzzy_match_kingdoms(to_classify[paperId], generic_dict)
-            if len(classes) == 1:
-                king = classes[0]
-            elif len(classes) > 1:
-                king = Counter(classes).most_common(1)[0][0]
-            else:
-                # If there's no classification, return NOCLASS
-                king = 'NOCLASS'
-        classified[paperId] = king
+        evidence = get_paper_evidence(spec_names, species_dict,
+                                      to_classify[paperId], generic_matcher,
+                                      dictionary_matcher)
+        evidence['kingdom'] = vote_kingdom(evidence)
+        paper_evidence[paperId] = evidence
+    classified = {
+        paperId: evidence['kingdom']
+        for paperId, evidence in paper_evidence.items()
+    }
 
+    sources = Counter(
+        'species' if any(king is not None for _, king in ev['species']) else
+        'dictionary' if ev['dictionary'] else 'fuzzy' if ev['fuzzy'] else
+        'none' for ev in paper_evidence.values())
+    print(f'{sources["species"]} papers were classified by their species, '
+          f'{sources["dictionary"]} by dictionary matches, '
+          f'{sources["fuzzy"]} by fuzzy matches, and {sources["none"]} '
+          'could not be classified.')
+
+    if return_evidence:
+        return classified, paper_evidence
     return classified
 
 
-def map_specs_to_kings(species_ids):
+def map_specs_to_kings(species_ids, cache_path=''):
     """
     Maps species names to kingdom classifications.
 
     parameters:
         species_ids, dict: keys are species names, values are NCBI IDs
+        cache_path, str: path to a database to persist resolved tax IDs to,
+            or empty string to not use a cache
 
     returns:
         species_dict, dict: keys are species names, values are kingdoms
     """
+    # Resolve each unique tax ID once
+    resolver = KingdomResolver(cache_path)
+    outcomes = resolver.resolve_many(tqdm(species_ids.values()))
+
     species_dict = {}
-    defs = {
-        'Metazoa': 'Animal',
-        'Viridiplantae': 'Plant',  # Consider adding algae
-        'Bacteria': 'Microbe',
-        'Archea': 'Microbe',
-        'Fungi': 'Fungi'
-    }
     not_tracked_lineage = 0
     no_sub_eukaryota_lineage = 0
     not_found_in_taxonomy = 0
     empty_lineage = 0
-    for spec_ent, ncbi_id in tqdm(species_ids.items()):
-        try:
-            t1 = taxoniq.Taxon(ncbi_id)
-            lineage = [t.scientific_name for t in t1.ranked_lineage]
-            if lineage[-1] == 'Bacteria' or lineage[-1] == 'Archea':
-                king = defs[lineage[-1]]
-                species_dict[spec_ent] = king
-            elif lineage[-1] == 'Eukaryota':
-                try:
-                    king = defs[lineage[-2]]
-                    if king == 'Opisthokonta':
-                        king = defs[lineage[-3]]
-                    species_dict[spec_ent] = king
-                except KeyError:
-                    not_tracked_lineage += 1
-                    continue
-                except IndexError:
-                    no_sub_eukaryota_lineage += 1
-                    continue
-        except KeyError:
+    for spec_ent, ncbi_id in species_ids.items():
+        outcome = outcomes[int(ncbi_id)]
+        if outcome in KingdomResolver.defs.values():
+            species_dict[spec_ent] = outcome
+        elif outcome == NOT_TRACKED:
+            not_tracked_lineage += 1
+        elif outcome == NO_SUB_EUKARYOTA:
+            no_sub_eukaryota_lineage += 1
+        elif outcome == NOT_FOUND:
             not_found_in_taxonomy += 1
-            continue
-        except IndexError:
+        elif outcome == EMPTY_LINEAGE:
             empty_lineage += 1
 
     print(f'When building the species --> kingdom dict, {not_tracked_lineage} '
@@ -209,42 +392,44 @@ def map_specs_to_kings(species_ids):
     return species_dict
 
 
-def link_taxoniq(uniq_names, docs, species_ids):
+def link_taxoniq(uniq_names, species_ids, cache_path=''):
     """
     Use taxoniq directly to attempt to link species names not linked by
     TaxoNERD.
 
     parameters:
         uniq_names, list of str: unique species names
-        docs, list of spacy Doc object: docs with linked entities
-        species_ids, dict: keys are species, values are NCBI ID's
+        species_ids, dict: keys are species linked by TaxoNERD, values are
+            NCBI ID's
+        cache_path, str: path to a database of cached results, or empty string
 
     returns:
         species_ids, dict: updated species IDs with futher identified species
     """
-    all_doc_ents = [ent.text for doc in docs for ent in doc.ents]
-    missed = [
-        s for s in uniq_names
-        if uniq_names not in all_doc_ents
-    ]
-    still_missed = []
-    for ent in missed:
-        try:
-            t1 = taxoniq.Taxon(scientific_name=ent)
-            tax_id = t1.tax_id
+    linked = set(species_ids.keys())
+    missed = [s for s in uniq_names if s not in linked]
+    print(f'{len(linked)} entities were linked by TaxoNERD, {len(missed)} '
+          'were not.')
+    tax_ids = lookup_scientific_names(missed, cache_path)
+    newly_linked = 0
+    for ent, tax_id in tax_ids.items():
+        if tax_id is not None:
             species_ids[ent] = tax_id
-        except KeyError:
-            still_missed.append(ent)
-    print(f'Linked an additional {len(missed) - len(still_missed)} entities.')
+            newly_linked += 1
+    print(f'Linked an additional {newly_linked} entities.')
 
     return species_ids
 
 
 def make_ent_docs(uniq_names, nlp):
     """
-    Make entities into dummy docs for linking. If there are more than 1 million
-    characters worth of entities, breaks up into multiple docs to get around
-    spacy's character limit.
+    Make entities into dummy docs for linking. If there are more than
+    ENT_DOC_MAX_CHARS characters worth of entities, breaks up into multiple
+    docs to get around spacy's character limit.
+
+    Names are joined with spaces and each joined text is tokenized once;
+    entity spans are then set from each name's character offsets, so we don't
+    have to guess at spacy's tokenization of the individual names.
 
     parameters:
         uniq_names, list of str: unique entities to link
@@ -253,56 +438,268 @@ def make_ent_docs(uniq_names, nlp):
     returns:
         docs, list of spacy Doc object: docs with entities set as doc.ents
     """
-    # Get the number of docs that we need to make
-    if len(' '.join(uniq_names)) < 10000:
-        num_docs = 1
-    else:
-        num_docs = ceil(len(' '.join(uniq_names))/10000)
-
-    # Make docs
+    # Break names up into chunks under the character limit
+    chunks = [[]]
+    char_num = 0
+    for ent in uniq_names:
+        if (char_num + len(ent) >= ENT_DOC_MAX_CHARS) and (len(chunks[-1]) >
+                                                            0):
+            chunks.append([])
+            char_num = 0
+        chunks[-1].append(ent)
+        char_num += len(ent) + 1  # To account for trailing space
+
+    # Get the character offsets of each name in its chunk
+    chunk_offsets = []
+    for names in chunks:
+        offsets = []
+        char_num = 0
+        for ent in names:
+            offsets.append((char_num, char_num + len(ent)))
+            char_num += len(ent) + 1
+        chunk_offsets.append(offsets)
+
+    # Tokenize all chunks in one pass; linking uses lemmas but not NER
+    disable = [pipe for pipe in ENT_DOC_DISABLE if pipe in nlp.pipe_names]
     docs = []
-    last_idx = 0 # To break up entities for docs
-    single_tok_times = []
-    for _ in range(num_docs):
-        char_num = 0 # So we can break when we get to too long
-        names_to_keep = [] # For making the doc later
-        span_idxs = [] # For keeping track of spans
-        prev_last = 0
-        for i, ent in enumerate(uniq_names[last_idx:]):
-            # We can't naively assume what spacy's tokenization wil be;
-            # splitting on spaces causes errors if spacy's tokenization is
-            # different. Therefore, we need to check how many tokens are in
-            # spacy's tokenization for each word
-            if char_num + len(ent) >= 10000:
-                last_idx += i
-                break
-            start = prev_last
-            single_tok_start_time = time.time()
-            num_toks = len(nlp(ent, disable=['tagger', 'attribute_ruler',
-                'lemmatizer', 'parser', 'ner']))
-            single_tok_times.append(time.time() - single_tok_start_time)
-            end = start + num_toks
-            prev_last += num_toks
-            span_idxs.append((start, end))
-            names_to_keep.append(ent)
-            char_num += len(ent) + 1 # To account for trailing space
-        single_doc_start_time = time.time()
-        doc = nlp(' '.join(names_to_keep))
-        toks = "\n".join([t.text for t in doc])
-        spans = [Span(doc, e[0], e[1], "ENTITY") for e in span_idxs]
-        doc.set_ents(spans)
-        print(f'It took {time.time() - single_doc_start_time:.2f} seconds to '
-                f'tokenize and add ents to doc number {_}')
-        docs.append(doc)
-    print('On average, it took '
-        f'{sum(single_tok_times)/len(single_tok_times):.2f} seconds to '
-        'tokenize each entity')
+    with nlp.select_pipes(disable=disable):
+        chunk_docs = nlp.pipe(' '.join(names) for names in chunks)
+        for doc, offsets in zip(chunk_docs, chunk_offsets):
+            spans = [
+                doc.char_span(start, end, "ENTITY", alignment_mode='expand')
+                for start, end in offsets
+            ]
+            doc.set_ents([span for span in spans if span is not None])
+            docs.append(doc)
 
     return docs
 
 
+def get_doc_links(doc):
+    """
+    Get the NCBI IDs of the entities in a linked doc.
+
+    parameters:
+        doc, spacy Doc object: doc that has been through the entity linker
+
+    returns:
+        links, list of tuple: (entity text, NCBI ID) for each linked entity,
+            in the order they appear in the doc
+    """
+    links = [(ent.text, ent._.kb_ents[0][0].split(':')[1])
+             for ent in doc.ents]
+
+    return links
+
+
+def init_link_worker(linker_name):
+    """
+    Load the entity linker once in a linking worker process.
+
+    parameters:
+        linker_name, str: name of the TaxoNERD linker to load
+    """
+    global link_worker_linker
+    link_worker_linker = EntityLinker(linker_name=linker_name,
+                                      resolve_abbreviations=False)
+
+
+def link_doc_bytes(doc_bytes):
+    """
+    Link the entities in a serialized doc with the worker's entity linker.
+
+    parameters:
+        doc_bytes, bytes: doc serialized with Doc.to_bytes
+
+    returns:
+        links, list of tuple: (entity text, NCBI ID) for each linked entity
+    """
+    doc = Doc(Vocab()).from_bytes(doc_bytes)
+    doc = link_worker_linker(doc)
+
+    return get_doc_links(doc)
+
+
+def link_docs_parallel(docs, link_processes, linker_name=LINKER_NAME):
+    """
+    Link entity docs in a pool of processes that each load the linker once.
+
+    parameters:
+        docs, list of spacy Doc object: docs with entities set as doc.ents
+        link_processes, int: number of linking processes
+        linker_name, str: name of the TaxoNERD linker to load
+
+    returns:
+        species_ids, dict: keys are species, values are NCBI ID's
+    """
+    doc_bytes = [doc.to_bytes(exclude=['user_data']) for doc in docs]
+    with get_context('spawn').Pool(link_processes,
+                                   initializer=init_link_worker,
+                                   initargs=(linker_name, )) as pool:
+        # map returns results in doc order, so merging is deterministic
+        doc_links = pool.map(link_doc_bytes, doc_bytes, chunksize=1)
+
+    species_ids = {}
+    for links in doc_links:
+        for ent_text, ent_id in links:
+            species_ids[ent_text] = ent_id
+
+    return species_ids
+
+
+def link_names(names, nlp, linker, link_processes=1, profiler=None):
+    """
+    Link species names to NCBI IDs with the TaxoNERD entity linker.
+
+    parameters:
+        names, list of str: unique species names to link
+        nlp, spacy NLP object: model to use to make doc for linking
+        linker, taxonerd EntityLinker instance: linker to use to get IDs
+        link_processes, int: number of processes to link docs in
+        profiler, RunProfiler instance or None: profiler to record the doc
+            building and linking stages in
+
+    returns:
+        species_ids, dict: keys are linked species, values are NCBI ID's
+    """
+    if profiler is None:
+        profiler = RunProfiler()
+
+    # Make into a doc with entities
+    print('Formatting unique entities into one document...')
+    with profiler.stage('doc_building', len(names)):
+        docs = make_ent_docs(names, nlp)
+
+    print(f'There are {len(docs)} spacy documents to link.')
+    with profiler.stage('linking', len(names)):
+        if link_processes > 1:
+            species_ids = link_docs_parallel(docs, link_processes)
+        else:
+            species_ids = {}
+            for doc in docs:
+                doc = linker(doc)
+                for ent_text, ent_id in get_doc_links(doc):
+                    species_ids[ent_text] = ent_id
+
+    return species_ids
+
+
+def normalize_ent_text(ent_text):
+    """
+    Normalize whitespace in an entity, to use it as a link cache key.
+    """
+    return ' '.join(ent_text.split())
+
+
+def get_link_namespace(linker_name=LINKER_NAME):
+    """
+    Get the link cache namespace, so that cached links are only re-used for
+    the same linker and TaxoNERD version.
+    """
+    return f'links:{linker_name}-taxonerd-{taxonerd_version}'
+
+
+def link_names_cached(uniq_names,
+                      nlp,
+                      linker,
+                      cache_path,
+                      link_processes=1,
+                      profiler=None):
+    """
+    Link species names, only sending names that aren't in the link cache to
+    make_ent_docs and the linker. Names that the linker couldn't link are
+    cached too, so they aren't re-linked on every run.
+
+    parameters:
+        uniq_names, list of str: unique species names to link
+        nlp, spacy NLP object: model to use to make doc for linking
+        linker, taxonerd EntityLinker instance: linker to use to get IDs
+        cache_path, str: path to the cache database, pass an empty string to
+            link all names without a cache
+        link_processes, int: number of processes to link docs in
+        profiler, RunProfiler instance or None: profiler to record the doc
+            building and linking stages in
+
+    returns:
+        species_ids, dict: keys are linked species, values are NCBI ID's
+    """
+    if cache_path == '':
+        return link_names(uniq_names, nlp, linker, link_processes, profiler)
+
+    link_cache = ResultCache(cache_path, get_link_namespace())
+    cached = link_cache.get_many(
+        set(normalize_ent_text(name) for name in uniq_names))
+    to_link = [
+        name for name in uniq_names
+        if normalize_ent_text(name) not in cached
+    ]
+    print(f'{len(uniq_names) - len(to_link)} of {len(uniq_names)} names were '
+          f'found in the link cache, linking {len(to_link)}.')
+
+    if len(to_link) > 0:
+        new_ids = link_names(to_link, nlp, linker, link_processes, profiler)
+    else:
+        new_ids = {}
+    new_links = {
+        normalize_ent_text(name): new_ids.get(name)
+        for name in to_link
+    }
+    link_cache.put_many(new_links)
+    link_cache.close()
+    cached.update(new_links)
+
+    species_ids = {}
+    for name in uniq_names:
+        ent_id = cached[normalize_ent_text(name)]
+        if ent_id is not None:
+            species_ids[name] = ent_id
+
+    return species_ids
+
+
+def load_intermediate(intermediate_save_path, use_intermed, file_name):
+    """
+    Read an intermediate result, if it's been saved and we're using them.
+
+    parameters:
+        intermediate_save_path, str: path to directory of intermediate results
+        use_intermed, bool: whether or not to read intermediate files
+        file_name, str: name of the intermediate file
+
+    returns:
+        results, dict or None: saved results, None if there aren't any
+    """
+    if (not use_intermed) or (intermediate_save_path == ''):
+        return None
+    save_name = f'{intermediate_save_path}/{file_name}'
+    if not isfile(save_name):
+        return None
+    with open(save_name) as myf:
+        results = json.load(myf)
+    print(f'Read in {file_name} from {save_name}')
+
+    return results
+
+
+def save_intermediate(intermediate_save_path, file_name, results):
+    """
+    Save an intermediate result, if there's somewhere to save it.
+
+    parameters:
+        intermediate_save_path, str: path to directory of intermediate results
+        file_name, str: name of the intermediate file
+        results, dict: results to save
+    """
+    if intermediate_save_path != '':
+        save_name = f'{intermediate_save_path}/{file_name}'
+        with open(save_name, 'w') as myf:
+            json.dump(results, myf)
+        print(f'Saved {file_name} as {save_name}')
+
+
 def get_species_classes(paper_spec_names, nlp, linker, intermediate_save_path,
-                        use_intermed):
+                        use_intermed, cache_path='', link_processes=1,
+                        manifest=None, profiler=None):
     """
     Get organism classifications from a list of NCBI Taxonomy IDs
 
@@ -315,84 +712,570 @@ def get_species_classes(paper_spec_names, nlp, linker, intermediate_save_path,
             results
         use_intermed, bool: whether or not to read intermediate files out of
             the intermediate save path
+        cache_path, str: path to a database of cached results, or empty string
+        link_processes, int: number of processes to link docs in. If more
+            than 1, each process loads its own linker and linker is unused
+        manifest, StageManifest instance: inputs of the intermediate results,
+            so that only names whose inputs changed are re-linked and
+            re-mapped to kingdoms
+        profiler, RunProfiler instance or None: profiler to record the
+            linking and kingdom mapping stages in
 
     returns:
         species_dict, keys are species names, values are kingdom
             classifications
     """
+    if manifest is None:
+        manifest = StageManifest(intermediate_save_path)
+    if profiler is None:
+        profiler = RunProfiler()
+
     # Get unique species names
     all_names = [s for p, ss in paper_spec_names.items() for s in ss]
     print(f'There were {len(all_names)} non-unique entities identified.')
-    uniq_names = list(set(all_names))
+    uniq_names = sorted(set(all_names))
     print(f'There are {len(uniq_names)} unique species names to classify.')
 
-    # Make into a doc with entities
-    print('Formatting unique entities into one document...')
-    docs = make_ent_docs(uniq_names, nlp)
-
-    # Perform linking
-    if use_intermed and ('species_ids.json' in
-            listdir(intermediate_save_path)):
-        species_id_save_name = f'{intermediate_save_path}/species_ids.json'
-        with open(species_id_save_name) as myf:
-            species_ids = json.load(myf)
-        print(f'Read in species NCBI IDs from {species_id_save_name}')
-    else:
+    # Perform linking for names we haven't linked with this linker/taxonomy
+    prev_ids = load_intermediate(intermediate_save_path, use_intermed,
+                                 'species_ids.json')
+    link_settings = {
+        'linker': get_link_namespace(),
+        'taxonomy': get_taxonomy_version()
+    }
+    name_hashes = {name: hash_text(name) for name in uniq_names}
+    valid_names = manifest.get_valid_keys('species_ids', link_settings,
+                                          name_hashes, prev_ids)
+    species_ids = {
+        name: prev_ids[name]
+        for name in uniq_names if (name in valid_names) and (name in prev_ids)
+    }
+    to_link = [name for name in uniq_names if name not in valid_names]
+    print(f'Re-using links for {len(valid_names)} names, linking '
+          f'{len(to_link)}.')
+    if len(to_link) > 0:
         print('Performing TaxoNERD entity linking...')
-        species_ids = {}
-        print(f'There are {len(docs)} spacy documents to link.')
-        for i, doc in enumerate(docs):
-            start = time.time()
-            doc = linker(doc)
-            print(f'Time to apply linker on doc {i}: {time.time() - start: .2f}')
-            for ent in doc.ents:
-                ent_id = ent._.kb_ents[0][0].split(':')[1]
-                species_ids[ent.text] = ent_id
-         # Use taxoniq to try and fill in some unlinked species
+        new_ids = link_names_cached(to_link, nlp, linker, cache_path,
+                                    link_processes, profiler)
+        # Use taxoniq to try and fill in some unlinked species
         print(f'Using taxoniq to attempt to link the missed entities...')
-        species_ids = link_taxoniq(uniq_names, docs, species_ids)
-        if intermediate_save_path != '':
-            species_id_save_name = f'{intermediate_save_path}/species_ids.json'
-            with open(species_id_save_name, 'w') as myf:
-                json.dump(species_ids, myf)
-            print(f'Saved species id dictionary as {species_id_save_name}')
+        with profiler.stage('taxoniq_fallback',
+                            len(to_link) - len(new_ids)):
+            species_ids.update(link_taxoniq(to_link, new_ids, cache_path))
+    if (len(to_link) > 0) or (prev_ids is None):
+        save_intermediate(intermediate_save_path, 'species_ids.json',
+                          species_ids)
+    manifest.update('species_ids', link_settings, name_hashes)
+
+    # Map to kingdoms for names whose IDs changed
+    prev_dict = load_intermediate(intermediate_save_path, use_intermed,
+                                  'species_dict.json')
+    king_settings = {'taxonomy': get_taxonomy_version()}
+    id_hashes = {
+        name: hash_text(str(ent_id))
+        for name, ent_id in species_ids.items()
+    }
+    valid_ids = manifest.get_valid_keys('species_dict', king_settings,
+                                        id_hashes, prev_dict)
+    species_dict = {
+        name: prev_dict[name]
+        for name in species_ids if (name in valid_ids) and (name in prev_dict)
+    }
+    to_map = {
+        name: ent_id
+        for name, ent_id in species_ids.items() if name not in valid_ids
+    }
+    print(f'Re-using kingdoms for {len(valid_ids)} names, mapping '
+          f'{len(to_map)}.')
+    if len(to_map) > 0:
+        print('Mapping to kingdom classifications...')
+        with profiler.stage('kingdom_mapping', len(to_map)):
+            species_dict.update(map_specs_to_kings(to_map, cache_path))
+    if (len(to_map) > 0) or (prev_dict is None):
+        save_intermediate(intermediate_save_path, 'species_dict.json',
+                          species_dict)
+    manifest.update('species_dict', king_settings, id_hashes)
 
+    return species_dict
 
-    # Map to kingdoms
-    print('Mapping to kingdom classifications...')
-    species_dict = map_specs_to_kings(species_ids)
 
-    return species_dict
+def get_paper_text(paper_dict):
+    """
+    Combine the title and abstract of a paper into one string.
+
+    parameters:
+        paper_dict, dict: keys are "title" and "abstract"
+
+    returns:
+        text, str: title and abstract separated by a space
+    """
+    if paper_dict['abstract'] is not None:
+        text = paper_dict['title'] + ' ' + paper_dict['abstract']
+    else:
+        text = paper_dict['title']
+
+    return text
 
 
-def get_species_names(title, abstract, taxonerd):
+def get_doc_species(doc):
     """
-    Gets the species names for a paper.
+    Get the unique organism names from a doc processed by the TaxoNERD model.
+    Applies the same entity filter as TaxoNERD.find_in_text, without building a
+    DataFrame for the doc.
 
     parameters:
-        title, str: title of the paper
-        abstract, str: abstract of the paper
-        taxonerd, TaxoNERD instance: model to use for classification
+        doc, spacy Doc object: doc processed by the TaxoNERD model
+
+    returns:
+        species, list of str: sorted unique species names in the doc
+    """
+    species = {
+        ent.text.replace('\n', ' ')
+        for ent in doc.ents
+        if (ent.label_ == 'LIVB') and ('\n' not in ent.text.strip('\n'))
+    }
+
+    return sorted(species)
+
+
+def get_species_names_batched(to_classify, nlp, batch_size=32, n_process=1):
+    """
+    Gets the species names for many papers at once by streaming their texts
+    through nlp.pipe. Pipeline components that don't contribute to NER are
+    disabled, since they are only needed later for entity linking.
+
+    parameters:
+        to_classify, dict: keys are paper IDs, values are dict with title and
+            abstract
+        nlp, spacy NLP object: TaxoNERD model to use for classification
+        batch_size, int: number of texts to send through the model at once
+        n_process, int: number of processes to use for CPU inference
+
+    returns:
+        paper_spec_names, dict: keys are paper IDs, values are lists of species
+            names
+    """
+    paper_ids = list(to_classify.keys())
+    texts = (get_paper_text(to_classify[paperId]) for paperId in paper_ids)
+    disable = [pipe for pipe in NER_DISABLE if pipe in nlp.pipe_names]
+
+    paper_spec_names = {}
+    with nlp.select_pipes(disable=disable):
+        docs = nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+        for paperId, doc in tqdm(zip(paper_ids, docs), total=len(paper_ids)):
+            paper_spec_names[paperId] = get_doc_species(doc)
+
+    return paper_spec_names
+
+
+def get_ner_namespace(nlp):
+    """
+    Get the NER cache namespace for a model, so that cached species names are
+    only re-used for the same model, version and backend.
+    """
+    namespace = (f'ner:{nlp.meta["lang"]}_{nlp.meta["name"]}-'
+                 f'{nlp.meta["version"]}')
+    if 'ner_backend' in nlp.meta:
+        namespace += f':{nlp.meta["ner_backend"]}'
+    return namespace
+
+
+def get_ner_settings(nlp, prefilter=None):
+    """
+    Get the settings that saved species names depend on, so that they're only
+    re-used for the same model, backend and prefilter.
+    """
+    ner_settings = {'model': get_ner_namespace(nlp)}
+    if prefilter is not None:
+        ner_settings['prefilter'] = hash_json(sorted(prefilter.names))
+    return ner_settings
+
+
+def get_prefilter(generic_dict, common_name_csv=COMMON_NAME_CSV):
+    """
+    Build a prefilter from the crop common names and the generic terms.
+
+    parameters:
+        generic_dict, dict or str: keys are generic terms for kingdoms, values
+            are kingdoms, or empty string to only use the common names
+        common_name_csv, str: path to csv with Common_name and
+            Scientific_name columns
+
+    returns:
+        prefilter, TaxonPrefilter instance: prefilter to skip texts with no
+            organism mentions
+    """
+    names = list(read_common_names(common_name_csv))
+    if generic_dict != '':
+        names.extend(generic_dict)
+
+    return TaxonPrefilter(names)
+
+
+def prefilter_papers(to_classify, prefilter):
+    """
+    Split papers into those with candidate organism mentions, which need NER,
+    and those without, which are skipped.
+
+    parameters:
+        to_classify, dict: keys are paper IDs, values are dict with title and
+            abstract
+        prefilter, TaxonPrefilter instance: prefilter to use
 
     returns:
-        species, list of str: species names in the paper
+        to_run, dict: papers from to_classify to run NER on
+        skipped, set of str: IDs of papers with no candidates
+    """
+    to_run = {}
+    skipped = set()
+    for paperId, paper_dict in to_classify.items():
+        if prefilter.has_candidates(get_paper_text(paper_dict)):
+            to_run[paperId] = paper_dict
+        else:
+            skipped.add(paperId)
+    print(f'The prefilter found no candidate organisms in {len(skipped)} of '
+          f'{len(to_classify)} papers, skipping NER for them.')
+
+    return to_run, skipped
+
+
+def get_species_names_cached(to_classify,
+                             nlp,
+                             cache_path,
+                             batch_size=32,
+                             n_process=1,
+                             update_cache=True,
+                             prefilter=None,
+                             return_skipped=False):
     """
-    # Combine title and abstract
-    if abstract is not None:
-        text = title + ' ' + abstract
+    Get species names, only running NER on titles and abstracts that aren't
+    already in the NER cache. Papers are looked up by the hash of their text,
+    so papers whose abstracts changed are re-run, and identical texts are only
+    run once.
+
+    parameters:
+        to_classify, dict: keys are paper IDs, values are dict with title and
+            abstract
+        nlp, spacy NLP object: TaxoNERD model to use for classification
+        cache_path, str: path to the cache database, pass an empty string to
+            run NER on all papers without a cache
+        batch_size, int: number of texts to send through the model at once
+        n_process, int: number of processes to use for CPU inference
+        update_cache, bool: whether or not to add new results to the cache
+        prefilter, TaxonPrefilter instance or None: prefilter to skip papers
+            that aren't in the cache and have no candidate organisms; skipped
+            papers get an empty list of names and aren't added to the cache
+        return_skipped, bool: whether or not to also return the IDs of the
+            papers skipped by the prefilter
+
+    returns:
+        paper_spec_names, dict: keys are paper IDs, values are lists of species
+            names
+        skipped, set of str: IDs of papers skipped by the prefilter, only
+            returned if return_skipped is True
+    """
+    # Find the texts we've already seen
+    if cache_path != '':
+        ner_cache = ResultCache(cache_path, get_ner_namespace(nlp))
+        text_hashes = {
+            paperId: hash_text(get_paper_text(data))
+            for paperId, data in to_classify.items()
+        }
+        cached = ner_cache.get_many(set(text_hashes.values()))
+        to_run = {
+            paperId: data
+            for paperId, data in to_classify.items()
+            if text_hashes[paperId] not in cached
+        }
     else:
-        text = title
+        cached = {}
+        to_run = to_classify
 
-    # Do TaxoNERD classification
-    ent_df = taxonerd.find_in_text(text)
+    # Only prefilter papers that aren't cached, so cached NER results are kept
+    if prefilter is not None:
+        to_run, skipped = prefilter_papers(to_run, prefilter)
+    else:
+        skipped = set()
+    if cache_path != '':
+        print(f'{len(to_classify) - len(to_run) - len(skipped)} of '
+              f'{len(to_classify)} papers were found in the NER cache, '
+              f'running NER on {len(to_run)}.')
+
+    # Run NER on the rest
+    new_spec_names = get_species_names_batched(to_run, nlp, batch_size,
+                                               n_process)
+    if cache_path != '':
+        if update_cache:
+            ner_cache.put_many({
+                text_hashes[paperId]: spec_names
+                for paperId, spec_names in new_spec_names.items()
+            })
+        ner_cache.close()
+
+    paper_spec_names = {}
+    for paperId in to_classify:
+        if paperId in new_spec_names:
+            paper_spec_names[paperId] = new_spec_names[paperId]
+        elif paperId in skipped:
+            paper_spec_names[paperId] = []
+        else:
+            paper_spec_names[paperId] = cached[text_hashes[paperId]]
 
-    # Get the unique organisms
-    try:
-        species = list(set(ent_df['text']))
-    except KeyError:
-        species = []
+    if return_skipped:
+        return paper_spec_names, skipped
+    return paper_spec_names
+
+
+def get_shard(to_classify, shard_index, num_shards):
+    """
+    Get one contiguous shard of the papers to classify. Shards only depend on
+    the order of to_classify, so separate jobs that read the same dataset
+    produce the same shards.
+
+    parameters:
+        to_classify, dict: keys are paper IDs, values are dict with title and
+            abstract
+        shard_index, int: index of the shard to get, starting at 0
+        num_shards, int: total number of shards
+
+    returns:
+        shard, dict: subset of to_classify
+    """
+    paper_ids = list(to_classify.keys())
+    shard_len = ceil(len(paper_ids) / num_shards)
+    shard_ids = paper_ids[shard_index * shard_len:(shard_index + 1) *
+                          shard_len]
+    shard = {paperId: to_classify[paperId] for paperId in shard_ids}
+
+    return shard
 
-    return species
+
+def get_shard_path(intermediate_save_path, shard_index, num_shards):
+    """
+    Get the path of the paper_to_species part file for a shard.
+    """
+    return (f'{intermediate_save_path}/paper_to_species_shard_'
+            f'{shard_index}_of_{num_shards}.json')
+
+
+def run_ner_shard(shard, shard_index, num_shards, intermediate_save_path,
+                  prefer_gpu, batch_size, cache_path, ner_backend='stock',
+                  prefilter=None, num_threads=None):
+    """
+    Load the TaxoNERD model, get the species names for one shard of papers and
+    save them as a part file. Papers skipped by the prefilter are saved with
+    null instead of a list of names, so that they aren't added to the NER
+    cache. The part file also records the NER settings and the hash of each
+    paper's text, so that it's only re-used for the same model, prefilter and
+    texts. Used both by the worker processes of get_species_names_sharded,
+    and to run a single shard as its own job.
+
+    parameters:
+        shard, dict: keys are paper IDs, values are dict with title and
+            abstract
+        shard_index, int: index of this shard
+        num_shards, int: total number of shards
+        intermediate_save_path, str: directory to save the part file
+        prefer_gpu, bool: whether or not to use a GPU if available
+        batch_size, int: number of texts to pass through the model at once
+        cache_path, str: path to the NER cache database, only read from here
+            so that shards don't write to the database at the same time
+        ner_backend, str: one of NER_BACKENDS
+        prefilter, TaxonPrefilter instance or None: prefilter to skip papers
+            with no candidate organisms
+        num_threads, int or None: number of CPU threads for the model to use,
+            None to keep PyTorch's default
+
+    returns:
+        shard_path, str: path to the saved part file
+    """
+    if num_threads is not None:
+        import torch
+        torch.set_num_threads(num_threads)
+
+    taxonerd = TaxoNERD(prefer_gpu=prefer_gpu)
+    nlp = load_ner_model(taxonerd, NER_MODEL, ner_backend)
+    print(f'Getting species names for shard {shard_index} of {num_shards} '
+          f'({len(shard)} papers)...')
+    paper_spec_names, skipped = get_species_names_cached(shard,
+                                                         nlp,
+                                                         cache_path,
+                                                         batch_size,
+                                                         update_cache=False,
+                                                         prefilter=prefilter,
+                                                         return_skipped=True)
+    for paperId in skipped:
+        paper_spec_names[paperId] = None
+    part = {
+        'settings': get_ner_settings(nlp, prefilter),
+        'text_hashes': {
+            paperId: hash_text(get_paper_text(paper_dict))
+            for paperId, paper_dict in shard.items()
+        },
+        'species': paper_spec_names
+    }
+
+    shard_path = get_shard_path(intermediate_save_path, shard_index,
+                                num_shards)
+    with open(shard_path, 'w') as myf:
+        json.dump(part, myf)
+    print(f'Saved shard {shard_index} paper --> species dict as {shard_path}')
+
+    return shard_path
+
+
+def merge_ner_shards(to_classify, intermediate_save_path, num_shards,
+                     return_skipped=False):
+    """
+    Merge the paper_to_species part files in shard order. Because shards are
+    contiguous slices of to_classify, the merged dict has the same order as
+    to_classify no matter which order the shards finished in.
+
+    parameters:
+        to_classify, dict: keys are paper IDs, values are dict with title and
+            abstract
+        intermediate_save_path, str: directory with the part files
+        num_shards, int: total number of shards
+        return_skipped, bool: whether or not to also return the IDs of the
+            papers the shards skipped with the prefilter
+
+    returns:
+        paper_spec_names, dict: keys are paper IDs, values are lists of species
+            names
+        skipped, set of str: IDs of papers skipped by the prefilter, only
+            returned if return_skipped is True
+    """
+    paper_spec_names = {}
+    for shard_index in range(num_shards):
+        shard_path = get_shard_path(intermediate_save_path, shard_index,
+                                    num_shards)
+        with open(shard_path) as myf:
+            paper_spec_names.update(json.load(myf)['species'])
+    assert set(paper_spec_names.keys()) == set(to_classify.keys()), (
+        'The merged shards do not contain the same papers as the dataset; '
+        'the part files may be from a different dataset or number of shards. '
+        'Please delete them and try again.')
+    skipped = {
+        paperId
+        for paperId, spec_names in paper_spec_names.items()
+        if spec_names is None
+    }
+    for paperId in skipped:
+        paper_spec_names[paperId] = []
+
+    if return_skipped:
+        return paper_spec_names, skipped
+    return paper_spec_names
+
+
+def is_valid_ner_shard(shard, shard_path, ner_settings):
+    """
+    Check whether a part file can be re-used for a shard.
+
+    parameters:
+        shard, dict: keys are paper IDs, values are dict with title and
+            abstract
+        shard_path, str: path to the part file
+        ner_settings, dict: settings NER is being run with, from
+            get_ner_settings
+
+    returns:
+        bool, whether or not the part file exists and was made from the same
+            settings and texts
+    """
+    if not isfile(shard_path):
+        return False
+    with open(shard_path) as myf:
+        part = json.load(myf)
+    # Part files saved before settings were recorded can't be checked
+    if not isinstance(part.get('settings'), dict):
+        return False
+    text_hashes = {
+        paperId: hash_text(get_paper_text(paper_dict))
+        for paperId, paper_dict in shard.items()
+    }
+
+    return (part['settings'] == ner_settings) and (part['text_hashes']
+                                                     == text_hashes)
+
+
+def get_species_names_sharded(to_classify, num_shards, intermediate_save_path,
+                              use_intermed, prefer_gpu, batch_size,
+                              cache_path, ner_settings, ner_backend='stock',
+                              prefilter=None):
+    """
+    Get species names by splitting the papers into shards and running each
+    shard in its own worker process. Each worker loads the TaxoNERD model once
+    and writes its own part file; part files that already exist are re-used if
+    use_intermed is specified and they were made with the same settings and
+    texts, so that shards can also be run as separate jobs with the
+    -shard_index option. Only the results of shards run here are added to the
+    NER cache.
+
+    parameters:
+        to_classify, dict: keys are paper IDs, values are dict with title and
+            abstract
+        num_shards, int: number of shards to split the papers into
+        intermediate_save_path, str: directory to save the part files
+        use_intermed, bool: whether or not to re-use existing part files
+        prefer_gpu, bool: whether or not to use a GPU if available
+        batch_size, int: number of texts to pass through the model at once
+        cache_path, str: path to the NER cache database, or empty string
+        ner_settings, dict: settings NER is being run with, from
+            get_ner_settings
+        ner_backend, str: one of NER_BACKENDS
+        prefilter, TaxonPrefilter instance or None: prefilter to skip papers
+            with no candidate organisms
+
+    returns:
+        paper_spec_names, dict: keys are paper IDs, values are lists of species
+            names
+    """
+    assert intermediate_save_path != '', ('An intermediate_save_path is '
+            'required to save the part files for sharded NER, please try '
+            'again.')
+    to_run = []
+    for shard_index in range(num_shards):
+        shard_path = get_shard_path(intermediate_save_path, shard_index,
+                                    num_shards)
+        if use_intermed and is_valid_ner_shard(
+                get_shard(to_classify, shard_index, num_shards), shard_path,
+                ner_settings):
+            print(f'Re-using shard {shard_index} from {shard_path}')
+        else:
+            to_run.append(shard_index)
+
+    if len(to_run) > 0:
+        print(f'Running NER on {len(to_run)} shards in parallel...')
+        # The workers all run on this machine, so split its CPU threads
+        # between them
+        num_threads = max(1, cpu_count() // len(to_run))
+        # Use fresh processes so that each worker loads its own model
+        with get_context('spawn').Pool(len(to_run)) as pool:
+            _ = pool.starmap(run_ner_shard, [
+                (get_shard(to_classify, shard_index, num_shards), shard_index,
+                 num_shards, intermediate_save_path, prefer_gpu, batch_size,
+                 cache_path, ner_backend, prefilter, num_threads)
+                for shard_index in to_run
+            ])
+        # Workers only read from the cache, so that they don't write to the
+        # database at the same time; papers skipped by the prefilter weren't
+        # run through NER, so they aren't cached
+        if cache_path != '':
+            for shard_index in to_run:
+                shard_path = get_shard_path(intermediate_save_path,
+                                            shard_index, num_shards)
+                with open(shard_path) as myf:
+                    part = json.load(myf)
+                ner_cache = ResultCache(cache_path, part['settings']['model'])
+                ner_cache.put_many({
+                    part['text_hashes'][paperId]: spec_names
+                    for paperId, spec_names in part['species'].items()
+                    if spec_names is not None
+                })
+                ner_cache.close()
+
+    return merge_ner_shards(to_classify, intermediate_save_path, num_shards)
 
 
 def get_unique_papers(search_results, keyname, return_jsonl):
@@ -448,24 +1331,21 @@ def generate_links_without_classification(search_results, keyname):
         nodes, list of two-tuple: the paper ID and an attribute dictionary containing the paper's title
         edges, list of three-tuple: the paper IDs of both citing and cited paper, and an attribute dictionary with the paper's title
     """
-    nodes, edges = [], []
-    i = 0
-    for paper in tqdm(search_results):
-        citing = (paper[keyname], {'title': paper['title']})
-        cited = [(p[keyname], {
-            'title': p['title']
-        }) for p in paper['references'] if p[keyname] is not None]
-        nodes.append(citing)
-        nodes.extend(cited)
-        edges.extend([(citing[0], p[0], num)
-                      for num, p in enumerate(cited, i)])
-        i += len(cited)
+    builder = get_graph_builder(search_results, None, keyname)
+    nodes = builder.get_nodes()
+    edges = list(builder.iter_edges())
     return nodes, edges
 
 
 def generate_classified_dict(search_results, taxonerd, nlp, linker,
                                        intermediate_save_path, use_intermed,
-                                       generic_dict, keyname, return_jsonl):
+                                       generic_dict, keyname, return_jsonl,
+                                       batch_size=32, n_process=1,
+                                       num_shards=1, prefer_gpu=False,
+                                       cache_path='', link_processes=1,
+                                       profiler=None, ner_backend='stock',
+                                       prefilter=None,
+                                       dictionary_matcher=None):
     """
     Generate a list of edges by paper ID from the results of a Semantic Scholar query. Removes malformed
     citations with no paperID, and classifies nodes by the organisms in their titles.
@@ -483,149 +1363,283 @@ def generate_classified_dict(search_results, taxonerd, nlp, linker,
             kingdoms
         keyname, str: whether to use 'paperId' or 'UID' to access paper IDs
         return_jsonl, bool: only get main results to add back to jsonl
+        batch_size, int: number of texts to pass through TaxoNERD at once
+        n_process, int: number of processes to use for TaxoNERD on CPU
+        num_shards, int: number of shards to split NER into, each run in its
+            own worker process, default is 1 (no sharding)
+        prefer_gpu, bool: whether or not sharded NER workers should use a GPU
+        cache_path, str: path to a database of cached results to re-use
+            between runs, pass an empty string to not use a cache
+        link_processes, int: number of processes to use for entity linking
+        profiler, RunProfiler instance or None: profiler to record the stages
+            of classification in
+        ner_backend, str: backend for sharded NER workers to load the model
+            with, should match the backend of nlp
+        prefilter, TaxonPrefilter instance or None: prefilter to skip NER for
+            papers with no candidate organisms
+        dictionary_matcher, DictionaryKingdomMatcher instance or None: matcher
+            for common names and exact generic terms, tried before the fuzzy
+            fallback
 
     returns:
         classified, dict: keys are UID/paperIds, values are classifications
     """
+    if profiler is None:
+        profiler = RunProfiler()
+
     # Make dict of unique papers for classification
     to_classify = get_unique_papers(search_results, keyname, return_jsonl)
-
-    # Start timer
-    start = time.time()
-
-    # Identify entites
-    if use_intermed and ('paper_to_species.json' in
-            listdir(intermediate_save_path)):
-        paper_spec_save_name = f'{intermediate_save_path}/paper_to_species.json'
-        with open(paper_spec_save_name) as myf:
-            paper_spec_names = json.load(myf)
-        print(f'Read in paper to species dict from {paper_spec_save_name}')
-    else:
-        paper_spec_names = {}
-        for paperId, data in tqdm(to_classify.items()):
-            species_names = get_species_names(data['title'], data['abstract'],
-                                              taxonerd)
-            paper_spec_names[paperId] = species_names
-        print(f'Time to get entities from all papers: {time.time() - start: .2f}')
-        if intermediate_save_path != '':
-            paper_spec_save_name = f'{intermediate_save_path}/paper_to_species.json'
-            with open(paper_spec_save_name, 'w') as myf:
-                json.dump(paper_spec_names, myf)
-            print(f'Saved paper --> species dict as {paper_spec_save_name}')
+    manifest = StageManifest(intermediate_save_path)
+
+    # Identify entites, re-using saved results for papers whose text hasn't
+    # changed since they were run through the same model
+    prev_spec_names = load_intermediate(intermediate_save_path, use_intermed,
+                                        'paper_to_species.json')
+    ner_settings = get_ner_settings(nlp, prefilter)
+    text_hashes = {
+        paperId: hash_text(get_paper_text(paper_dict))
+        for paperId, paper_dict in to_classify.items()
+    }
+    valid_papers = manifest.get_valid_keys('paper_to_species', ner_settings,
+                                           text_hashes, prev_spec_names)
+    paper_spec_names = {
+        paperId: prev_spec_names[paperId]
+        for paperId in valid_papers
+    }
+    to_run = {
+        paperId: paper_dict
+        for paperId, paper_dict in to_classify.items()
+        if paperId not in valid_papers
+    }
+    print(f'Re-using entities for {len(valid_papers)} papers, running NER on '
+          f'{len(to_run)}.')
+    with profiler.stage('ner', len(to_run)):
+        if (num_shards > 1) and (len(valid_papers) == 0):
+            paper_spec_names = get_species_names_sharded(
+                to_classify, num_shards, intermediate_save_path, use_intermed,
+                prefer_gpu, batch_size, cache_path, ner_settings, ner_backend,
+                prefilter)
+        elif len(to_run) > 0:
+            # Shards are defined over all papers, so a handful of changed
+            # papers are run in this process instead
+            paper_spec_names.update(
+                get_species_names_cached(to_run, nlp, cache_path, batch_size,
+                                         n_process, True, prefilter))
+    paper_spec_names = {
+        paperId: paper_spec_names[paperId]
+        for paperId in to_classify
+    }
+    if (len(to_run) > 0) or (prev_spec_names is None):
+        save_intermediate(intermediate_save_path, 'paper_to_species.json',
+                          paper_spec_names)
+    manifest.update('paper_to_species', ner_settings, text_hashes)
 
     # Map entities to classifications
-    if use_intermed and ('species_dict.json' in
-            listdir(intermediate_save_path)):
-        species_dict_save_name = f'{intermediate_save_path}/species_dict.json'
-        with open(species_dict_save_name) as myf:
-            species_dict = json.load(myf)
-        print(f'Read in species dict as {species_dict_save_name}')
-    else:
-        start = time.time()
-        species_dict = get_species_classes(paper_spec_names, nlp, linker,
-                intermediate_save_path, use_intermed)
-        if intermediate_save_path != '':
-            species_dict_save_name = f'{intermediate_save_path}/species_dict.json'
-            with open(species_dict_save_name, 'w') as myf:
-                json.dump(species_dict, myf)
-            print(f'Saved species dict as {species_dict_save_name}')
-
-    if use_intermed and ('paper_classifications.json' in
-            listdir(intermediate_save_path)):
-        classified_save_name = f'{intermediate_save_path}/paper_classifications.json'
-        with open(classified_save_name) as myf:
-            classified = json.load(myf)
-        print(f'Read in paper classifications from {classified_save_name}')
+    species_dict = get_species_classes(paper_spec_names, nlp, linker,
+                                       intermediate_save_path, use_intermed,
+                                       cache_path, link_processes, manifest,
+                                       profiler)
+
+    # Only reclassify papers whose entities, entity kingdoms or text changed,
+    # or that fall back on the generic terms if the term map or dictionary
+    # changed
+    prev_classified = load_intermediate(intermediate_save_path, use_intermed,
+                                        'paper_classifications.json')
+    prev_evidence = load_intermediate(intermediate_save_path, use_intermed,
+                                      'paper_evidence.json')
+    if dictionary_matcher is None:
+        generic_hash = hash_json(generic_dict)
     else:
-        classified = map_paper_species(paper_spec_names, species_dict,
-                                   generic_dict, to_classify)
-        if intermediate_save_path != '':
-            classified_save_name = f'{intermediate_save_path}/paper_classifications.json'
-            with open(classified_save_name, 'w') as myf:
-                json.dump(classified, myf)
-            print(f'Saved paper classifications as {classified_save_name}')
-    print(
-        f'Time to get the classification of entities from all papers: {time.time() - start: .2f}'
-    )
+        generic_hash = hash_json(
+            [generic_dict, dictionary_matcher.term_kingdoms])
+    class_hashes = {}
+    for paperId, spec_names in paper_spec_names.items():
+        spec_kings = [species_dict.get(spec) for spec in spec_names]
+        uses_generic = all(king is None for king in spec_kings)
+        class_hashes[paperId] = hash_json([
+            text_hashes[paperId], spec_names, spec_kings,
+            generic_hash if uses_generic else None
+        ])
+    valid_papers = manifest.get_valid_keys('paper_classifications', {},
+                                           class_hashes, prev_classified)
+    # Papers without a saved evidence record, e.g. from a run before evidence
+    # was saved, are reclassified so that every paper has one
+    if prev_evidence is None:
+        prev_evidence = {}
+    valid_papers = {
+        paperId
+        for paperId in valid_papers if paperId in prev_evidence
+    }
+    classified = {
+        paperId: prev_classified[paperId]
+        for paperId in valid_papers
+    }
+    paper_evidence = {
+        paperId: prev_evidence[paperId]
+        for paperId in valid_papers
+    }
+    to_reclassify = {
+        paperId: spec_names
+        for paperId, spec_names in paper_spec_names.items()
+        if paperId not in valid_papers
+    }
+    print(f'Re-using classifications for {len(valid_papers)} papers, '
+          f'classifying {len(to_reclassify)}.')
+    if len(to_reclassify) > 0:
+        # Kingdom votes and the dictionary and generic term fallbacks for
+        # each paper
+        with profiler.stage('paper_classification', len(to_reclassify)):
+            new_classified, new_evidence = map_paper_species(
+                to_reclassify, species_dict, generic_dict, to_classify,
+                dictionary_matcher, True)
+        classified.update(new_classified)
+        paper_evidence.update(new_evidence)
+    classified = {paperId: classified[paperId] for paperId in to_classify}
+    paper_evidence = {
+        paperId: paper_evidence[paperId]
+        for paperId in to_classify if paperId in paper_evidence
+    }
+    if (len(to_reclassify) > 0) or (prev_classified is None):
+        save_intermediate(intermediate_save_path,
+                          'paper_classifications.json', classified)
+    if (len(to_reclassify) > 0) or (paper_evidence != prev_evidence):
+        save_intermediate(intermediate_save_path, 'paper_evidence.json',
+                          paper_evidence)
+    manifest.update('paper_classifications', {}, class_hashes)
 
     return classified
 
 
+def has_uid_and_abstract(paper):
+    """
+    Check whether a paper or reference has a UID and a non-None abstract.
+    """
+    return ('UID' in paper) and (paper.get('abstract') is not None)
+
+
+def get_clean_counts():
+    """
+    Get empty counters for the summary of what was dropped while cleaning.
+    """
+    return {
+        'mains_no_uid': 0,
+        'refs_no_uid': 0,
+        'mains_dropped': set(),
+        'refs_dropped': set(),
+        'isolates': 0
+    }
+
+
+def clean_paper(res, counts=None):
+    """
+    Get rid of a main result without a UID or abstract, and of its references
+    without UIDs or abstracts.
+
+    parameters:
+        res, dict: main result
+        counts, dict or None: counters for the summary of what was dropped,
+            updated in place, None if the paper has already been counted
+
+    returns:
+        clean_res, dict or None: copy of the main result with only the
+            references that have UIDs and abstracts, None if the main result
+            was dropped
+    """
+    if counts is None:
+        counts = get_clean_counts()
+    # Check for a UID
+    if 'UID' not in res:
+        counts['mains_no_uid'] += 1
+        return None
+    # Check for a main result abstract
+    if res.get('abstract') is None:
+        counts['mains_dropped'].add(res['UID'])
+        return None
+    # If it's not None, we can process the references
+    updated_refs = []
+    for ref in res['references']:
+        if 'UID' not in ref:
+            counts['refs_no_uid'] += 1
+        elif ref.get('abstract') is None:
+            counts['refs_dropped'].add(ref['UID'])
+        else:
+            updated_refs.append(ref)
+    clean_res = dict(res)
+    clean_res['references'] = updated_refs
+
+    return clean_res
+
+
+def iter_clean_input_data(search_results, counts):
+    """
+    Yield cleaned main results, dropping isolates. Makes two passes over the
+    search results: one to collect the UIDs of cited papers, and one to clean
+    and yield papers, so search_results can be anything that can be iterated
+    over twice.
+
+    parameters:
+        search_results, iterable of dict: papers
+        counts, dict: counters for the summary of what was dropped, updated
+            in place; see get_clean_counts
+
+    yields:
+        idx, int: position of the main result in search_results
+        clean_res, dict: cleaned main result
+    """
+    # Pass 1: get the papers that are cited by a main result we'll keep
+    is_cited = set()
+    for res in search_results:
+        if has_uid_and_abstract(res):
+            is_cited.update(ref['UID'] for ref in res['references']
+                            if has_uid_and_abstract(ref))
+
+    # Pass 2: clean and drop isolates
+    for idx, res in enumerate(search_results):
+        clean_res = clean_paper(res, counts)
+        if clean_res is None:
+            continue
+        if (clean_res['UID'] not in is_cited) and (len(
+                clean_res['references']) == 0):
+            counts['isolates'] += 1
+            continue
+        yield idx, clean_res
+
+
 def clean_input_data(search_results, keyname):
     """
     Get rid of documents that don't have UIDs or abstracts. If a main
     result paper doens't have an abstract, it and all of its references will be
     removed from the dataset. Papers with no references will also be removed.
+    If search_results is a PaperStore, only the positions of the kept papers
+    are held in memory, and papers are cleaned again as they're read.
 
     parameters:
-        search_results, list of dict: papers
+        search_results, list of dict or PaperStore: papers
         keyname, str: whether to use UID or paperID to get papers
 
     returns:
-        clean_search_results, list of dict: cleaned search results
+        clean_search_results, list of dict or PaperSubset: cleaned search
+            results
     """
-    original_len = len(search_results)
-    clean_search_results = []
-    mains_dropped = []
-    refs_dropped = []
-    mains_no_uid = 0
-    refs_no_uid = 0
-    for res in search_results:
-        # Check for a UID
-        try:
-            uid = res['UID']
-        except KeyError:
-            mains_no_uid += 1
-            continue
-        # Check for a main result abstract
-        try:
-            main_abstract = res['abstract']
-        except KeyError:
-            mains_dropped.append(uid)
-            continue
-        # Check if the abstract is None
-        if main_abstract is None:
-            mains_dropped.append(uid)
-            continue
-        # If it's not None, we can process the references:
-        else:
-            updated_refs = []
-            for ref in res['references']:
-                # Check for a UID
-                try:
-                    uid = ref['UID']
-                except KeyError:
-                    refs_no_uid += 1
-                    continue
-                # Check for an abstract
-                try:
-                    ref_abstract = ref['abstract']
-                except KeyError:
-                    refs_dropped.append(uid)
-                    continue
-                # Check if the abstract is None
-                if ref_abstract is None:
-                    refs_dropped.append(uid)
-                    continue
-                # If it's not, then we can keep the reference
-                else:
-                    updated_refs.append(ref)
-            res['references'] = updated_refs
-            clean_search_results.append(res)
-    # Now, need to drop isolate nodes
-    to_drop = []
-    is_cited = [ref['UID'] for paper in clean_search_results for ref in paper['references']]
-    for paper in clean_search_results:
-        if (paper['UID'] not in is_cited) and (len(paper['references']) == 0):
-            to_drop.append(paper)
-    clean_search_results = [paper for paper in clean_search_results if paper not in to_drop]
-
-    print(f'While processing documents, {mains_no_uid} main documents were '
-    f'dropped because they did not have a UID, and {refs_no_uid} references '
-    f'were lost for the same reason.\n{len(set(mains_dropped))} main results '
-    f'of the original {original_len} documents were dropped because they '
-    f'did not have abstracts, and {len(set(refs_dropped))} references were '
-    f'dropped for not having an abstract. A final {len(to_drop)} documents were '
+    counts = get_clean_counts()
+    if isinstance(search_results, PaperStore):
+        clean_search_results = PaperSubset(
+            search_results,
+            (idx for idx, _ in iter_clean_input_data(search_results, counts)),
+            clean_paper)
+    else:
+        clean_search_results = [
+            clean_res
+            for _, clean_res in iter_clean_input_data(search_results, counts)
+        ]
+
+    print(f'While processing documents, {counts["mains_no_uid"]} main '
+    'documents were dropped because they did not have a UID, and '
+    f'{counts["refs_no_uid"]} references were lost for the same reason.\n'
+    f'{len(counts["mains_dropped"])} main results of the original '
+    f'{len(search_results)} documents were dropped because they did not have '
+    f'abstracts, and {len(counts["refs_dropped"])} references were dropped '
+    f'for not having an abstract. A final {counts["isolates"]} documents were '
     'dropped because after cleaning they had 0 references or citations.')
 
     print(f'There were {len(search_results)} main results in the original '
@@ -635,14 +1649,18 @@ def clean_input_data(search_results, keyname):
 
 def main(search_result_path, output_save_path, intermediate_save_path,
         use_intermed, generic_dict, prefer_gpu, skip_classification,
-        return_jsonl):
+        return_jsonl, batch_size, n_process, num_shards, shard_index,
+        cache_path, link_processes, paper_store, profile_report,
+        profile_dir, ner_backend, ner_prefilter, common_name_csv,
+        dictionary_match):
+
+    profiler = RunProfiler(profile_dir)
 
     # Read in search results and clean
     print('\nLoading citation data...')
-    with jsonlines.open(search_result_path) as reader:
-        search_results = []
-        for obj in reader:
-            search_results.append(obj)
+    with profiler.stage('load') as record:
+        search_results = load_papers(search_result_path, paper_store)
+        record['items'] = len(search_results)
     # Determine which key to use for IDs
     try:
         search_results[0]['paperId']
@@ -650,59 +1668,100 @@ def main(search_result_path, output_save_path, intermediate_save_path,
     except KeyError:
         keyname = 'UID'
     print('\nCleaning input data...')
-    search_results = clean_input_data(search_results, keyname)
+    with profiler.stage('clean') as record:
+        search_results = clean_input_data(search_results, keyname)
+        record['items'] = len(search_results)
+
+    # Build the prefilter to skip NER on texts without organism mentions
+    if ner_prefilter and not skip_classification:
+        prefilter = get_prefilter(generic_dict, common_name_csv)
+    else:
+        prefilter = None
+
+    # Run a single NER shard as its own job if requested
+    if shard_index is not None:
+        print(f'\nRunning NER for shard {shard_index} of {num_shards}...')
+        to_classify = get_unique_papers(search_results, keyname, return_jsonl)
+        shard = get_shard(to_classify, shard_index, num_shards)
+        with profiler.stage('ner', len(shard)):
+            _ = run_ner_shard(shard, shard_index, num_shards,
+                              intermediate_save_path, prefer_gpu, batch_size,
+                              cache_path, ner_backend, prefilter)
+        if profile_report != '':
+            profiler.save(profile_report)
+        print('\nDone!')
+        return
 
     # Define TaxoNERD model for classification
     if not skip_classification:
         print('\nLoading TaxoNERD model...')
-        start = time.time()
-        taxonerd = TaxoNERD(prefer_gpu=prefer_gpu)
-        nlp = taxonerd.load(model="en_core_eco_biobert")
-        print(f'Time to load model: {time.time() - start: .2f}')
-        print('\nLoading entity linker...')
-        start = time.time()
-        linker = EntityLinker(linker_name='ncbi_taxonomy',
-                              resolve_abbreviations=False)
-        print(f'Time to load linker: {time.time() - start: .2f}')
+        with profiler.stage('load_ner_model'):
+            taxonerd = TaxoNERD(prefer_gpu=prefer_gpu)
+            nlp = load_ner_model(taxonerd, NER_MODEL, ner_backend)
+        # Linking workers load their own linker
+        if link_processes > 1:
+            linker = None
+        else:
+            print('\nLoading entity linker...')
+            with profiler.stage('load_linker'):
+                linker = EntityLinker(linker_name=LINKER_NAME,
+                                      resolve_abbreviations=False)
+        if dictionary_match:
+            print('\nBuilding common name dictionary...')
+            with profiler.stage('load_dictionary'):
+                dictionary_matcher = get_dictionary_matcher(
+                    common_name_csv, generic_dict, cache_path)
+        else:
+            dictionary_matcher = None
 
     # Get classifications and/or network
     if not skip_classification:
         print('\nClassifying papers...')
         classified = generate_classified_dict(
             search_results, taxonerd, nlp, linker, intermediate_save_path,
-            use_intermed, generic_dict, keyname, return_jsonl)
+            use_intermed, generic_dict, keyname, return_jsonl, batch_size,
+            n_process, num_shards, prefer_gpu, cache_path, link_processes,
+            profiler, ner_backend, prefilter, dictionary_matcher)
         # Map the classifications back to requested data structure and save
         if not return_jsonl:
             print('\nBuilding graph...')
-            citenet = build_graph(search_results, classified, keyname)
+            with profiler.stage('graph_build') as record:
+                builder = get_graph_builder(search_results, classified,
+                                            keyname)
+                record['items'] = len(builder.src)
             # Save graph
             print('\nSaving graph...')
-            nx.write_graphml(citenet, output_save_path)
+            with profiler.stage('save', len(builder.src)):
+                builder.save(output_save_path)
             print(f'Graph saved to {output_save_path}')
         else:
-            print('\nMapping classifications back to jsonl...')
-            for res in search_results:
-                res['study_system'] = classified[res[keyname]]
-            print('\nSaving results...')
-            with jsonlines.open(output_save_path, 'w') as writer:
-                writer.write_all(search_results)
+            # Papers from a store are read as they're written, so map the
+            # classifications back while saving
+            print('\nMapping classifications back to jsonl and saving...')
+            with profiler.stage('save', len(search_results)):
+                with jsonlines.open(output_save_path, 'w') as writer:
+                    for res in search_results:
+                        res['study_system'] = classified[res[keyname]]
+                        writer.write(res)
             print(f'Results saved to {output_save_path}')
     else:
         if not return_jsonl:
             print('\nFormatting citation network without classification...')
-            nodes, edges = generate_links_without_classification(search_results,
-                    keyname)
-            citenet = nx.MultiDiGraph()
-            _ = citenet.add_nodes_from(nodes)
-            _ = citenet.add_edges_from(edges)
+            with profiler.stage('graph_build') as record:
+                builder = get_graph_builder(search_results, None, keyname)
+                record['items'] = len(builder.src)
             # Save graph
             print('\nSaving graph...')
-            nx.write_graphml(citenet, output_save_path)
+            with profiler.stage('save', len(builder.src)):
+                builder.save(output_save_path)
             print(f'Graph saved to {output_save_path}')
         else:
             assert not return_jsonl, ('Cannot return a citation network '
                     'if return_jsonl is specified, please try again.')
 
+    if profile_report != '':
+        profiler.save(profile_report)
+
     print('\nDone!')
 
 
@@ -716,8 +1775,9 @@ if __name__ == '__main__':
                         help='Output from pull_papers.py')
     parser.add_argument('output_save_path',
                         type=str,
-                        help='Path to save graph, extension is .graphml if '
-                        'a graph is requested, .jsonl if --return_jsonl '
+                        help='Path to save graph, extension is .graphml or '
+                        '.npz (faster to read and write for large networks) '
+                        'if a graph is requested, .jsonl if --return_jsonl '
                         'is specified.')
     parser.add_argument('-intermediate_save_path', type=str, default='',
                         help='Path to directory to save intermediate results, '
@@ -728,6 +1788,70 @@ if __name__ == '__main__':
                         default='',
                         help='Path to dictionary mapping general terms to '
                         'life kingdoms, to be used for fuzzy mapping')
+    parser.add_argument('-batch_size', type=int, default=32,
+                        help='Number of titles/abstracts to pass through '
+                        'TaxoNERD at once')
+    parser.add_argument('-n_process', type=int, default=1,
+                        help='Number of processes to use for TaxoNERD '
+                        'inference, only use values above 1 on CPU')
+    parser.add_argument('-link_processes', type=int, default=1,
+                        help='Number of processes to use for entity linking. '
+                        'Each process loads its own copy of the linker')
+    parser.add_argument('-cache_path', type=str, default='',
+                        help='Path to a SQLite database used to cache NER '
+                        'results by the content of each title and abstract, '
+                        'so they can be re-used between runs and datasets. '
+                        'Created if it doesn\'t exist')
+    parser.add_argument('-paper_store', type=str, default='',
+                        help='Path to a SQLite database to store the search '
+                        'results in, so they are read from disk as needed '
+                        'instead of all being loaded into memory. Built from '
+                        'search_result_path if it doesn\'t exist or is out of '
+                        'date')
+    parser.add_argument('-profile_report', type=str, default='',
+                        help='Path to save a JSON report of the wall time, '
+                        'CPU time, peak memory and number of items for each '
+                        'stage of the run')
+    parser.add_argument('-profile_dir', type=str, default='',
+                        help='Directory to save a cProfile dump of each stage '
+                        'in, for detailed profiling')
+    parser.add_argument('-num_shards', type=int, default=1,
+                        help='Number of shards to split NER into. Each shard '
+                        'is run in its own process and saved as a part file '
+                        'in intermediate_save_path')
+    parser.add_argument('-shard_index', type=int, default=None,
+                        help='Only run NER for the shard with this index '
+                        '(0 to num_shards - 1) and save its part file, so '
+                        'that shards can be run as separate jobs. Re-run '
+                        'with the same -num_shards and --use_intermed to '
+                        'merge the shards and finish classification')
+    parser.add_argument('-ner_backend', type=str, default='stock',
+                        choices=NER_BACKENDS,
+                        help='Backend for the TaxoNERD model. "quantized" '
+                        'uses int8 weights for the transformer, which is '
+                        'faster on CPU but can find slightly different '
+                        'entities; check it against "stock" on a sample of '
+                        'your data with check_ner_parity.py first. NER '
+                        'results are cached separately for each backend')
+    parser.add_argument('-common_name_csv', type=str,
+                        default=COMMON_NAME_CSV,
+                        help='Path to csv with Common_name and '
+                        'Scientific_name columns of crop names, used by '
+                        '--ner_prefilter and --dictionary_match. Default is '
+                        'maps/ag_plant_common_names.csv')
+    parser.add_argument('--dictionary_match', action='store_true',
+                        help='Label papers with no species that map to a '
+                        'kingdom by exact matches for the common names in '
+                        '-common_name_csv and the terms in -generic_dict, '
+                        'before falling back on fuzzy matching')
+    parser.add_argument('--ner_prefilter', action='store_true',
+                        help='Skip NER for titles/abstracts without an '
+                        'abbreviated binomial, a capitalised word that is a '
+                        'scientific name in NCBI Taxonomy, a crop common '
+                        'name from -common_name_csv or a term from '
+                        '-generic_dict. Papers mentioning organisms '
+                        'only by other common names are missed; check the '
+                        'recall loss with check_ner_parity.py --prefilter')
     parser.add_argument('--prefer_gpu',
                         action='store_true',
                         help='Whether or not GPU is available to use')
@@ -746,19 +1870,42 @@ if __name__ == '__main__':
     args.output_save_path = abspath(args.output_save_path)
     if args.intermediate_save_path != '':
         args.intermediate_save_path = abspath(args.intermediate_save_path)
+    if args.cache_path != '':
+        args.cache_path = abspath(args.cache_path)
+    if args.paper_store != '':
+        args.paper_store = abspath(args.paper_store)
+    if args.profile_report != '':
+        args.profile_report = abspath(args.profile_report)
+    if args.profile_dir != '':
+        args.profile_dir = abspath(args.profile_dir)
+    args.common_name_csv = abspath(args.common_name_csv)
+    generic_dict = ''
     if args.generic_dict != '':
         args.generic_dict = abspath(args.generic_dict)
         with open(args.generic_dict) as myf:
             generic_dict = json.load(myf)
+    if args.ner_backend == 'quantized':
+        assert not args.prefer_gpu, ('The quantized backend only runs on CPU, '
+                'please try again.')
+    if args.shard_index is not None:
+        assert 0 <= args.shard_index < args.num_shards, ('shard_index must be '
+                'between 0 and num_shards - 1, please try again.')
+        assert args.intermediate_save_path != '', ('An '
+                'intermediate_save_path is required to save shard part files, '
+                'please try again.')
     if args.return_jsonl:
         assert splitext(args.output_save_path)[1] == '.jsonl', (
                 'Extension for output_save_path must be .jsonl if '
                 '--return_jsonl is specified, please try again.')
     else:
-        assert splitext(args.output_save_path)[1] == '.graphml', (
-                'Extension for output_save_path must be .graphml if '
+        assert splitext(args.output_save_path)[1] in NETWORK_EXTENSIONS, (
+                'Extension for output_save_path must be .graphml or .npz if '
                 '--return_jsonl is not specified, please try again.')
 
     main(args.search_result_path, args.output_save_path,
             args.intermediate_save_path, args.use_intermed, generic_dict,
-         args.prefer_gpu, args.skip_classification, args.return_jsonl)
+         args.prefer_gpu, args.skip_classification, args.return_jsonl,
+         args.batch_size, args.n_process, args.num_shards, args.shard_index,
+         args.cache_path, args.link_processes, args.paper_store,
+         args.profile_report, args.profile_dir, args.ner_backend,
+         args.ner_prefilter, args.common_name_csv, args.dictionary_match)
@@ -6,8 +6,8 @@ Author: Serena G. Lotreck
 """
 import argparse
 from os.path import abspath
-import jsonlines
-import networkx as nx
+from network_io import read_network
+from paper_store import load_papers
 import matplotlib.pyplot as plt
 plt.rcParams['pdf.fonttype'] = 42
 from collections import Counter, defaultdict
@@ -310,15 +310,12 @@ def flatten_papers(papers, keyname):
     return flattened_papers
 
 
-def main(jsonl, graphml, search_term, out_loc, out_prefix):
+def main(jsonl, graphml, search_term, out_loc, out_prefix, paper_store=''):
 
     # Read in the data
     print('\nReading in data...')
-    with jsonlines.open(jsonl) as reader:
-        pulled_papers = []
-        for obj in reader:
-            pulled_papers.append(obj)
-    classified_graph = nx.read_graphml(graphml)
+    pulled_papers = load_papers(jsonl, paper_store)
+    classified_graph = read_network(graphml)
     try:
         pulled_papers[0]['paperId']
         keyname = 'paperId'
@@ -385,7 +382,7 @@ if __name__ == "__main__":
         'graphml',
         type=str,
         help='Path to output of classify_papers.py that took the jsonl arg '
-        'as input')
+        'as input, .graphml or .npz')
     parser.add_argument('search_term',
                         type=str,
                         help='String to use in chart titles')
@@ -393,12 +390,21 @@ if __name__ == "__main__":
     parser.add_argument('out_prefix',
                         type=str,
                         help='String to prepend to output file names')
+    parser.add_argument('-paper_store',
+                        type=str,
+                        default='',
+                        help='Path to a SQLite database to store the jsonl '
+                        'dataset in, so papers are read from disk as needed '
+                        'instead of all being loaded into memory. Built from '
+                        'the jsonl if it doesn\'t exist or is out of date')
 
     args = parser.parse_args()
 
     args.jsonl = abspath(args.jsonl)
     args.graphml = abspath(args.graphml)
     args.out_loc = abspath(args.out_loc)
+    if args.paper_store != '':
+        args.paper_store = abspath(args.paper_store)
 
     main(args.jsonl, args.graphml, args.search_term, args.out_loc,
-         args.out_prefix)
+         args.out_prefix, args.paper_store)
@@ -0,0 +1,155 @@
+"""
+Accumulates the nodes and edges of a citation network without repeating
+nodes for every citation, and builds the network once at the end.
+
+Author: Serena G. Lotreck
+"""
+from array import array
+from os.path import splitext
+import resource
+import sys
+import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+from network_io import write_network, write_network_arrays
+
+
+class CitationGraphBuilder():
+    """
+    Class to build a citation network from citing papers and their
+    references.
+
+    Each paper is stored once in a node table that maps its ID to an integer
+    index; edges are stored as two integer arrays of source and target
+    indices. If a paper is added more than once, its attributes are updated
+    the same way as adding it repeatedly to a networkx graph.
+    """
+    def __init__(self):
+        """
+        Initialize CitationGraphBuilder instance.
+        """
+        self.node_index = {}
+        self.node_ids = []
+        self.node_attrs = []
+        self.src = array('q')
+        self.dst = array('q')
+
+    def add_node(self, node_id, attrs):
+        """
+        Add a paper to the node table, or update its attributes.
+
+        parameters:
+            node_id, str: paper ID
+            attrs, dict: node attributes
+
+        returns:
+            idx, int: index of the node
+        """
+        idx = self.node_index.get(node_id)
+        if idx is None:
+            idx = len(self.node_ids)
+            self.node_index[node_id] = idx
+            self.node_ids.append(node_id)
+            self.node_attrs.append(dict(attrs))
+        else:
+            self.node_attrs[idx].update(attrs)
+
+        return idx
+
+    def add_paper(self, node_id, attrs, refs):
+        """
+        Add a citing paper, its references, and an edge to each reference.
+
+        parameters:
+            node_id, str: ID of the citing paper
+            attrs, dict: attributes of the citing paper
+            refs, list of tuple: (ID, attributes) for each reference
+        """
+        citing = self.add_node(node_id, attrs)
+        for ref_id, ref_attrs in refs:
+            cited = self.add_node(ref_id, ref_attrs)
+            self.src.append(citing)
+            self.dst.append(cited)
+
+    def get_nodes(self):
+        """
+        Get nodes in the format taken by networkx's add_nodes_from.
+
+        returns:
+            nodes, list of two-tuple: paper ID and attribute dictionary
+        """
+        return list(zip(self.node_ids, self.node_attrs))
+
+    def iter_edges(self):
+        """
+        Yield edges in the format taken by networkx's add_edges_from. Edge
+        keys are the order the edges were added in.
+
+        yields:
+            edge, three-tuple: citing paper ID, cited paper ID, edge key
+        """
+        for key, (s, d) in enumerate(zip(self.src, self.dst)):
+            yield (self.node_ids[s], self.node_ids[d], key)
+
+    def to_networkx(self):
+        """
+        Build the citation network.
+
+        returns:
+            citenet, MultiDiGraph: citation network
+        """
+        citenet = nx.MultiDiGraph()
+        _ = citenet.add_nodes_from(self.get_nodes())
+        _ = citenet.add_edges_from(self.iter_edges())
+
+        return citenet
+
+    def to_sparse(self):
+        """
+        Build the citation network as a sparse adjacency matrix, where entry
+        (i, j) is the number of times paper i cites paper j.
+
+        returns:
+            adjacency, scipy csr_matrix: adjacency matrix
+            node_ids, list of str: paper ID for each row and column
+        """
+        num_nodes = len(self.node_ids)
+        adjacency = csr_matrix(
+            (np.ones(len(self.src), dtype=np.int32),
+             (np.frombuffer(self.src, dtype=np.int64),
+              np.frombuffer(self.dst, dtype=np.int64))),
+            shape=(num_nodes, num_nodes))
+
+        return adjacency, list(self.node_ids)
+
+    def save(self, path):
+        """
+        Save the citation network. Networks saved as .npz are written straight
+        from the node table and edge arrays, without building a networkx
+        graph.
+
+        parameters:
+            path, str: path to save the network, .graphml or .npz
+        """
+        if splitext(path)[1] == '.npz':
+            write_network_arrays(path, self.node_ids, self.node_attrs,
+                                 self.src, self.dst)
+        else:
+            write_network(self.to_networkx(), path)
+
+    def report_memory(self):
+        """
+        Print the size of the node table and edge arrays, and the peak memory
+        use of the process so far.
+        """
+        edge_bytes = (self.src.itemsize * len(self.src) +
+                      self.dst.itemsize * len(self.dst))
+        table_bytes = (sys.getsizeof(self.node_index) +
+                       sys.getsizeof(self.node_ids) +
+                       sys.getsizeof(self.node_attrs))
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f'Citation network has {len(self.node_ids)} unique nodes and '
+              f'{len(self.src)} edges. The node table takes '
+              f'{table_bytes / 1024**2:.2f} MB (not counting attributes), '
+              f'the edge arrays take {edge_bytes / 1024**2:.2f} MB, and peak '
+              f'memory use so far is {peak_mb:.2f} MB.')
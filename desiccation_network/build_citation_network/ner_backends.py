@@ -0,0 +1,120 @@
+"""
+CPU-optimised backends for the TaxoNERD NER model.
+
+The "quantized" backend applies int8 dynamic quantisation to the linear
+layers of the model's transformer, which makes CPU inference faster and
+uses less memory at the cost of small differences in the predicted
+entities. Use check_ner_parity.py to measure those differences on a sample
+of your own data before relying on it.
+
+Author: Serena G. Lotreck
+"""
+from collections import Counter
+import torch
+from thinc.shims import PyTorchShim
+
+NER_BACKENDS = ('stock', 'quantized')
+
+
+def quantize_thinc_model(model):
+    """
+    Replace the PyTorch modules wrapped by a thinc model with int8 dynamically
+    quantised copies, in place.
+
+    parameters:
+        model, thinc Model: model to quantise
+
+    returns:
+        num_quantized, int: number of PyTorch modules that were quantised
+    """
+    num_quantized = 0
+    for node in model.walk():
+        for shim in node.shims:
+            if isinstance(shim, PyTorchShim):
+                shim._model = torch.ao.quantization.quantize_dynamic(
+                    shim._model, {torch.nn.Linear}, dtype=torch.qint8)
+                num_quantized += 1
+
+    return num_quantized
+
+
+def quantize_transformer(nlp):
+    """
+    Quantise the transformer of a spaCy pipeline for CPU inference, in place.
+    The backend is recorded in nlp.meta, so that cached NER results from the
+    quantised model aren't mixed with those from the stock model.
+
+    parameters:
+        nlp, spacy NLP object: pipeline with a transformer component
+    """
+    assert 'transformer' in nlp.pipe_names, ('The quantized backend needs a '
+            'model with a transformer component, please try again.')
+    num_quantized = quantize_thinc_model(nlp.get_pipe('transformer').model)
+    assert num_quantized > 0, ('No PyTorch modules were found in the '
+            'transformer component, please try again.')
+    nlp.meta['ner_backend'] = 'quantized'
+
+
+def load_ner_model(taxonerd, model, backend='stock'):
+    """
+    Load a TaxoNERD model with the given backend.
+
+    parameters:
+        taxonerd, TaxoNERD instance: TaxoNERD to load the model with
+        model, str: name of the model to load
+        backend, str: one of NER_BACKENDS
+
+    returns:
+        nlp, spacy NLP object: loaded model
+    """
+    assert backend in NER_BACKENDS, (f'backend must be one of {NER_BACKENDS}, '
+                                     'please try again.')
+    nlp = taxonerd.load(model=model)
+    if backend == 'quantized':
+        quantize_transformer(nlp)
+
+    return nlp
+
+
+def compare_ner_outputs(reference, predicted):
+    """
+    Compare the species names found by two NER models on the same papers.
+    Names are compared as multisets per paper, so a name found twice by one
+    model and once by the other counts as one match.
+
+    parameters:
+        reference, dict: keys are paper IDs, values are lists of species
+            names from the reference (stock) model
+        predicted, dict: keys are paper IDs, values are lists of species
+            names from the model being checked
+
+    returns:
+        metrics, dict: precision, recall and F1 of the predicted names
+            against the reference names, and the proportion of papers where
+            both models found exactly the same names
+    """
+    num_match = num_ref = num_pred = num_same = 0
+    for paperId, ref_names in reference.items():
+        ref_counts = Counter(ref_names)
+        pred_counts = Counter(predicted[paperId])
+        num_match += sum((ref_counts & pred_counts).values())
+        num_ref += sum(ref_counts.values())
+        num_pred += sum(pred_counts.values())
+        num_same += ref_counts == pred_counts
+
+    precision = num_match / num_pred if num_pred > 0 else 1.0
+    recall = num_match / num_ref if num_ref > 0 else 1.0
+    f1 = (2 * precision * recall / (precision + recall) if
+          (precision + recall) > 0 else 0.0)
+    metrics = {
+        'num_papers': len(reference),
+        'num_reference_names': num_ref,
+        'num_predicted_names': num_pred,
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'identical_papers': num_same / len(reference) if len(reference) > 0
+        else 1.0
+    }
+
+    return metrics
@@ -0,0 +1,230 @@
+"""
+Reads and writes citation networks. Networks can be saved as GraphML, for
+visualization in Gephi or Cytoscape, or in a compact .npz format that is much
+faster to read and write for large networks. The format is chosen from the
+file extension.
+
+The .npz format stores the node IDs and each node attribute as columns, and
+the edges as two arrays of integer node indices, in the order the edges were
+added. String columns are stored as one UTF-8 encoded blob with byte offsets,
+and columns with missing values have a mask of which nodes have the
+attribute.
+
+Running this script converts a network between the two formats, e.g. to
+export a .npz network to GraphML:
+
+    python network_io.py classified_citation_network.npz classified_citation_network.graphml
+
+Author: Serena G. Lotreck
+"""
+import argparse
+from os.path import abspath, splitext
+import numpy as np
+import networkx as nx
+
+NETWORK_EXTENSIONS = ('.graphml', '.npz')
+
+
+def encode_strings(strings):
+    """
+    Encode a list of strings as one UTF-8 blob and byte offsets.
+
+    parameters:
+        strings, list of str: strings to encode
+
+    returns:
+        blob, numpy array of uint8: concatenated UTF-8 bytes
+        offsets, numpy array of int64: start of each string in the blob, plus
+            the end of the last string
+    """
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+    return blob, offsets
+
+
+def decode_strings(blob, offsets):
+    """
+    Decode strings encoded with encode_strings.
+
+    parameters:
+        blob, numpy array of uint8: concatenated UTF-8 bytes
+        offsets, numpy array of int64: start of each string in the blob, plus
+            the end of the last string
+
+    returns:
+        strings, list of str: decoded strings
+    """
+    blob = blob.tobytes()
+    offsets = offsets.tolist()
+    strings = [
+        blob[start:end].decode('utf-8')
+        for start, end in zip(offsets, offsets[1:])
+    ]
+
+    return strings
+
+
+def write_network_arrays(path, node_ids, node_attrs, src, dst):
+    """
+    Write a network in .npz format.
+
+    parameters:
+        path, str: path to save the network
+        node_ids, list of str: node IDs
+        node_attrs, list of dict: attributes of each node
+        src, array-like of int: index of the source node of each edge
+        dst, array-like of int: index of the target node of each edge
+    """
+    arrays = {}
+    arrays['node_ids_blob'], arrays['node_ids_offsets'] = encode_strings(
+        [str(n) for n in node_ids])
+    arrays['src'] = np.asarray(src, dtype=np.int64)
+    arrays['dst'] = np.asarray(dst, dtype=np.int64)
+
+    attr_names = sorted(set(name for attrs in node_attrs for name in attrs))
+    for name in attr_names:
+        mask = np.array([name in attrs for attrs in node_attrs], dtype=bool)
+        values = [attrs[name] for attrs in node_attrs if name in attrs]
+        if all(isinstance(v, str) for v in values):
+            col = [attrs.get(name, '') for attrs in node_attrs]
+            arrays[f'attr_str_{name}_blob'], arrays[
+                f'attr_str_{name}_offsets'] = encode_strings(col)
+        else:
+            col = [attrs.get(name, 0) for attrs in node_attrs]
+            arrays[f'attr_num_{name}'] = np.asarray(col)
+        if not mask.all():
+            arrays[f'mask_{name}'] = mask
+
+    np.savez_compressed(path, **arrays)
+
+
+def read_network_arrays(path):
+    """
+    Read a network saved in .npz format without building a networkx graph.
+
+    parameters:
+        path, str: path to the saved network
+
+    returns:
+        node_ids, list of str: node IDs
+        node_attrs, dict: keys are attribute names, values are lists with the
+            value of the attribute for each node, None for nodes without it
+        src, numpy array of int64: index of the source node of each edge
+        dst, numpy array of int64: index of the target node of each edge
+    """
+    with np.load(path) as arrays:
+        node_ids = decode_strings(arrays['node_ids_blob'],
+                                  arrays['node_ids_offsets'])
+        node_attrs = {}
+        for key in arrays.files:
+            if key.startswith('attr_str_') and key.endswith('_blob'):
+                name = key[len('attr_str_'):-len('_blob')]
+                node_attrs[name] = decode_strings(
+                    arrays[key], arrays[f'attr_str_{name}_offsets'])
+            elif key.startswith('attr_num_'):
+                name = key[len('attr_num_'):]
+                node_attrs[name] = arrays[key].tolist()
+        for name, col in node_attrs.items():
+            if f'mask_{name}' in arrays.files:
+                mask = arrays[f'mask_{name}']
+                node_attrs[name] = [
+                    v if has_attr else None for v, has_attr in zip(col, mask)
+                ]
+        src = arrays['src']
+        dst = arrays['dst']
+
+    return node_ids, node_attrs, src, dst
+
+
+def read_network(path):
+    """
+    Read a citation network saved as GraphML or .npz.
+
+    parameters:
+        path, str: path to the saved network
+
+    returns:
+        graph, MultiDiGraph: citation network
+    """
+    ext = splitext(path)[1]
+    assert ext in NETWORK_EXTENSIONS, ('Network file extension must be one of '
+            f'{NETWORK_EXTENSIONS}, please try again.')
+    if ext == '.graphml':
+        return nx.read_graphml(path)
+
+    node_ids, node_attrs, src, dst = read_network_arrays(path)
+    nodes = []
+    for i, node_id in enumerate(node_ids):
+        attrs = {
+            name: col[i]
+            for name, col in node_attrs.items() if col[i] is not None
+        }
+        nodes.append((node_id, attrs))
+    graph = nx.MultiDiGraph()
+    _ = graph.add_nodes_from(nodes)
+    _ = graph.add_edges_from(
+        (node_ids[s], node_ids[d], key)
+        for key, (s, d) in enumerate(zip(src.tolist(), dst.tolist())))
+
+    return graph
+
+
+def write_network(graph, path):
+    """
+    Write a citation network as GraphML or .npz.
+
+    parameters:
+        graph, networkx graph: citation network
+        path, str: path to save the network
+    """
+    ext = splitext(path)[1]
+    assert ext in NETWORK_EXTENSIONS, ('Network file extension must be one of '
+            f'{NETWORK_EXTENSIONS}, please try again.')
+    if ext == '.graphml':
+        nx.write_graphml(graph, path)
+        return
+
+    node_ids = list(graph.nodes)
+    index = {node: i for i, node in enumerate(node_ids)}
+    node_attrs = [attrs for _, attrs in graph.nodes(data=True)]
+    edges = list(graph.edges())
+    src = [index[u] for u, _ in edges]
+    dst = [index[v] for _, v in edges]
+    write_network_arrays(path, node_ids, node_attrs, src, dst)
+
+
+def main(input_path, output_path):
+
+    print('\nReading network...')
+    graph = read_network(input_path)
+
+    print('\nSaving network...')
+    write_network(graph, output_path)
+    print(f'Network saved to {output_path}')
+
+    print('\nDone!')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Convert a citation network between GraphML and .npz')
+
+    parser.add_argument('input_path',
+                        type=str,
+                        help='Path to the network to convert, .graphml or '
+                        '.npz')
+    parser.add_argument('output_path',
+                        type=str,
+                        help='Path to save the converted network, .graphml '
+                        'or .npz')
+
+    args = parser.parse_args()
+
+    args.input_path = abspath(args.input_path)
+    args.output_path = abspath(args.output_path)
+
+    main(args.input_path, args.output_path)
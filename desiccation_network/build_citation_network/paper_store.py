@@ -0,0 +1,267 @@
+"""
+On-disk store for a jsonl dataset of papers, so that large datasets don't
+have to be held in memory as a list of dicts.
+
+Papers are stored in a SQLite database with one row per paper, indexed by
+position and by UID (or paperId). Each row holds the full paper as JSON,
+plus the title, abstract and authors in their own columns, so they can be
+iterated over without parsing every paper. A PaperStore can be used in place
+of the list of papers read from a jsonl file: it supports len, indexing and
+iteration, and papers are only parsed when they're accessed. A PaperSubset
+does the same for a subset of the papers in a store, e.g. the papers kept
+after cleaning, holding only their positions in memory.
+
+Author: Serena G. Lotreck
+"""
+from array import array
+from collections.abc import Sequence
+from os import stat
+from os.path import abspath, isfile
+import sqlite3
+import json
+import jsonlines
+
+
+class PaperStore(Sequence):
+    """
+    Class for lazy, read-only access to a dataset of papers saved in SQLite.
+
+    Each access returns a new dict parsed from the database, so changes to a
+    paper aren't saved back to the store.
+    """
+    # Number of papers to insert or fetch at once
+    batch_size = 1000
+
+    def __init__(self, store_path):
+        """
+        Initialize PaperStore instance.
+
+        parameters:
+            store_path, str: path to a database created with from_jsonl
+        """
+        assert isfile(store_path), (f'No paper store found at {store_path}, '
+                                    'please try again.')
+        self.store_path = store_path
+        self.conn = sqlite3.connect(store_path)
+        self.num_papers = self.conn.execute(
+            'SELECT COUNT(*) FROM papers').fetchone()[0]
+
+    @staticmethod
+    def get_source_info(jsonl_path):
+        """
+        Get the path, size and modification time of a jsonl file, to check
+        whether a store is up to date.
+        """
+        info = stat(jsonl_path)
+        return json.dumps([abspath(jsonl_path), info.st_size, info.st_mtime_ns])
+
+    @classmethod
+    def from_jsonl(cls, jsonl_path, store_path):
+        """
+        Open a store of a jsonl file, building it first if it doesn't exist
+        or was built from a different version of the file. The file is read
+        in one streaming pass.
+
+        parameters:
+            jsonl_path, str: path to the jsonl dataset
+            store_path, str: path to the SQLite database
+
+        returns:
+            store, PaperStore: store of the dataset
+        """
+        source_info = cls.get_source_info(jsonl_path)
+        conn = sqlite3.connect(store_path)
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, '
+                     'value TEXT)')
+        built_from = conn.execute(
+            "SELECT value FROM meta WHERE key = 'source'").fetchone()
+        if built_from is not None and built_from[0] == source_info:
+            conn.close()
+            return cls(store_path)
+
+        print(f'Building paper store for {jsonl_path}...')
+        conn.execute('DROP TABLE IF EXISTS papers')
+        conn.execute('CREATE TABLE papers (idx INTEGER PRIMARY KEY, uid TEXT, '
+                     'title TEXT, abstract TEXT, authors TEXT, paper TEXT)')
+        rows = []
+        with jsonlines.open(jsonl_path) as reader:
+            for idx, paper in enumerate(reader):
+                rows.append(
+                    (idx, paper.get('UID', paper.get('paperId')),
+                     paper.get('title'), paper.get('abstract'),
+                     json.dumps(paper.get('authors')), json.dumps(paper)))
+                if len(rows) == cls.batch_size:
+                    conn.executemany(
+                        'INSERT INTO papers VALUES (?, ?, ?, ?, ?, ?)', rows)
+                    rows = []
+        conn.executemany('INSERT INTO papers VALUES (?, ?, ?, ?, ?, ?)', rows)
+        conn.execute('CREATE INDEX IF NOT EXISTS uid_index ON papers (uid)')
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('source', ?)",
+                     [source_info])
+        conn.commit()
+        conn.close()
+
+        return cls(store_path)
+
+    def __len__(self):
+        return self.num_papers
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self.num_papers))]
+        if idx < 0:
+            idx += self.num_papers
+        if not 0 <= idx < self.num_papers:
+            raise IndexError('PaperStore index out of range')
+        row = self.conn.execute('SELECT paper FROM papers WHERE idx = ?',
+                                [idx]).fetchone()
+        return json.loads(row[0])
+
+    def iter_column(self, column):
+        """
+        Iterate over one column of the store in paper order.
+
+        parameters:
+            column, str: one of 'uid', 'title', 'abstract', 'authors' or
+                'paper'
+
+        yields:
+            value, str or None: value of the column for each paper
+        """
+        assert column in ['uid', 'title', 'abstract', 'authors', 'paper'], (
+            f'{column} is not a column of the paper store, please try again.')
+        cursor = self.conn.execute(f'SELECT {column} FROM papers ORDER BY idx')
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if len(rows) == 0:
+                return
+            for row in rows:
+                yield row[0]
+
+    def __iter__(self):
+        for paper in self.iter_column('paper'):
+            yield json.loads(paper)
+
+    def get(self, uid, default=None):
+        """
+        Get a paper by its UID.
+
+        parameters:
+            uid, str: UID or paperId of the paper
+            default: value to return if the paper isn't in the store
+
+        returns:
+            paper, dict: the paper
+        """
+        row = self.conn.execute(
+            'SELECT paper FROM papers WHERE uid = ? ORDER BY idx LIMIT 1',
+            [uid]).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def iter_uids(self):
+        """
+        Iterate over the UIDs of the papers.
+        """
+        return self.iter_column('uid')
+
+    def iter_titles(self):
+        """
+        Iterate over the titles of the papers, None if a paper has no title.
+        """
+        return self.iter_column('title')
+
+    def iter_abstracts(self):
+        """
+        Iterate over the abstracts of the papers, None if a paper has no
+        abstract.
+        """
+        return self.iter_column('abstract')
+
+    def iter_authors(self):
+        """
+        Iterate over the author lists of the papers, None if a paper has no
+        authors.
+        """
+        for authors in self.iter_column('authors'):
+            yield json.loads(authors)
+
+    def close(self):
+        """
+        Close the connection to the database.
+        """
+        self.conn.close()
+
+
+class PaperSubset(Sequence):
+    """
+    Class for lazy, read-only access to a subset of the papers in a
+    PaperStore, in store order. Only the positions of the papers are held in
+    memory; papers are read from the store and transformed when they're
+    accessed.
+    """
+    def __init__(self, store, indices, transform=None):
+        """
+        Initialize PaperSubset instance.
+
+        parameters:
+            store, PaperStore: store to read the papers from
+            indices, iterable of int: positions of the papers in the store, in
+                increasing order
+            transform, function or None: function to apply to each paper when
+                it's read
+        """
+        self.store = store
+        self.indices = array('q', indices)
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.indices)
+
+    def get_paper(self, paper):
+        """
+        Apply the transform to a paper read from the store.
+        """
+        if self.transform is None:
+            return paper
+        return self.transform(paper)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return self.get_paper(self.store[self.indices[idx]])
+
+    def __iter__(self):
+        # Stream through the store once rather than looking up each paper
+        keep = iter(self.indices)
+        next_idx = next(keep, None)
+        for idx, paper in enumerate(self.store.iter_column('paper')):
+            if next_idx is None:
+                return
+            if idx == next_idx:
+                yield self.get_paper(json.loads(paper))
+                next_idx = next(keep, None)
+
+
+def load_papers(jsonl_path, store_path=''):
+    """
+    Load a jsonl dataset of papers, either into memory or as a PaperStore.
+
+    parameters:
+        jsonl_path, str: path to the jsonl dataset
+        store_path, str: path to a PaperStore database to build or re-use, or
+            empty string to read the papers into a list
+
+    returns:
+        papers, list of dict or PaperStore: papers
+    """
+    if store_path != '':
+        return PaperStore.from_jsonl(jsonl_path, store_path)
+
+    with jsonlines.open(jsonl_path) as reader:
+        papers = []
+        for obj in reader:
+            papers.append(obj)
+
+    return papers
@@ -0,0 +1,111 @@
+"""
+Persistent cache for intermediate classification results, shared between
+runs and datasets. Results are stored in a SQLite database, and are
+separated into namespaces that should include the name and version of
+whatever produced them, so that changing a model or database doesn't return
+stale results.
+
+Author: Serena G. Lotreck
+"""
+import sqlite3
+import json
+import hashlib
+
+
+def hash_text(text):
+    """
+    Get a content hash for a string.
+
+    parameters:
+        text, str: text to hash
+
+    returns:
+        text_hash, str: hex digest of the SHA-256 hash of the text
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def hash_json(obj):
+    """
+    Get a content hash for a JSON-serializable object. Dict keys are sorted,
+    so dicts with the same items have the same hash.
+
+    parameters:
+        obj, JSON-serializable object: object to hash
+
+    returns:
+        obj_hash, str: hex digest of the SHA-256 hash of the object's JSON
+    """
+    return hash_text(json.dumps(obj, sort_keys=True))
+
+
+class ResultCache():
+    """
+    Key-value store for JSON-serializable results in one namespace of a
+    SQLite database.
+    """
+    # SQLite limits the number of variables in a single query
+    query_chunk_size = 500
+
+    def __init__(self, cache_path, namespace):
+        """
+        parameters:
+            cache_path, str: path to the SQLite database, created if it
+                doesn't exist
+            namespace, str: namespace for this cache's results
+        """
+        self.cache_path = cache_path
+        self.namespace = namespace
+        self.conn = sqlite3.connect(cache_path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS results (namespace '
+                          'TEXT, key TEXT, value TEXT, PRIMARY KEY '
+                          '(namespace, key))')
+        self.conn.commit()
+
+    def get_many(self, keys):
+        """
+        Get the cached results for a collection of keys.
+
+        parameters:
+            keys, iterable of str: keys to look up
+
+        returns:
+            found, dict: keys are the keys that were in the cache, values are
+                their results
+        """
+        keys = list(keys)
+        found = {}
+        for i in range(0, len(keys), self.query_chunk_size):
+            chunk = keys[i:i + self.query_chunk_size]
+            placeholders = ', '.join(['?'] * len(chunk))
+            rows = self.conn.execute(
+                'SELECT key, value FROM results WHERE namespace = ? AND key '
+                f'IN ({placeholders})', [self.namespace] + chunk)
+            for key, value in rows:
+                found[key] = json.loads(value)
+
+        return found
+
+    def put_many(self, results):
+        """
+        Add or replace results in the cache.
+
+        parameters:
+            results, dict: keys are keys, values are JSON-serializable results
+        """
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO results (namespace, key, value) VALUES '
+            '(?, ?, ?)', [(self.namespace, key, json.dumps(value))
+                          for key, value in results.items()])
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute(
+            'SELECT COUNT(*) FROM results WHERE namespace = ?',
+            [self.namespace]).fetchone()[0]
+
+    def close(self):
+        """
+        Close the connection to the database.
+        """
+        self.conn.close()
@@ -0,0 +1,184 @@
+"""
+Records how long each stage of a run takes and how much memory it uses, and
+saves them as a JSON report.
+
+Author: Serena G. Lotreck
+"""
+from contextlib import contextmanager
+from os import makedirs
+from os.path import join
+import cProfile
+import json
+import resource
+import time
+
+# Linux files to reset and read the peak resident memory of this process
+CLEAR_REFS_PATH = '/proc/self/clear_refs'
+STATUS_PATH = '/proc/self/status'
+
+
+class RunProfiler():
+    """
+    Class to time the stages of a run.
+
+    For each stage, records wall time, CPU time (of this process and any
+    child processes that finished during the stage), peak resident memory,
+    and the number of items processed. On Linux, the peak memory of the
+    process is reset at the start of each stage, so it's the peak during the
+    stage; elsewhere it's the peak of the process so far, as recorded in
+    peak_rss_scope. Memory used by child processes is recorded separately as
+    the peak of the largest child process that finished during the stage, if
+    it was larger than any child that finished before it. Optionally saves
+    a cProfile dump per stage, which can be read with pstats or snakeviz;
+    only one profiler can run at a time, so stages shouldn't be nested when
+    profiling.
+    """
+    def __init__(self, profile_dir=''):
+        """
+        Initialize RunProfiler instance.
+
+        parameters:
+            profile_dir, str: directory to save a cProfile dump for each stage
+                in, created if it doesn't exist, or empty string to not
+                profile
+        """
+        self.profile_dir = profile_dir
+        if profile_dir != '':
+            makedirs(profile_dir, exist_ok=True)
+        self.stages = []
+        self.start_time = time.perf_counter()
+        # Peak memory of the run and of each open stage, since resetting the
+        # peak for a stage also resets it for the run and enclosing stages
+        self.run_peak_rss_mb = 0.0
+        self.open_peaks = []
+
+    @staticmethod
+    def get_cpu_time():
+        """
+        Get the CPU time used so far by this process and its finished child
+        processes.
+        """
+        usages = [
+            resource.getrusage(resource.RUSAGE_SELF),
+            resource.getrusage(resource.RUSAGE_CHILDREN)
+        ]
+        return sum(u.ru_utime + u.ru_stime for u in usages)
+
+    @staticmethod
+    def reset_peak_rss():
+        """
+        Reset the peak resident memory of this process to its current
+        resident memory, where supported.
+
+        returns:
+            bool, whether or not the peak was reset
+        """
+        try:
+            with open(CLEAR_REFS_PATH, 'w') as myf:
+                myf.write('5')
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def get_peak_rss_mb():
+        """
+        Get the peak resident memory of this process since it was last reset,
+        in MB.
+        """
+        try:
+            with open(STATUS_PATH) as myf:
+                for line in myf:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    @staticmethod
+    def get_peak_child_rss_mb():
+        """
+        Get the peak resident memory of the largest finished child process,
+        in MB.
+        """
+        return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    def update_peaks(self, peak_rss_mb):
+        """
+        Fold a peak memory measurement into the run and the innermost open
+        stage, before the peak is reset.
+        """
+        self.run_peak_rss_mb = max(self.run_peak_rss_mb, peak_rss_mb)
+        if len(self.open_peaks) > 0:
+            self.open_peaks[-1] = max(self.open_peaks[-1], peak_rss_mb)
+
+    @contextmanager
+    def stage(self, name, items=None):
+        """
+        Time the code run inside a with block as one stage. The number of
+        items can be given up front, or set on the yielded record if it's only
+        known once the stage has run.
+
+        parameters:
+            name, str: name of the stage
+            items, int or None: number of items processed in the stage
+
+        yields:
+            record, dict: record for this stage
+        """
+        record = {'name': name, 'items': items}
+        if self.profile_dir != '':
+            profile = cProfile.Profile()
+            profile.enable()
+        self.update_peaks(self.get_peak_rss_mb())
+        is_reset = self.reset_peak_rss()
+        self.open_peaks.append(0.0)
+        start_child_rss = self.get_peak_child_rss_mb()
+        start_wall = time.perf_counter()
+        start_cpu = self.get_cpu_time()
+        try:
+            yield record
+        finally:
+            record['wall_time'] = time.perf_counter() - start_wall
+            record['cpu_time'] = self.get_cpu_time() - start_cpu
+            record['peak_rss_mb'] = max(self.get_peak_rss_mb(),
+                                        self.open_peaks.pop())
+            record['peak_rss_scope'] = 'stage' if is_reset else 'process'
+            self.update_peaks(record['peak_rss_mb'])
+            end_child_rss = self.get_peak_child_rss_mb()
+            record['peak_child_rss_mb'] = (end_child_rss if end_child_rss
+                                           > start_child_rss else None)
+            if self.profile_dir != '':
+                profile.disable()
+                record['profile_path'] = join(
+                    self.profile_dir, f'{len(self.stages)}_{name}.prof')
+                profile.dump_stats(record['profile_path'])
+            self.stages.append(record)
+            print(f'Time for {name}: {record["wall_time"]: .2f}')
+
+    def get_report(self):
+        """
+        Get the run report.
+
+        returns:
+            report, dict: total wall time, peak memory of this process and of
+                its largest finished child process, and a list of stage
+                records, in the order the stages finished
+        """
+        return {
+            'total_wall_time': time.perf_counter() - self.start_time,
+            'peak_rss_mb': max(self.run_peak_rss_mb, self.get_peak_rss_mb()),
+            'peak_child_rss_mb': self.get_peak_child_rss_mb(),
+            'stages': self.stages
+        }
+
+    def save(self, report_path):
+        """
+        Save the run report as JSON.
+
+        parameters:
+            report_path, str: path to save the report
+        """
+        with open(report_path, 'w') as myf:
+            json.dump(self.get_report(), myf, indent=4)
+        print(f'Run report saved to {report_path}')
@@ -0,0 +1,89 @@
+"""
+Tracks the inputs that each saved intermediate classification result was
+computed from, so that re-runs only recompute the results whose inputs have
+changed.
+
+Author: Serena G. Lotreck
+"""
+import json
+from os.path import isfile
+
+
+class StageManifest():
+    """
+    Class to store the settings and per-item input hashes for each stage of
+    classification, saved as stage_manifest.json next to the intermediate
+    results.
+
+    Each stage's record has "settings", which invalidate all of the stage's
+    results when they change (e.g. a model version), and "items", which map
+    each key in the stage's results (a paper ID or species name) to a hash of
+    the inputs that key's result was computed from.
+    """
+    file_name = 'stage_manifest.json'
+
+    def __init__(self, intermediate_save_path):
+        """
+        Initialize StageManifest instance, reading the saved manifest if
+        there is one.
+
+        parameters:
+            intermediate_save_path, str: path to the directory of intermediate
+                results, or empty string to not save the manifest
+        """
+        if intermediate_save_path != '':
+            self.path = f'{intermediate_save_path}/{self.file_name}'
+        else:
+            self.path = ''
+        if self.path != '' and isfile(self.path):
+            with open(self.path) as myf:
+                self.stages = json.load(myf)
+        else:
+            self.stages = {}
+
+    def get_valid_keys(self, stage, settings, item_hashes, prev_results):
+        """
+        Get the keys whose saved results were computed from the same inputs.
+
+        parameters:
+            stage, str: name of the stage
+            settings, dict: settings the stage is being run with
+            item_hashes, dict: keys are the keys to compute results for,
+                values are hashes of their inputs
+            prev_results, dict or None: saved results for the stage, None if
+                there aren't any
+
+        returns:
+            valid_keys, set: keys whose saved results can be re-used
+        """
+        if prev_results is None:
+            return set()
+        record = self.stages.get(stage)
+        if record is None:
+            # Results saved before stages were tracked; trust them as before
+            return set(prev_results.keys()) & set(item_hashes.keys())
+        if record['settings'] != settings:
+            return set()
+        valid_keys = {
+            key
+            for key, item_hash in item_hashes.items()
+            if record['items'].get(key) == item_hash
+        }
+
+        return valid_keys
+
+    def update(self, stage, settings, item_hashes):
+        """
+        Record the inputs a stage's results were computed from and save the
+        manifest.
+
+        parameters:
+            stage, str: name of the stage
+            settings, dict: settings the stage was run with
+            item_hashes, dict: keys are the keys in the stage's results,
+                values are hashes of their inputs
+        """
+        self.stages[stage] = {'settings': settings, 'items': item_hashes}
+        if self.path != '':
+            with open(self.path, 'w') as myf:
+                json.dump(self.stages, myf)
@@ -0,0 +1,241 @@
+"""
+Resolves NCBI Taxonomy IDs to the kingdoms used to classify papers.
+
+Author: Serena G. Lotreck
+"""
+from collections import OrderedDict
+import taxoniq
+import ncbi_taxon_db
+from result_cache import ResultCache
+
+# Outcomes for tax IDs that can't be mapped to a kingdom of interest
+NOT_TRACKED = 'NOT_TRACKED'
+NO_SUB_EUKARYOTA = 'NO_SUB_EUKARYOTA'
+NOT_FOUND = 'NOT_FOUND'
+EMPTY_LINEAGE = 'EMPTY_LINEAGE'
+OTHER_DOMAIN = 'OTHER_DOMAIN'
+
+
+def get_taxonomy_version():
+    """
+    Get a string identifying the version of taxoniq and its NCBI Taxonomy
+    database, to namespace cached results.
+    """
+    return (f'taxoniq-{taxoniq.__version__}-ncbi_taxon_db-'
+            f'{ncbi_taxon_db.db_timestamp}')
+
+
+def lookup_scientific_names(names, cache_path=''):
+    """
+    Get NCBI Taxonomy IDs for names that are exact scientific names in
+    taxoniq's copy of the taxonomy. Each unique name is looked up once, and
+    lookups (including misses) are cached if a cache path is given.
+
+    parameters:
+        names, iterable of str: names to look up
+        cache_path, str: path to a ResultCache database, or empty string to
+            not use a cache
+
+    returns:
+        tax_ids, dict: keys are the unique names, values are tax IDs, or None
+            for names that aren't in the taxonomy
+    """
+    uniq_names = list(dict.fromkeys(names))
+    if cache_path != '':
+        cache = ResultCache(cache_path,
+                            f'scientific_names:{get_taxonomy_version()}')
+        tax_ids = cache.get_many(uniq_names)
+    else:
+        tax_ids = {}
+
+    new_ids = {}
+    for name in uniq_names:
+        if name in tax_ids:
+            continue
+        try:
+            new_ids[name] = taxoniq.Taxon(scientific_name=name).tax_id
+        except KeyError:
+            new_ids[name] = None
+    tax_ids.update(new_ids)
+
+    if cache_path != '':
+        cache.put_many(new_ids)
+        cache.close()
+
+    return {name: tax_ids[name] for name in uniq_names}
+
+
+class KingdomResolver():
+    """
+    Class to map NCBI Taxonomy IDs to kingdoms, memoising the kingdom of every
+    taxon it passes through.
+
+    Lineages are walked bottom-up, and the walk stops as soon as it reaches an
+    ancestor whose kingdom is already known, so species that share a genus or
+    family only walk up to the first shared ancestor. Memoised outcomes are
+    kept in an LRU in memory, and optionally in a ResultCache on disk so that
+    they can be re-used between runs.
+    """
+    defs = {
+        'Metazoa': 'Animal',
+        'Viridiplantae': 'Plant',  # Consider adding algae
+        'Bacteria': 'Microbe',
+        'Archea': 'Microbe',
+        'Fungi': 'Fungi'
+    }
+
+    def __init__(self, cache_path='', max_size=100000):
+        """
+        Initialize KingdomResolver instance.
+
+        parameters:
+            cache_path, str: path to a ResultCache database to persist
+                outcomes to, or empty string to only memoise in memory
+            max_size, int: maximum number of tax IDs to keep in memory
+        """
+        self.max_size = max_size
+        self.memo = OrderedDict()
+        self.new_outcomes = {}
+        if cache_path != '':
+            self.cache = ResultCache(cache_path, self.get_namespace())
+        else:
+            self.cache = None
+
+    @staticmethod
+    def get_namespace():
+        """
+        Get the cache namespace, so that outcomes are recomputed when the
+        taxonomy database is updated.
+        """
+        return f'kingdoms:{get_taxonomy_version()}'
+
+    def remember(self, tax_id, outcome):
+        """
+        Add an outcome to the in-memory LRU, and mark it to be persisted.
+
+        parameters:
+            tax_id, int: NCBI Taxonomy ID
+            outcome, str: kingdom, or one of the failure outcomes
+        """
+        self.memo[tax_id] = outcome
+        self.memo.move_to_end(tax_id)
+        if len(self.memo) > self.max_size:
+            self.memo.popitem(last=False)
+        self.new_outcomes[tax_id] = outcome
+
+    def classify_ranked_lineage(self, ranked):
+        """
+        Get the kingdom for a ranked lineage, following the rules in
+        classify_papers.map_specs_to_kings.
+
+        parameters:
+            ranked, list of Taxon: ranked lineage, from the taxon to the root
+
+        returns:
+            outcome, str: kingdom, or one of the failure outcomes
+            anchor, Taxon or None: ranked ancestor that determines the
+                kingdom, only returned for kingdoms of interest
+        """
+        if len(ranked) == 0:
+            return EMPTY_LINEAGE, None
+        top = ranked[-1].scientific_name
+        if top in ('Bacteria', 'Archea'):
+            return self.defs[top], ranked[-1]
+        elif top == 'Eukaryota':
+            if len(ranked) < 2:
+                return NO_SUB_EUKARYOTA, None
+            king = ranked[-2].scientific_name
+            if king in self.defs:
+                return self.defs[king], ranked[-2]
+            return NOT_TRACKED, None
+        return OTHER_DOMAIN, None
+
+    def resolve(self, tax_id):
+        """
+        Get the kingdom for one tax ID.
+
+        parameters:
+            tax_id, int or str: NCBI Taxonomy ID
+
+        returns:
+            outcome, str: kingdom, or one of the failure outcomes
+        """
+        tax_id = int(tax_id)
+        if tax_id in self.memo:
+            self.memo.move_to_end(tax_id)
+            return self.memo[tax_id]
+        try:
+            taxon = taxoniq.Taxon(tax_id)
+        except KeyError:
+            self.remember(tax_id, NOT_FOUND)
+            return NOT_FOUND
+
+        # Walk up until we hit the root or an ancestor with a known kingdom
+        path = []
+        outcome = None
+        while True:
+            known = self.memo.get(taxon.tax_id)
+            if known in self.defs.values():
+                outcome = known
+                break
+            path.append(taxon)
+            if taxon.tax_id == 1:
+                break
+            taxon = taxon.parent
+
+        if outcome is not None:
+            # Everything on the path is below an ancestor with this kingdom
+            for t in path:
+                self.remember(t.tax_id, outcome)
+            return outcome
+
+        ranked = [t for t in path if t.rank in taxoniq.Taxon.common_ranks]
+        outcome, anchor = self.classify_ranked_lineage(ranked)
+        if anchor is None:
+            # Ancestors can have a different outcome, only keep this ID
+            self.remember(tax_id, outcome)
+        else:
+            # Ancestors up to and including the anchor share the kingdom
+            for t in path:
+                self.remember(t.tax_id, outcome)
+                if t.tax_id == anchor.tax_id:
+                    break
+
+        return outcome
+
+    def resolve_many(self, tax_ids):
+        """
+        Get the kingdoms for a collection of tax IDs, resolving each unique ID
+        once.
+
+        parameters:
+            tax_ids, iterable of int or str: NCBI Taxonomy IDs
+
+        returns:
+            outcomes, dict: keys are the unique tax IDs as int, values are
+                kingdoms or failure outcomes
+        """
+        uniq_ids = list(dict.fromkeys(int(t) for t in tax_ids))
+
+        # Load anything we've resolved on a previous run
+        if self.cache is not None:
+            to_load = [str(t) for t in uniq_ids if t not in self.memo]
+            for tax_id, outcome in self.cache.get_many(to_load).items():
+                self.memo[int(tax_id)] = outcome
+                if len(self.memo) > self.max_size:
+                    self.memo.popitem(last=False)
+
+        outcomes = {tax_id: self.resolve(tax_id) for tax_id in uniq_ids}
+        self.save()
+
+        return outcomes
+
+    def save(self):
+        """
+        Persist outcomes resolved since the last save to the cache.
+        """
+        if self.cache is not None and len(self.new_outcomes) > 0:
+            self.cache.put_many(
+                {str(t): o
+                 for t, o in self.new_outcomes.items()})
+        self.new_outcomes = {}
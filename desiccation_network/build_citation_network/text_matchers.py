@@ -0,0 +1,370 @@
+"""
+Matchers to find kingdom-specific terms in the titles and abstracts of papers.
+
+Author: Serena G. Lotreck
+"""
+from collections import deque
+import csv
+import regex
+import taxoniq
+
+# Parenthetical notes in the common names csv that qualify a name rather than
+# giving another name for the same crop
+COMMON_NAME_QUALIFIERS = ('all ', 'except ', 'mixed ', 'hybrid', 'sweet')
+# Common names that are more often ordinary words in the literature than crops
+AMBIGUOUS_COMMON_NAMES = ('rose', 'lime', 'orange', 'rubber', 'dates', 'fig',
+                          'hop', 'mace', 'nut', 'timothy', 'indigo', 'opium',
+                          'quinine', 'prune', 'squash', 'swede', 'rhea', 'edo',
+                          'palm')
+
+
+def split_common_name(entry):
+    """
+    Get the names in one entry of the common names csv. Entries look like
+    "Corn (maize), for cereals" or "Satsuma (mandarin/tangerine)": the name
+    is the part before the first comma, with any "for ..." or "of ..."
+    description removed, and parentheses give other names unless they
+    qualify the name, as in "(all varieties)" or "(red, white, Savoy)".
+
+    parameters:
+        entry, str: common name entry
+
+    returns:
+        names, list of str: casefolded names
+    """
+    head, _, paren = entry.partition('(')
+    paren = paren.split(')')[0]
+    candidates = regex.split(r'\s+\p{Pd}\s+', head.split(',')[0])
+    if (',' not in paren) and not paren.casefold().startswith(
+            COMMON_NAME_QUALIFIERS):
+        candidates.extend(paren.split('/'))
+    names = []
+    for name in candidates:
+        name = regex.sub(r'\s+(for|of)\s.*$', '', name)
+        name = ' '.join(name.casefold().split())
+        if (name != '') and (name not in names):
+            names.append(name)
+
+    return names
+
+
+def read_common_names(csv_path):
+    """
+    Read a csv of crop common names and scientific names, such as
+    maps/ag_plant_common_names.csv. The csv is read as Windows-1252, which is
+    the encoding of the file that ships with this project.
+
+    parameters:
+        csv_path, str: path to csv with Common_name and Scientific_name
+            columns
+
+    returns:
+        common_names, dict: keys are casefolded common names, values are
+            scientific names
+    """
+    common_names = {}
+    with open(csv_path, encoding='cp1252', newline='') as myf:
+        reader = csv.DictReader(myf)
+        for row in reader:
+            for name in split_common_name(row['Common_name']):
+                common_names.setdefault(name, row['Scientific_name'])
+
+    return common_names
+
+
+def get_name_forms(name):
+    """
+    Get the casefolded singular and plural forms of a name, pluralising the
+    last word.
+
+    parameters:
+        name, str: name
+
+    returns:
+        forms, set of str: forms of the name
+    """
+    name = ' '.join(name.casefold().split())
+    forms = {name, name + 's', name + 'es'}
+    if name.endswith('y'):
+        forms.add(name[:-1] + 'ies')
+
+    return forms
+
+
+class TaxonPrefilter():
+    """
+    Class to cheaply check whether a text could mention an organism, so that
+    texts that can't are skipped by NER.
+
+    A text is a candidate if it has an abbreviated binomial (e.g. "E. coli"),
+    a binomial that is a scientific name in NCBI Taxonomy (e.g. "Arabidopsis
+    thaliana"), a genus in NCBI Taxonomy followed by "sp." or "spp.", or a
+    common or generic name. Capitalised words on their own aren't looked up,
+    because many ordinary words that start sentences ("This", "Data",
+    "Major") are also genera. Taxonomy lookups are remembered, so each name
+    is only looked up once. Organisms mentioned only by common names that
+    aren't in the list, or only by a genus or higher taxon, are missed, so
+    the recall loss should be checked against full NER with
+    check_ner_parity.py.
+    """
+    abbrev_pattern = regex.compile(r'\b\p{Lu}\.\s?\p{Ll}{3,}\b')
+    binomial_pattern = regex.compile(r'\b\p{Lu}\p{Ll}{2,}\s+\p{Ll}{3,}\b')
+    genus_sp_pattern = regex.compile(r'\b(\p{Lu}\p{Ll}{2,})\s+spp?\.')
+    word_pattern = regex.compile(r'\p{L}+')
+
+    def __init__(self, names):
+        """
+        Initialize TaxonPrefilter instance.
+
+        parameters:
+            names, iterable of str: common and generic names of organisms
+        """
+        self.names = set()
+        for name in names:
+            self.names.update(get_name_forms(name))
+        self.max_words = max((len(name.split()) for name in self.names),
+                             default=1)
+        self.scientific_names = {}
+
+    def is_scientific_name(self, name, rank=None):
+        """
+        Check whether a name is a scientific name in NCBI Taxonomy.
+
+        parameters:
+            name, str: name to check
+            rank, str or None: if given, the name also has to have this rank,
+                e.g. "genus"
+
+        returns:
+            bool, whether or not the name is a scientific name
+        """
+        if name not in self.scientific_names:
+            try:
+                taxon = taxoniq.Taxon(scientific_name=name)
+                self.scientific_names[name] = taxon.rank.name
+            except KeyError:
+                self.scientific_names[name] = None
+        name_rank = self.scientific_names[name]
+
+        return (name_rank is not None) and (rank is None or name_rank == rank)
+
+    def has_candidates(self, text):
+        """
+        Check whether a text has any candidate organism mentions.
+
+        parameters:
+            text, str: text to check
+
+        returns:
+            bool, whether or not the text should be passed to NER
+        """
+        if self.abbrev_pattern.search(text) is not None:
+            return True
+        words = self.word_pattern.findall(text.casefold())
+        for num_words in range(1, self.max_words + 1):
+            for i in range(len(words) - num_words + 1):
+                if ' '.join(words[i:i + num_words]) in self.names:
+                    return True
+        for genus in set(self.genus_sp_pattern.findall(text)):
+            if self.is_scientific_name(genus, 'genus'):
+                return True
+        binomials = {
+            ' '.join(binomial.split())
+            for binomial in self.binomial_pattern.findall(text, overlapped=True)
+        }
+        for binomial in binomials:
+            if self.is_scientific_name(binomial):
+                return True
+
+        return False
+
+
+class FuzzyKingdomMatcher():
+    """
+    Class to find fuzzy matches for generic kingdom terms in text.
+
+    Each term is allowed len(term)//3 errors. Rather than running the fuzzy
+    regex for every term on every text, each term is split into
+    len(term)//3 + 1 pieces; a match with at most len(term)//3 errors has to
+    contain at least one of those pieces exactly, so only terms with a piece
+    in the text are checked with their fuzzy regex.
+    """
+    def __init__(self, generic_dict):
+        """
+        Precompile the regex and exact pieces for each term.
+
+        parameters:
+            generic_dict, dict: keys are generic terms, values are kingdom
+                names
+        """
+        self.generic_dict = generic_dict
+        self.patterns = {}
+        self.pieces = {}
+        for term in generic_dict:
+            sub_len = len(term) // 3
+            spacejoined = r"\s+".join(term.split())
+            self.patterns[term] = regex.compile(
+                fr'\b({spacejoined}){{e<={sub_len}}}\b', regex.IGNORECASE)
+            self.pieces[term] = self.split_term(term, sub_len + 1)
+
+    @staticmethod
+    def split_term(term, num_pieces):
+        """
+        Split a term into contiguous, non-overlapping pieces of roughly equal
+        length. Whitespace is collapsed to one space, as it is in the texts
+        that are searched.
+
+        parameters:
+            term, str: term to split
+            num_pieces, int: number of pieces
+
+        returns:
+            pieces, list of str: casefolded pieces of the term
+        """
+        norm_term = ' '.join(term.casefold().split())
+        bounds = [
+            round(i * len(norm_term) / num_pieces)
+            for i in range(num_pieces + 1)
+        ]
+        pieces = [
+            norm_term[start:end] for start, end in zip(bounds, bounds[1:])
+        ]
+
+        return pieces
+
+    def find_terms(self, text):
+        """
+        Find the generic terms with a fuzzy match in the text.
+
+        parameters:
+            text, str: text to search
+
+        returns:
+            terms, list of str: matched terms, in the order of generic_dict
+        """
+        norm_text = ' '.join(regex.split(r'\s+', text.casefold()))
+        terms = []
+        for term in self.generic_dict:
+            if not any(piece in norm_text for piece in self.pieces[term]):
+                continue
+            if self.patterns[term].search(text) is not None:
+                terms.append(term)
+
+        return terms
+
+    def match(self, text):
+        """
+        Find the kingdoms of all generic terms with a fuzzy match in the text.
+
+        parameters:
+            text, str: text to search
+
+        returns:
+            classes, list of str: kingdoms identified, one per matched term,
+                in the order of generic_dict
+        """
+        return [self.generic_dict[term] for term in self.find_terms(text)]
+
+
+class DictionaryKingdomMatcher():
+    """
+    Class to find exact, whole-word matches for organism names in text.
+
+    All forms of all names are put in one Aho-Corasick automaton, so a text is
+    searched for every name in a single scan, however many names there are.
+    Matching is case-insensitive, and any run of whitespace in the text
+    matches a single space in a name.
+    """
+    def __init__(self, term_kingdoms):
+        """
+        Build the automaton.
+
+        parameters:
+            term_kingdoms, dict: keys are names, values are kingdom names
+        """
+        self.term_kingdoms = dict(term_kingdoms)
+        # Trie transitions, failure links, and the (length, term) of the
+        # names ending at each state
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for term in self.term_kingdoms:
+            for form in get_name_forms(term):
+                self.add_name(form, term)
+        self.build_failure_links()
+
+    def add_name(self, name, term):
+        """
+        Add one form of a term to the trie.
+
+        parameters:
+            name, str: casefolded form to match
+            term, str: term the form belongs to
+        """
+        state = 0
+        for char in name:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        if (len(name), term) not in self.output[state]:
+            self.output[state].append((len(name), term))
+
+    def build_failure_links(self):
+        """
+        Set the failure link of each state to the state for the longest proper
+        suffix of its string that is also in the trie, breadth-first, and add
+        the names ending at that state to its output.
+        """
+        queue = deque(self.goto[0].values())
+        while len(queue) > 0:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                fallback = self.fail[state]
+                while (fallback != 0) and (char not in self.goto[fallback]):
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(char, 0)
+                self.output[nxt] = self.output[nxt] + self.output[
+                    self.fail[nxt]]
+                queue.append(nxt)
+
+    def find_terms(self, text):
+        """
+        Find the terms with a whole-word match in the text.
+
+        parameters:
+            text, str: text to search
+
+        returns:
+            terms, list of str: matched terms, in order of first match
+        """
+        norm_text = ' '.join(text.casefold().split())
+        terms = {}
+        state = 0
+        for end, char in enumerate(norm_text):
+            while (state != 0) and (char not in self.goto[state]):
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, term in self.output[state]:
+                start = end - length + 1
+                if ((start == 0 or not norm_text[start - 1].isalnum()) and
+                    (end + 1 == len(norm_text)
+                     or not norm_text[end + 1].isalnum())):
+                    terms.setdefault(term, start)
+
+        return list(terms)
+
+    def match(self, text):
+        """
+        Find the kingdoms of all terms with a match in the text.
+
+        parameters:
+            text, str: text to search
+
+        returns:
+            classes, list of str: kingdoms identified, one per matched term,
+                in order of first match
+        """
+        return [self.term_kingdoms[term] for term in self.find_terms(text)]
@@ -0,0 +1,357 @@
+"""
+Compact citation network backed by a sparse adjacency matrix, for analyses
+of networks that are too large to hold comfortably as a networkx
+MultiDiGraph.
+
+Author: Serena G. Lotreck
+"""
+import numpy as np
+import networkx as nx
+from scipy.sparse import csr_matrix
+
+CATEGORICAL_ATTRS = ('study_system', )
+
+
+class CSRCitationGraph():
+    """
+    Class to hold a directed citation network as a CSR adjacency matrix.
+
+    Nodes are indexed by integers; entry (i, j) of the adjacency matrix is the
+    number of times paper i cites paper j, so multi-edges are stored as counts
+    rather than as separate edges. Categorical attributes such as
+    study_system are stored as an integer code per node plus a list of
+    categories, with -1 for nodes without the attribute. Other attributes are
+    stored as one list per attribute.
+
+    Methods follow the networkx names for the operations used in this
+    codebase; degrees count multi-edges, and neighbors returns each
+    successor once, as in a MultiDiGraph.
+    """
+    def __init__(self, node_ids, adjacency, categorical=None, node_attrs=None):
+        """
+        Initialize CSRCitationGraph instance.
+
+        parameters:
+            node_ids, list of str: paper ID for each row and column
+            adjacency, scipy sparse matrix: citation counts between papers
+            categorical, dict or None: keys are attribute names, values are
+                two-tuples of a numpy array of int codes and a list of
+                categories
+            node_attrs, dict or None: keys are attribute names, values are
+                lists with the value of the attribute for each node, None for
+                nodes without it
+        """
+        self.node_ids = list(node_ids)
+        self.node_index = {node: i for i, node in enumerate(self.node_ids)}
+        self.adjacency = csr_matrix(adjacency, dtype=np.int32)
+        self.adjacency.sum_duplicates()
+        self.categorical = categorical if categorical is not None else {}
+        self.node_attrs = node_attrs if node_attrs is not None else {}
+        # Column sums are computed the first time an in-degree is needed
+        self.in_degrees = None
+
+    @staticmethod
+    def encode_categories(values):
+        """
+        Encode a column of attribute values as integer codes.
+
+        parameters:
+            values, list: value for each node, None for nodes without it
+
+        returns:
+            codes, numpy array of int32: index of each value in categories,
+                -1 for None
+            categories, list: unique values, in order of first appearance
+        """
+        lookup = {}
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, val in enumerate(values):
+            if val is None:
+                codes[i] = -1
+            else:
+                codes[i] = lookup.setdefault(val, len(lookup))
+
+        return codes, list(lookup)
+
+    @classmethod
+    def from_arrays(cls,
+                    node_ids,
+                    node_attrs,
+                    src,
+                    dst,
+                    categorical_attrs=CATEGORICAL_ATTRS):
+        """
+        Build a graph from node attribute columns and edge index arrays, in
+        the format returned by network_io.read_network_arrays.
+
+        parameters:
+            node_ids, list of str: node IDs
+            node_attrs, dict: keys are attribute names, values are lists with
+                the value of the attribute for each node, None for nodes
+                without it
+            src, array-like of int: index of the source node of each edge
+            dst, array-like of int: index of the target node of each edge
+            categorical_attrs, tuple of str: attributes to store as codes
+
+        returns:
+            graph, CSRCitationGraph: citation network
+        """
+        num_nodes = len(node_ids)
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        adjacency = csr_matrix(
+            (np.ones(len(src), dtype=np.int32), (src, dst)),
+            shape=(num_nodes, num_nodes))
+
+        categorical = {}
+        other_attrs = {}
+        for name, col in node_attrs.items():
+            if name in categorical_attrs:
+                categorical[name] = cls.encode_categories(col)
+            else:
+                other_attrs[name] = list(col)
+
+        return cls(node_ids, adjacency, categorical, other_attrs)
+
+    @classmethod
+    def from_networkx(cls, graph, categorical_attrs=CATEGORICAL_ATTRS):
+        """
+        Build a graph from a networkx graph.
+
+        parameters:
+            graph, networkx graph: citation network
+            categorical_attrs, tuple of str: attributes to store as codes
+
+        returns:
+            graph, CSRCitationGraph: citation network
+        """
+        node_ids = list(graph.nodes)
+        index = {node: i for i, node in enumerate(node_ids)}
+        attr_names = {
+            name
+            for _, attrs in graph.nodes(data=True) for name in attrs
+        }
+        node_attrs = {
+            name: [attrs.get(name) for _, attrs in graph.nodes(data=True)]
+            for name in attr_names
+        }
+        edges = list(graph.edges())
+        src = [index[u] for u, _ in edges]
+        dst = [index[v] for _, v in edges]
+
+        return cls.from_arrays(node_ids, node_attrs, src, dst,
+                               categorical_attrs)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __contains__(self, node):
+        return node in self.node_index
+
+    def number_of_nodes(self):
+        """
+        Get the number of papers in the network.
+        """
+        return len(self.node_ids)
+
+    def number_of_edges(self):
+        """
+        Get the number of citations in the network, counting multi-edges.
+        """
+        return int(self.adjacency.data.sum())
+
+    def get_attribute(self, name):
+        """
+        Get the value of an attribute for every node.
+
+        parameters:
+            name, str: attribute name
+
+        returns:
+            values, list: value for each node, None for nodes without it
+        """
+        if name in self.categorical:
+            codes, categories = self.categorical[name]
+            return [
+                categories[c] if c != -1 else None for c in codes.tolist()
+            ]
+        return list(self.node_attrs[name])
+
+    def get_codes(self, name):
+        """
+        Get the integer codes of a categorical attribute.
+
+        parameters:
+            name, str: attribute name
+
+        returns:
+            codes, numpy array of int32: category index for each node, -1 for
+                nodes without the attribute
+            categories, list: category names
+        """
+        if name not in self.categorical:
+            self.categorical[name] = self.encode_categories(
+                self.node_attrs.pop(name))
+        return self.categorical[name]
+
+    def nodes(self, data=False):
+        """
+        Get the nodes of the network, as with networkx's graph.nodes.
+
+        parameters:
+            data, bool: whether or not to include attribute dictionaries
+
+        returns:
+            nodes, list: node IDs, or two-tuples of node ID and attributes
+        """
+        if not data:
+            return list(self.node_ids)
+        columns = {
+            name: self.get_attribute(name)
+            for name in list(self.categorical) + list(self.node_attrs)
+        }
+        nodes = []
+        for i, node in enumerate(self.node_ids):
+            attrs = {
+                name: col[i]
+                for name, col in columns.items() if col[i] is not None
+            }
+            nodes.append((node, attrs))
+
+        return nodes
+
+    def out_degree(self, node=None):
+        """
+        Get the number of citations made by a paper, counting multi-edges.
+
+        parameters:
+            node, str or None: paper ID, or None to get all out-degrees
+
+        returns:
+            degree, int, or numpy array of int for all nodes in index order
+        """
+        if node is None:
+            return np.asarray(self.adjacency.sum(axis=1)).ravel()
+        i = self.node_index[node]
+        start, end = self.adjacency.indptr[i], self.adjacency.indptr[i + 1]
+        return int(self.adjacency.data[start:end].sum())
+
+    def in_degree(self, node=None):
+        """
+        Get the number of times a paper is cited, counting multi-edges.
+
+        parameters:
+            node, str or None: paper ID, or None to get all in-degrees
+
+        returns:
+            degree, int, or numpy array of int for all nodes in index order
+        """
+        if self.in_degrees is None:
+            self.in_degrees = np.asarray(self.adjacency.sum(axis=0)).ravel()
+        if node is None:
+            return self.in_degrees.copy()
+        return int(self.in_degrees[self.node_index[node]])
+
+    def neighbors(self, node):
+        """
+        Get the papers cited by a paper, each listed once.
+
+        parameters:
+            node, str: paper ID
+
+        returns:
+            neighbors, list of str: IDs of cited papers
+        """
+        i = self.node_index[node]
+        start, end = self.adjacency.indptr[i], self.adjacency.indptr[i + 1]
+        return [self.node_ids[j] for j in self.adjacency.indices[start:end]]
+
+    def edge_arrays(self):
+        """
+        Get the unique edges of the network and their multiplicities.
+
+        returns:
+            src, numpy array of int: index of the citing paper of each edge
+            dst, numpy array of int: index of the cited paper of each edge
+            counts, numpy array of int: number of times each edge occurs
+        """
+        src = np.repeat(np.arange(len(self.node_ids)),
+                        np.diff(self.adjacency.indptr))
+        return src, self.adjacency.indices, self.adjacency.data
+
+    def iter_edge_counts(self):
+        """
+        Yield each unique edge once with its multiplicity.
+
+        yields:
+            edge, three-tuple: citing paper ID, cited paper ID, count
+        """
+        for s, d, count in zip(*(a.tolist() for a in self.edge_arrays())):
+            yield (self.node_ids[s], self.node_ids[d], count)
+
+    def edges(self):
+        """
+        Yield every edge, repeating multi-edges, as when iterating over the
+        edges of a MultiDiGraph.
+
+        yields:
+            edge, three-tuple: citing paper ID, cited paper ID, edge key
+        """
+        for u, v, count in self.iter_edge_counts():
+            for key in range(count):
+                yield (u, v, key)
+
+    def subgraph_mask(self, mask):
+        """
+        Get the subgraph induced by the nodes selected by a boolean mask.
+
+        parameters:
+            mask, numpy array of bool: whether to keep each node
+
+        returns:
+            subgraph, CSRCitationGraph: new graph with only the kept nodes
+        """
+        keep = np.flatnonzero(mask)
+        adjacency = self.adjacency[keep][:, keep]
+        categorical = {
+            name: (codes[keep], list(categories))
+            for name, (codes, categories) in self.categorical.items()
+        }
+        node_attrs = {
+            name: [col[i] for i in keep.tolist()]
+            for name, col in self.node_attrs.items()
+        }
+        node_ids = [self.node_ids[i] for i in keep.tolist()]
+
+        return CSRCitationGraph(node_ids, adjacency, categorical, node_attrs)
+
+    def subgraph(self, nodes):
+        """
+        Get the subgraph induced by a set of nodes. Unlike networkx, this
+        returns a copy rather than a view.
+
+        parameters:
+            nodes, iterable of str: paper IDs to keep
+
+        returns:
+            subgraph, CSRCitationGraph: new graph with only the given nodes
+        """
+        mask = np.zeros(len(self.node_ids), dtype=bool)
+        idxs = [self.node_index[n] for n in nodes if n in self.node_index]
+        mask[idxs] = True
+
+        return self.subgraph_mask(mask)
+
+    def to_networkx(self):
+        """
+        Build a networkx MultiDiGraph of the network, e.g. for clustering
+        with Infomap.
+
+        returns:
+            graph, MultiDiGraph: citation network
+        """
+        graph = nx.MultiDiGraph()
+        _ = graph.add_nodes_from(self.nodes(data=True))
+        _ = graph.add_edges_from(self.edges())
+
+        return graph
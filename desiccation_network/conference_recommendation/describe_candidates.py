@@ -5,10 +5,12 @@ Author: Serena G. Lotreck
 """
 import argparse
 from os.path import abspath
-import jsonlines
+import sys
 from collections import defaultdict
 import numpy as np
 import pandas as pd
+sys.path.append('../build_citation_network/')
+from paper_store import load_papers
 
 
 def get_author_info(candidate_list, dataset):
@@ -17,7 +19,7 @@ def get_author_info(candidate_list, dataset):
 
     parameters:
         candidate_list, list of str: candidate WOS names
-        dataset, list of dict: dataset
+        dataset, list of dict or PaperStore: dataset
 
     returns:
         candidate_data, df: columns are candidate, publication_title,
@@ -59,7 +61,7 @@ def get_author_info(candidate_list, dataset):
     return candidate_data
     
 
-def main(candidates, dataset, outpath, outprefix):
+def main(candidates, dataset, outpath, outprefix, paper_store=''):
     
     # Read in candidates
     with open(candidates) as myf:
@@ -67,8 +69,7 @@ def main(candidates, dataset, outpath, outprefix):
     print(f'\nThere are {len(cands)} candidates.')
 
     # Read in dataset
-    with jsonlines.open(dataset) as reader:
-        data = [obj for obj in reader]
+    data = load_papers(dataset, paper_store)
     
     # Process
     print('\nGetting candidate data...')
@@ -95,11 +96,18 @@ if __name__ == "__main__":
             help='Path to directory to save output')
     parser.add_argument('outprefix', type=str,
             help='String to prepend to outputs')
+    parser.add_argument('-paper_store', type=str, default='',
+            help='Path to a SQLite database to store the dataset in, so '
+            'papers are read from disk as needed instead of all being loaded '
+            'into memory')
 
     args = parser.parse_args()
     
     args.candidates = abspath(args.candidates)
     args.dataset = abspath(args.dataset)
     args.outpath = abspath(args.outpath)
+    if args.paper_store != '':
+        args.paper_store = abspath(args.paper_store)
     
-    main(args.candidates, args.dataset, args.outpath, args.outprefix)
\ No newline at end of file
+    main(args.candidates, args.dataset, args.outpath, args.outprefix,
+            args.paper_store)
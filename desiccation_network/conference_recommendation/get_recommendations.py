@@ -7,8 +7,6 @@ import argparse
 from os.path import abspath
 import sys
 import json
-import jsonlines
-import networkx as nx
 from ast import literal_eval
 from sentence_transformers import SentenceTransformer
 from umap import UMAP
@@ -19,6 +17,9 @@ from bertopic import BERTopic
 from bertopic.representation import MaximalMarginalRelevance, KeyBERTInspired, PartOfSpeech, OpenAI
 import pandas as pd
 from recommendation_system import RecommendationSystem
+sys.path.append('../build_citation_network/')
+from network_io import read_network
+from paper_store import load_papers
 import pickle ##TODO remove
 
 
@@ -103,7 +104,7 @@ if __name__ == "__main__":
     parser.add_argument(
         'graphml_path',
         type=str,
-        help='Path to classified citation network graphml file')
+        help='Path to classified citation network, .graphml or .npz file')
     parser.add_argument(
         'topic_model_config',
         type=str,
@@ -148,14 +149,22 @@ if __name__ == "__main__":
                         type=str,
                         default='',
                         help='String to prepend to output file names')
+    parser.add_argument('-paper_store',
+                        type=str,
+                        default='',
+                        help='Path to a SQLite database to store the jsonl '
+                        'dataset in, so papers are read from disk as needed '
+                        'instead of all being loaded into memory. Built from '
+                        'jsonl_path if it doesn\'t exist or is out of date')
 
     args = parser.parse_args()
 
     # Read in files here
-    with jsonlines.open(abspath(args.jsonl_path)) as reader:
-        paper_dataset = [obj for obj in reader]
+    if args.paper_store != '':
+        args.paper_store = abspath(args.paper_store)
+    paper_dataset = load_papers(abspath(args.jsonl_path), args.paper_store)
 
-    classed_cite_net = nx.read_graphml(abspath(args.graphml_path))
+    classed_cite_net = read_network(abspath(args.graphml_path))
 
     with open(abspath(args.topic_model_config)) as myf:
         topic_model_config = json.load(myf)
@@ -4,6 +4,7 @@ Class for building conference intive recommendation system.
 Author: Serena G. Lotreck
 """
 import utils
+from csr_graph import CSRCitationGraph
 import pandas as pd
 import networkx as nx
 from infomap import Infomap
@@ -38,11 +39,11 @@ class RecommendationSystem():
                  outprefix=''):
         """
         parameters:
-            paper_dataset, list of dict: WoS papers with author and affiliation
-                data
-            class_citation_net, networkx Graph: directed citation network, nodes
-                are papers and edges are citations, nodes have study_system
-                attribute defined
+            paper_dataset, list of dict or PaperStore: WoS papers with author
+                and affiliation data
+            class_citation_net, networkx Graph or CSRCitationGraph: directed
+                citation network, nodes are papers and edges are citations,
+                nodes have study_system attribute defined
             topic_model, BERTopic instance: topic model to use
             vec_model, CountVectorizer: vectorizer model for topic_model
             rep_model, one of the representation model options in BERTopic:
@@ -127,15 +128,25 @@ class RecommendationSystem():
             country_conversions[count] for count in attendee_countries
         ]
 
+    def iter_paper_authors(self):
+        """
+        Iterate over the UID and author list of each paper. For a PaperStore,
+        the UID and author columns are read without parsing the full papers.
+        """
+        if hasattr(self.paper_dataset, 'iter_authors'):
+            return zip(self.paper_dataset.iter_uids(),
+                       self.paper_dataset.iter_authors())
+        return ((paper['UID'], paper['authors'])
+                for paper in self.paper_dataset)
+
     def set_author_papers(self):
         """
         Set author_papers attribute
         """
         # Index by author
         author_papers = defaultdict(list)
-        for paper in self.paper_dataset:
-            uid = paper['UID']
-            for author in paper['authors']:
+        for uid, authors in self.iter_paper_authors():
+            for author in authors:
                 try:
                     author_papers[author['wos_standard'].lower()].append(uid)
                 except KeyError:
@@ -149,9 +160,8 @@ class RecommendationSystem():
         """
         # Index by paper
         paper_authors = defaultdict(list)
-        for paper in self.paper_dataset:
-            uid = paper['UID']
-            for author in paper['authors']:
+        for uid, authors in self.iter_paper_authors():
+            for author in authors:
                 try:
                     paper_authors[uid].append(author['wos_standard'].lower())
                 except KeyError:
@@ -214,9 +224,9 @@ class RecommendationSystem():
         print('\nBuilding co-author network...')
         # Get all co-author pairs
         co_authorship_weights = defaultdict(int)
-        for paper in self.paper_dataset:
+        for _, paper_authors in self.iter_paper_authors():
             authors = []
-            for author in paper['authors']:
+            for author in paper_authors:
                 try:
                     authors.append(author['wos_standard'].lower())
                 except KeyError:
@@ -272,13 +282,20 @@ class RecommendationSystem():
         print('\nBuilding co-citation network...')
         self.set_paper_authors()
 
+        # Multi-edges are stored as counts in a CSRCitationGraph
+        if isinstance(self.classed_citation_net, CSRCitationGraph):
+            edge_counts = self.classed_citation_net.iter_edge_counts()
+        else:
+            edge_counts = ((edge[0], edge[1], 1)
+                           for edge in self.classed_citation_net.edges)
+
         co_citation_weights = defaultdict(int)
-        for edge in self.classed_citation_net.edges:
-            for author1 in self.paper_authors[edge[0]]:
-                for author2 in self.paper_authors[edge[1]]:
+        for citing, cited, count in edge_counts:
+            for author1 in self.paper_authors[citing]:
+                for author2 in self.paper_authors[cited]:
                     if author1 != author2:
                         author_pair = tuple(set([author1, author2]))
-                        co_citation_weights[author_pair] += 1
+                        co_citation_weights[author_pair] += count
 
         # Combine reverse-ordered pair counts for edges
         co_cite_joined_weights = defaultdict(int)
@@ -322,7 +339,15 @@ class RecommendationSystem():
         """
         print('\nPerfomring Infomap clustering on citation network...')
         im = Infomap(seed=1234)
-        mapping = im.add_networkx_graph(self.classed_citation_net)
+        if isinstance(self.classed_citation_net, CSRCitationGraph):
+            # Add the edges straight from the adjacency matrix, with
+            # multi-edges as weights, rather than building a networkx graph
+            for i, node in enumerate(self.classed_citation_net.node_ids):
+                im.add_node(i, str(node))
+            src, dst, counts = self.classed_citation_net.edge_arrays()
+            im.add_links(zip(src.tolist(), dst.tolist(), counts.tolist()))
+        else:
+            mapping = im.add_networkx_graph(self.classed_citation_net)
         _ = im.run()
         cluster_output = im.get_dataframe(["module_id", "name"])
         self.cite_ids_to_authors = defaultdict(list)
@@ -4,19 +4,143 @@ Utility functions for working with citation networks.
 Author: Serena G. Lotreck
 """
 from itertools import product
+from multiprocessing import get_context
+import warnings
 import numpy as np
 from collections import defaultdict, Counter
 import pycountry
 import pandas as pd
+import jsonlines
 from unidecode import unidecode
+from csr_graph import CSRCitationGraph
+
+# Arrays shared by the replicates run in one resampling process
+resample_worker_data = None
+
+
+def get_edge_index_arrays(graph):
+    """
+    Get the edges of a citation network as arrays of node indices, with
+    nodes indexed in the order of graph.nodes.
+
+    parameters:
+        graph, MultiDiGraph or CSRCitationGraph: citation network
+
+    returns:
+        src, numpy array of int: index of the citing paper of each edge
+        dst, numpy array of int: index of the cited paper of each edge
+        counts, numpy array of int: number of times each edge occurs
+    """
+    if isinstance(graph, CSRCitationGraph):
+        return graph.edge_arrays()
+
+    index = {node: i for i, node in enumerate(graph.nodes)}
+    num_edges = graph.number_of_edges()
+    src = np.fromiter((index[u] for u, _ in graph.edges()),
+                      dtype=np.int64,
+                      count=num_edges)
+    dst = np.fromiter((index[v] for _, v in graph.edges()),
+                      dtype=np.int64,
+                      count=num_edges)
+
+    return src, dst, np.ones(num_edges, dtype=np.int64)
+
+
+def encode_node_attribute(graph, attribute):
+    """
+    Encode the values of a node attribute as integer codes, in the order of
+    graph.nodes.
+
+    parameters:
+        graph, MultiDiGraph or CSRCitationGraph: citation network
+        attribute, str: name of the attribute to encode
+
+    returns:
+        codes, numpy array of int: category index for each node
+        categories, list: category names
+    """
+    if isinstance(graph, CSRCitationGraph):
+        codes, categories = graph.get_codes(attribute)
+    else:
+        codes, categories = CSRCitationGraph.encode_categories(
+            [attrs.get(attribute) for _, attrs in graph.nodes(data=True)])
+    assert (codes != -1).all(), (f'All nodes must have a {attribute} '
+                                 'attribute, please try again.')
+
+    return codes, categories
+
+
+def get_dyadic_citation_counts(graph, attributes):
+    """
+    Count the citations between each pair of categories for one or more node
+    attributes. The edge arrays are only built once for all attributes.
+
+    parameters:
+        graph, MultiDiGraph or CSRCitationGraph: citation network with
+            classifications
+        attributes, list of str: names of the attributes to count for
+
+    returns:
+        dyadic_counts, dict: keys are attribute names, values are two-tuples
+            of a k x k numpy array, where entry (i, j) is the number of
+            citations from papers in category i to papers in category j, and
+            the list of the k categories present in the network
+    """
+    src, dst, counts = get_edge_index_arrays(graph)
+    dyadic_counts = {}
+    for attribute in attributes:
+        codes, categories = encode_node_attribute(graph, attribute)
+        num_cats = len(categories)
+        pair_counts = np.bincount(codes[src] * num_cats + codes[dst],
+                                  weights=counts,
+                                  minlength=num_cats**2).reshape(
+                                      num_cats, num_cats)
+        # Drop categories without any nodes, e.g. after taking a subgraph
+        present = np.unique(codes)
+        pair_counts = pair_counts[np.ix_(present, present)].astype(np.int64)
+        dyadic_counts[attribute] = (pair_counts,
+                                    [categories[i] for i in present])
+
+    return dyadic_counts
+
+
+def calculate_dyadic_citation_freqs_batch(graph, attributes):
+    """
+    Calculate dyadic citation frequencies for several attributes at once.
+
+    parameters:
+        graph, MultiDiGraph or CSRCitationGraph: citation network with
+            classifications
+        attributes, list of str: names of the attributes for which to
+            calculate the frequencies
+
+    returns:
+        all_freqs, dict: keys are attribute names, values are dyadic_freqs
+            dicts as returned by calculate_dyadic_citation_freqs
+    """
+    all_freqs = {}
+    for attribute, (pair_counts, categories) in get_dyadic_citation_counts(
+            graph, attributes).items():
+        system_totals = pair_counts.sum(axis=1)
+        all_freqs[attribute] = {
+            (categories[i], categories[j]):
+            float(pair_counts[i, j] / system_totals[i])
+            if system_totals[i] != 0 else np.nan
+            for i, j in product(range(len(categories)), repeat=2)
+        }
+
+    return all_freqs
 
 
 def calculate_dyadic_citation_freqs(graph, attribute):
     """
-    Calculate dyadic citation frequencies for a given network.
+    Calculate dyadic citation frequencies for a given network. Every citation
+    is counted, including repeated citations between the same two papers, so
+    the frequencies for each citing study system sum to 1.
 
     parameters:
-        graph, MultiDiGraph: citation network with classifications
+        graph, MultiDiGraph or CSRCitationGraph: citation network with
+            classifications
         attribute, str: name of the attribute for which to calculate the
             frequencies
 
@@ -25,32 +149,202 @@ def calculate_dyadic_citation_freqs(graph, attribute):
             floats for the frequency at which the first study system cited the
             second
     """
-    # Get the available study systems
-    systems = {attrs[attribute] for node, attrs in graph.nodes(data=True)}
-
-    # Get all ordered pairs and set up for data collection
-    system_pairs = {p: 0 for p in product(systems, repeat=2)}
-    system_totals = {sys: 0 for sys in systems}
-
-    # For all nodes, add to both dicts
-    for node, attrs in graph.nodes(data=True):
-        # Get the system of this paper
-        self_system = attrs[attribute]
-        # Get the total number of citations for this node
-        system_totals[self_system] += graph.out_degree(node)
-        # Go through citations specifically and get their systems
-        for cited_paper in graph.neighbors(node):
-            cit_type = graph.nodes[cited_paper][attribute]
-            system_pairs[(self_system, cit_type)] += 1
-
-    # Calculate dyadic freqs
-    dyadic_freqs = {
-        sys_pair: num / system_totals[sys_pair[0]]
-        if system_totals[sys_pair[0]] != 0 else np.nan
-        for sys_pair, num in system_pairs.items()
+    return calculate_dyadic_citation_freqs_batch(graph, [attribute])[attribute]
+
+
+def dyadic_freqs_from_counts(pair_counts):
+    """
+    Convert a matrix of citation counts between categories to dyadic citation
+    frequencies.
+
+    parameters:
+        pair_counts, numpy array: k x k citation counts
+
+    returns:
+        freqs, numpy array: k x k frequencies, rows with no citations are nan
+    """
+    totals = pair_counts.sum(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        freqs = np.where(totals != 0, pair_counts / totals, np.nan)
+
+    return freqs
+
+
+def init_resample_worker(pair_codes, src, dst, counts, codes, num_cats):
+    """
+    Store the arrays needed to draw replicates once in a resampling process.
+
+    parameters:
+        pair_codes, numpy array of int: citing * num_cats + cited category
+            code for every citation, repeating multi-edges
+        src, numpy array of int: index of the citing paper of each edge
+        dst, numpy array of int: index of the cited paper of each edge
+        counts, numpy array of int: number of times each edge occurs
+        codes, numpy array of int: category code for each node
+        num_cats, int: number of categories
+    """
+    global resample_worker_data
+    resample_worker_data = {
+        'pair_codes': pair_codes,
+        'src': src,
+        'dst': dst,
+        'counts': counts,
+        'codes': codes,
+        'num_cats': num_cats
     }
 
-    return dyadic_freqs
+
+def run_resample_chunk(kind, seed_seq, num_reps):
+    """
+    Draw a chunk of replicates and calculate their dyadic frequencies.
+
+    'bootstrap' replicates resample citations with replacement;
+    'permutation' replicates shuffle the categories between nodes, keeping
+    the network structure fixed, to simulate citations that don't depend on
+    study system.
+
+    parameters:
+        kind, str: 'bootstrap' or 'permutation'
+        seed_seq, numpy SeedSequence: seed for this chunk
+        num_reps, int: number of replicates to draw
+
+    returns:
+        freqs, numpy array: num_reps x k x k dyadic frequencies
+    """
+    data = resample_worker_data
+    num_cats = data['num_cats']
+    rng = np.random.default_rng(seed_seq)
+    freqs = np.empty((num_reps, num_cats, num_cats))
+    for rep in range(num_reps):
+        if kind == 'bootstrap':
+            num_cites = len(data['pair_codes'])
+            idx = rng.integers(0, num_cites, size=num_cites)
+            pair_counts = np.bincount(data['pair_codes'][idx],
+                                      minlength=num_cats**2)
+        else:
+            perm_codes = rng.permutation(data['codes'])
+            pair_counts = np.bincount(perm_codes[data['src']] * num_cats +
+                                      perm_codes[data['dst']],
+                                      weights=data['counts'],
+                                      minlength=num_cats**2)
+        freqs[rep] = dyadic_freqs_from_counts(
+            pair_counts.reshape(num_cats, num_cats))
+
+    return freqs
+
+
+def resample_dyadic_citation_freqs(graph,
+                                   attribute,
+                                   num_bootstrap=1000,
+                                   num_permutations=1000,
+                                   alpha=0.05,
+                                   seed=1234,
+                                   processes=1,
+                                   chunk_size=100):
+    """
+    Estimate uncertainty in dyadic citation frequencies. Confidence intervals
+    come from bootstrap replicates that resample citations with replacement,
+    and p-values from a null model that permutes the attribute between nodes.
+
+    Replicates are drawn in chunks of chunk_size, each with its own seed
+    spawned from seed, so results are the same for any number of processes.
+
+    parameters:
+        graph, MultiDiGraph or CSRCitationGraph: citation network with
+            classifications
+        attribute, str: name of the attribute for which to calculate the
+            frequencies
+        num_bootstrap, int: number of bootstrap replicates
+        num_permutations, int: number of permutation replicates
+        alpha, float: confidence intervals cover 1 - alpha
+        seed, int: random seed
+        processes, int: number of processes to draw replicates in
+        chunk_size, int: number of replicates per task
+
+    returns:
+        resampled_freqs, df: columns are citing, cited, freq, ci_lower,
+            ci_upper and p_value, with one row per ordered pair of categories.
+            p-values only count permutation replicates where the citing
+            category made citations, and are nan if there are none
+    """
+    assert num_bootstrap >= 1, ('num_bootstrap must be at least 1, please '
+                                'try again.')
+    assert num_permutations >= 1, ('num_permutations must be at least 1, '
+                                   'please try again.')
+    codes, categories = encode_node_attribute(graph, attribute)
+    present, codes = np.unique(codes, return_inverse=True)
+    categories = [categories[i] for i in present]
+    num_cats = len(categories)
+    src, dst, counts = get_edge_index_arrays(graph)
+    # Sorted so that replicates don't depend on the order edges are stored in
+    pair_codes = np.sort(np.repeat(codes[src] * num_cats + codes[dst], counts))
+    init_args = (pair_codes, src, dst, counts, codes, num_cats)
+
+    # Spawn one seed per chunk so replicates don't depend on scheduling
+    tasks = []
+    kind_seeds = np.random.SeedSequence(seed).spawn(2)
+    for kind, num_reps, kind_seed in zip(['bootstrap', 'permutation'],
+                                         [num_bootstrap, num_permutations],
+                                         kind_seeds):
+        sizes = [
+            min(chunk_size, num_reps - start)
+            for start in range(0, num_reps, chunk_size)
+        ]
+        for chunk_seed, size in zip(kind_seed.spawn(len(sizes)), sizes):
+            tasks.append((kind, chunk_seed, size))
+
+    if processes == 1:
+        init_resample_worker(*init_args)
+        chunks = [run_resample_chunk(*task) for task in tasks]
+    else:
+        with get_context('spawn').Pool(processes,
+                                       initializer=init_resample_worker,
+                                       initargs=init_args) as pool:
+            chunks = pool.starmap(run_resample_chunk, tasks)
+    replicates = {
+        kind: [np.empty((0, num_cats, num_cats))]
+        for kind in ['bootstrap', 'permutation']
+    }
+    for (kind, _, _), chunk in zip(tasks, chunks):
+        replicates[kind].append(chunk)
+    boot = np.concatenate(replicates['bootstrap'])
+    null = np.concatenate(replicates['permutation'])
+
+    observed = dyadic_freqs_from_counts(
+        np.bincount(pair_codes, minlength=num_cats**2).reshape(
+            num_cats, num_cats))
+    with warnings.catch_warnings():
+        # Pairs whose citing category has no citations are all nan
+        warnings.simplefilter('ignore', RuntimeWarning)
+        ci_lower = np.nanpercentile(boot, 100 * alpha / 2, axis=0)
+        ci_upper = np.nanpercentile(boot, 100 * (1 - alpha / 2), axis=0)
+        # Two-sided p-value for the distance from the null mean
+        null_mean = np.nanmean(null, axis=0)
+        extreme = (np.abs(null - null_mean) >=
+                   np.abs(observed - null_mean) - 1e-12).sum(axis=0)
+        # Replicates where the citing category made no citations are nan, so
+        # they can't count as extreme and are left out of the denominator
+        valid = (~np.isnan(null)).sum(axis=0)
+        p_value = np.where(
+            np.isnan(observed) | (valid == 0), np.nan,
+            (1 + extreme) / (1 + valid))
+
+    rows = []
+    for i, j in product(range(num_cats), repeat=2):
+        rows.append({
+            'citing': categories[i],
+            'cited': categories[j],
+            'freq': observed[i, j],
+            'ci_lower': ci_lower[i, j],
+            'ci_upper': ci_upper[i, j],
+            'p_value': p_value[i, j]
+        })
+
+    return pd.DataFrame(rows,
+                        columns=[
+                            'citing', 'cited', 'freq', 'ci_lower',
+                            'ci_upper', 'p_value'
+                        ])
 
 
 def flatten_jsonl(jsonl):
@@ -108,13 +402,75 @@ def map_classes_to_jsonl(graph, jsonl, flatten, keyname):
     return updated_jsonl
 
 
+def get_prune_mask(graph,
+                   main_results_only=None,
+                   remove_dead_ends=False,
+                   threshold_in_degree=None,
+                   remove_noclass=False,
+                   until_stable=False):
+    """
+    Get which nodes of a citation network pass all of the given pruning
+    criteria, in the order of graph.nodes. See prune_citation_network for the
+    criteria.
+
+    Criteria are evaluated together on the unpruned graph. If until_stable
+    is True, the degree criteria are then re-evaluated on the remaining nodes
+    until no more nodes are removed.
+
+    parameters:
+        graph, MultiDiGraph or CSRCitationGraph: graph to prune; the other
+            parameters are the same as for prune_citation_network
+
+    returns:
+        keep, numpy array of bool: whether each node is kept
+    """
+    node_ids = graph.nodes()
+    keep = np.ones(len(node_ids), dtype=bool)
+    if main_results_only is not None:
+        main_results = set(main_results_only)
+        keep &= np.fromiter((node in main_results for node in node_ids),
+                            dtype=bool,
+                            count=len(node_ids))
+    if remove_noclass:
+        codes, categories = encode_node_attribute(graph, 'study_system')
+        if 'NOCLASS' in categories:
+            keep &= codes != categories.index('NOCLASS')
+    if not remove_dead_ends and threshold_in_degree is None:
+        return keep
+
+    src, dst, counts = get_edge_index_arrays(graph)
+    static_keep = keep
+    alive = np.ones(len(src), dtype=bool)
+    while True:
+        new_keep = static_keep.copy()
+        if remove_dead_ends:
+            out_degree = np.bincount(src[alive],
+                                     weights=counts[alive],
+                                     minlength=len(keep))
+            new_keep &= out_degree > 0
+        if threshold_in_degree is not None:
+            in_degree = np.bincount(dst[alive],
+                                    weights=counts[alive],
+                                    minlength=len(keep))
+            new_keep &= in_degree >= threshold_in_degree
+        if not until_stable or (new_keep == keep).all():
+            return new_keep
+        keep = new_keep
+        # Degrees only count edges between nodes that haven't been removed
+        alive = keep[src] & keep[dst]
+
+
 def prune_citation_network(graph,
                            main_results_only=None,
                            remove_dead_ends=False,
                            threshold_in_degree=None,
-                           remove_noclass=False):
+                           remove_noclass=False,
+                           until_stable=False,
+                           as_view=False):
     """
-    Prune a citation network according to some criteria. Options:
+    Prune a citation network according to some criteria. Any combination of
+    options can be given, and nodes are only kept if they pass all of them.
+    Options:
         main_results_only: only keep nodes and links that are among the main
             search results
         remove_dead_ends: only keep papers that have citations (out-degree > 0)
@@ -122,8 +478,18 @@ def prune_citation_network(graph,
             number of papers
         remove_noclass: removes nodes with no classification
 
+    Degrees are calculated on the unpruned graph, so removing a node doesn't
+    change whether its neighbors are removed; pass until_stable to repeat the
+    degree criteria on the pruned graph until no more nodes are removed (e.g.
+    to remove dead ends until none remain).
+
+    networkx graphs are modified in place, unless as_view is True, in which
+    case a subgraph view of the original graph is returned without copying
+    it. CSRCitationGraphs can't be modified in place or viewed, so a pruned
+    copy is always returned for them.
+
     parameters:
-        graph, MultiDiGraph: graph to prune
+        graph, MultiDiGraph or CSRCitationGraph: graph to prune
         main_results, list of str or None: list of main result UIDs. Pass to perform
             main_results_only filtering
         remove_dead_ends, bool: whether or not to remove dead ends from the
@@ -132,66 +498,78 @@ def prune_citation_network(graph,
             number of times a paper should be cited to keep in the network
         remove_noclass, bool: whether or not to remove nodes without a
             classification
+        until_stable, bool: whether or not to repeat pruning until no more
+            nodes are removed
+        as_view, bool: whether or not to return a view of a networkx graph
+            instead of modifying it
 
     returns:
-        graph, MultiDiGraph: pruned graph
+        graph, MultiDiGraph or CSRCitationGraph: pruned graph
     """
-    if main_results_only is not None:
-        to_remove = [
-            node for node in graph.nodes if node not in main_results_only
-        ]
-    elif remove_dead_ends:
-        to_remove = [
-            node for node in graph.nodes if graph.out_degree(node) == 0
-        ]
-    elif threshold_in_degree is not None:
-        to_remove = [
-            node for node in graph.nodes
-            if graph.in_degree(node) < threshold_in_degree
-        ]
-    elif remove_noclass:
-        to_remove = [
-            node for node, attrs in graph.nodes(data=True)
-            if attrs['study_system'] == 'NOCLASS'
-        ]
-
-    _ = graph.remove_nodes_from(to_remove)
+    keep = get_prune_mask(graph, main_results_only, remove_dead_ends,
+                          threshold_in_degree, remove_noclass, until_stable)
+
+    if isinstance(graph, CSRCitationGraph):
+        return graph.subgraph_mask(keep)
+
+    node_ids = list(graph.nodes)
+    if as_view:
+        return graph.subgraph(
+            [node for node, kept in zip(node_ids, keep) if kept])
+    _ = graph.remove_nodes_from(
+        [node for node, kept in zip(node_ids, keep) if not kept])
     return graph
 
 
-def prune_jsonl(jsonl):
+def build_uid_index(jsonl):
     """
-    Removes all references that are not also in the main results. Also adds
-    abstracts to the reference instances.
+    Index the UIDs and abstracts of the main results in one pass.
 
     parameters:
-        jsonl, list of dict: nested papers
+        jsonl, iterable of dict: nested papers
 
     returns:
-        final_jsonl, list of dict: pruned jsonl
+        uids, set of str: UIDs of all main results
+        abstracts, dict: keys are UIDs, values are abstracts, for main results
+            that have an abstract
     """
-    # Get all main results UIDs
-    uids = []
-    for paper in jsonl:
-        try:
-            uids.append(paper['UID'])
-        except KeyError:
-            continue
-
-    # Index abstracts by UID
+    uids = set()
     abstracts = {}
     for paper in jsonl:
         try:
             uid = paper['UID']
         except KeyError:
             continue
+        uids.add(uid)
         try:
-            abstract = paper['abstract']
-            abstracts[uid] = abstract
+            abstracts[uid] = paper['abstract']
         except KeyError:
             continue
 
-    final_jsonl = []
+    return uids, abstracts
+
+
+def iter_pruned_jsonl(jsonl, uids=None, abstracts=None):
+    """
+    Lazily remove all references that are not also in the main results, and
+    add abstracts to the references that remain. Papers and references are
+    copied, so the input isn't modified.
+
+    If uids and abstracts aren't given, they are built from jsonl, which then
+    has to be iterable twice; to stream a file, build them with
+    build_uid_index in a first pass over the file and pass them in.
+
+    parameters:
+        jsonl, iterable of dict: nested papers
+        uids, set of str or None: UIDs of all main results
+        abstracts, dict or None: keys are UIDs, values are abstracts
+
+    yields:
+        pruned_paper, dict: paper with pruned references
+    """
+    if uids is None or abstracts is None:
+        uids, abstracts = build_uid_index(jsonl)
+
     for paper in jsonl:
         pruned_paper = {}
         for k, v in paper.items():
@@ -199,53 +577,129 @@ def prune_jsonl(jsonl):
                 pruned_paper[k] = v
             else:
                 updated_refs = []
-                for ref in paper['references']:
-                    try:
-                        if ref['UID'] in uids:
-                            try:
-                                ref['abstract'] = abstracts[ref['UID']]
-                            except KeyError:
-                                pass
-                            updated_refs.append(ref)
-                    except KeyError:
+                for ref in v:
+                    if ref.get('UID') not in uids:
                         continue
+                    updated_ref = dict(ref)
+                    if ref['UID'] in abstracts:
+                        updated_ref['abstract'] = abstracts[ref['UID']]
+                    updated_refs.append(updated_ref)
                 pruned_paper['references'] = updated_refs
-        final_jsonl.append(pruned_paper)
+        yield pruned_paper
 
-    return final_jsonl
 
+def prune_jsonl(jsonl):
+    """
+    Removes all references that are not also in the main results. Also adds
+    abstracts to the reference instances.
+
+    parameters:
+        jsonl, list of dict: nested papers
 
-def filter_papers(papers, key_df, kind, stringency='most'):
+    returns:
+        final_jsonl, list of dict: pruned jsonl
     """
-    Filter papers by keyword.
+    return list(iter_pruned_jsonl(jsonl))
+
+
+def prune_jsonl_file(jsonl_path, output_path):
+    """
+    Prune a jsonl file as with prune_jsonl, reading it twice so that only the
+    UID index, and not the whole dataset, is held in memory.
+
+    parameters:
+        jsonl_path, str: path to the nested papers
+        output_path, str: path to save the pruned papers
+    """
+    with jsonlines.open(jsonl_path) as reader:
+        uids, abstracts = build_uid_index(reader)
+    with jsonlines.open(jsonl_path) as reader, jsonlines.open(
+            output_path, 'w') as writer:
+        for pruned_paper in iter_pruned_jsonl(reader, uids, abstracts):
+            writer.write(pruned_paper)
+
+
+def get_keyword_relevance_counts(papers, key_df, kind):
+    """
+    Count the relevant and irrelevant keywords of every paper, and whether
+    each paper passes each stringency level of filter_papers.
+
+    The relevance table is converted to a dict once, and all papers'
+    keywords are scored together as one exploded Series. Keywords that
+    aren't in key_df are counted as unknown and otherwise ignored.
+
+    parameters:
+        papers, list of dict: papers to score
+        key_df, pandas df: index are keywords, column is 'relevant' containing Y or N strings
+        kind, str: either 'static_keys' or 'dynamic_keys'
+
+    returns:
+        counts, pandas df: one row per paper, in the order of papers, with
+            columns UID, num_Y, num_N, num_other (keywords with any other
+            label), num_unknown, and most, middle and least (bools for whether
+            the paper is kept at that stringency)
+    """
+    relevance = key_df['relevant'].to_dict()
+    keys = pd.Series([paper[kind] for paper in papers],
+                     index=pd.RangeIndex(len(papers)),
+                     dtype=object).explode()
+    known = keys.isin(relevance.keys())
+    rels = keys.map(relevance).where(known)
+
+    # Empty keyword lists explode to one NaN row, which isn't counted
+    by_paper = pd.DataFrame({
+        'num_Y': rels.eq('Y'),
+        'num_N': rels.eq('N'),
+        'num_other': known & ~rels.isin(['Y', 'N']),
+        'num_unknown': keys.notna() & ~known
+    }).groupby(level=0).sum()
+    counts = by_paper.reindex(pd.RangeIndex(len(papers)), fill_value=0)
+
+    counts.insert(0, 'UID', [paper.get('UID') for paper in papers])
+    counts['most'] = ((counts.num_Y > 0) & (counts.num_N == 0) &
+                      (counts.num_other == 0))
+    counts['middle'] = counts.num_Y > counts.num_N
+    counts['least'] = counts.num_Y > 0
+
+    return counts
+
+
+def filter_papers(papers,
+                  key_df,
+                  kind,
+                  stringency='most',
+                  return_counts=False):
+    """
+    Filter papers by keyword. Stringencies:
+        most: all of a paper's keywords are relevant
+        middle: a paper has more relevant than irrelevant keywords
+        least: a paper has at least one relevant keyword
+    Keywords that aren't in key_df are ignored.
 
     parameters:
         papers, list of dict: papers to filter
         key_df, pandas df: index are keywords, column is 'relevant' containing Y or N strings
-        kind, str: either 'static_keywords' or 'dynamic_keys' ## TODO change to static_keys for udpated dataset
+        kind, str: either 'static_keys' or 'dynamic_keys'
         stringency, str: 'most', 'middle', or 'least', default is 'most'
+        return_counts, bool: whether or not to also return the relevance
+            counts from get_keyword_relevance_counts
 
     returns:
         filtered_papers, list of dict: list of papers with irrelevant papers removed
+        counts, pandas df: per-paper relevance counts, only returned if
+            return_counts is True
     """
-    filtered_papers = []
-    for paper in papers:
-        # Get the relevances of all keywords
-        keys = paper[kind]
-        key_rels = key_df.loc[keys, :]
-        # Filter based on requested stringency
-        if stringency == 'most':
-            if (len(key_rels['relevant'].unique())
-                    == 1) and (key_rels['relevant'].unique()[0] == 'Y'):
-                filtered_papers.append(paper)
-        elif stringency == 'middle':
-            nums = Counter(key_rels['relevant'].values.tolist())
-            if nums['Y'] > nums['N']:
-                filtered_papers.append(paper)
-        elif stringency == 'least':
-            if 'Y' in key_rels.relevant.values.tolist():
-                filtered_papers.append(paper)
+    assert stringency in ['most', 'middle', 'least'], (
+        'stringency must be one of "most", "middle" or "least", please try '
+        'again.')
+    counts = get_keyword_relevance_counts(papers, key_df, kind)
+    filtered_papers = [
+        paper for paper, keep in zip(papers, counts[stringency].tolist())
+        if keep
+    ]
 
+    if return_counts:
+        return filtered_papers, counts
     return filtered_papers
 
 
@@ -9,11 +9,12 @@ Author: Serena G. Lotreck
 """
 import argparse
 from os.path import abspath
-import networkx as nx
 from random import sample
 import requests
 import sys
 sys.path.append('../data/')
+sys.path.append('../build_citation_network/')
+from network_io import read_network
 from semantic_scholar_API_key import API_KEY
 header = {'x-api-key': API_KEY}
 import pandas as pd
@@ -22,7 +23,7 @@ import pandas as pd
 def main(graphml, output_csv):
 
     print('\nReading graph file...')
-    graph = nx.read_graphml(graphml)
+    graph = read_network(graphml)
 
     print('\nGetting nodes with no classification...')
     noclass_paperIds = []
@@ -97,7 +98,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Manual classification')
 
     parser.add_argument('graphml', type=str,
-            help='Graph file to use')
+            help='Graph file to use, .graphml or .npz')
     parser.add_argument('output_csv', type=str,
             help='Path to save output')
 
@@ -6,20 +6,19 @@ Author: Serena G. Lotreck
 """
 import argparse
 from os.path import abspath
+import sys
 import networkx as nx
 from random import sample
-import jsonlines
 import pandas as pd
+sys.path.append('../build_citation_network/')
+from paper_store import load_papers
 
 
-def main(jsonl, output_csv, to_pull, to_unify):
+def main(jsonl, output_csv, to_pull, to_unify, paper_store=''):
 
     # Read in the data
     print('\nReading in the data...')
-    with jsonlines.open(jsonl) as reader:
-        data = []
-        for obj in reader:
-            data.append(obj)
+    data = load_papers(jsonl, paper_store)
 
     # Get the paper ID key to use
     try:
@@ -112,6 +111,10 @@ if __name__ == "__main__":
     parser.add_argument('-to_unify', type=str, default='',
             help='An additional csv to to_pull, use to unify two sets of '
             'annotations')
+    parser.add_argument('-paper_store', type=str, default='',
+            help='Path to a SQLite database to store the jsonl in, so papers '
+            'are read from disk as needed instead of all being loaded into '
+            'memory')
 
     args = parser.parse_args()
 
@@ -126,4 +129,8 @@ if __name__ == "__main__":
     if args.to_pull != '':
         args.to_pull = abspath(args.to_pull)
 
-    main(args.jsonl, args.output_csv, args.to_pull, args.to_unify)
+    if args.paper_store != '':
+        args.paper_store = abspath(args.paper_store)
+
+    main(args.jsonl, args.output_csv, args.to_pull, args.to_unify,
+            args.paper_store)
@@ -8,15 +8,122 @@ import sys
 
 sys.path.append('../citation_network/')
 import classify_papers as cp
+from text_matchers import (TaxonPrefilter, DictionaryKingdomMatcher,
+                           FuzzyKingdomMatcher)
+from result_cache import ResultCache, hash_text
+from paper_store import PaperStore, PaperSubset
 import spacy
 import string
 import random
+import json
+import jsonlines
 
 ################################### clean_input_data ##########################
-## TODO write a test: I caught a bug in this function via the print statement
-## and fixed it when I refactored/rewrote the function -- still not sure what it
-## was. Need to write a test here to make sure there aren't other weird edge case
-## failures that could happen for other inputs
+
+
+@pytest.fixture
+def dirty_results():
+    return [{
+        'title': 'no UID',
+        'abstract': 'abstract',
+        'references': []
+    }, {
+        'UID': 'main_no_abstract',
+        'title': 'no abstract',
+        'references': [{
+            'UID': 'ref1',
+            'abstract': 'abstract'
+        }]
+    }, {
+        'UID': 'main_none_abstract',
+        'abstract': None,
+        'references': [{
+            'UID': 'isolate',
+            'abstract': 'abstract'
+        }]
+    }, {
+        'UID': 'main1',
+        'abstract': 'abstract',
+        'references': [{
+            'abstract': 'ref without UID'
+        }, {
+            'UID': 'ref_none_abstract',
+            'abstract': None
+        }, {
+            'UID': 'main2',
+            'abstract': 'abstract'
+        }]
+    }, {
+        'UID': 'main2',
+        'abstract': 'abstract',
+        'references': [{
+            'UID': 'ref_no_abstract'
+        }]
+    }, {
+        'UID': 'isolate',
+        'abstract': 'abstract',
+        'references': []
+    }]
+
+
+@pytest.fixture
+def clean_results():
+    return [{
+        'UID': 'main1',
+        'abstract': 'abstract',
+        'references': [{
+            'UID': 'main2',
+            'abstract': 'abstract'
+        }]
+    }, {
+        'UID': 'main2',
+        'abstract': 'abstract',
+        'references': []
+    }]
+
+
+def test_clean_input_data(dirty_results, clean_results):
+
+    result = cp.clean_input_data(dirty_results, 'UID')
+
+    assert result == clean_results
+
+
+def test_clean_input_data_store(dirty_results, clean_results, tmp_path):
+
+    jsonl_path = tmp_path / 'dirty.jsonl'
+    with jsonlines.open(jsonl_path, 'w') as writer:
+        writer.write_all(dirty_results)
+    store = PaperStore.from_jsonl(str(jsonl_path), str(tmp_path / 'dirty.db'))
+
+    result = cp.clean_input_data(store, 'UID')
+
+    assert isinstance(result, PaperSubset)
+    assert list(result.indices) == [3, 4]
+    assert list(result) == clean_results
+    assert result[0] == clean_results[0]
+    store.close()
+
+
+def test_iter_clean_input_data_counts(dirty_results):
+
+    counts = {
+        'mains_no_uid': 0,
+        'refs_no_uid': 0,
+        'mains_dropped': set(),
+        'refs_dropped': set(),
+        'isolates': 0
+    }
+    _ = list(cp.iter_clean_input_data(dirty_results, counts))
+
+    # The isolate is only cited by a main result that was dropped
+    assert counts == {
+        'mains_no_uid': 1,
+        'refs_no_uid': 1,
+        'mains_dropped': {'main_no_abstract', 'main_none_abstract'},
+        'refs_dropped': {'ref_none_abstract', 'ref_no_abstract'},
+        'isolates': 1
+    }
 
 
 ################################# get_unique_papers ###########################
@@ -124,6 +231,242 @@ def test_get_unique_papers(search_results, to_classify):
     assert result == to_classify
 
 
+######################### get_species_names_batched ###########################
+
+
+@pytest.fixture
+def ruler_nlp():
+    nlp = spacy.blank('en')
+    ruler = nlp.add_pipe('entity_ruler')
+    ruler.add_patterns([{
+        'label': 'LIVB',
+        'pattern': 'Arabidopsis thaliana'
+    }, {
+        'label': 'LIVB',
+        'pattern': 'maize'
+    }, {
+        'label': 'CHEM',
+        'pattern': 'water'
+    }])
+    return nlp
+
+
+@pytest.fixture
+def to_classify_batched():
+    return {
+        'paper1': {
+            'title': 'Drought in maize and Arabidopsis thaliana',
+            'abstract': 'Arabidopsis thaliana lost water faster than maize.'
+        },
+        'paper2': {
+            'title': 'Water loss in soils',
+            'abstract': None
+        },
+        'paper3': {
+            'title': 'Only water here',
+            'abstract': 'Still just water.'
+        }
+    }
+
+
+@pytest.fixture
+def batched_species():
+    return {
+        'paper1': ['Arabidopsis thaliana', 'maize'],
+        'paper2': [],
+        'paper3': []
+    }
+
+
+def test_get_species_names_batched(to_classify_batched, ruler_nlp,
+                                   batched_species):
+
+    result = cp.get_species_names_batched(to_classify_batched,
+                                          ruler_nlp,
+                                          batch_size=2)
+
+    assert result == batched_species
+
+
+################################ NER sharding #################################
+
+
+def test_get_shard_covers_papers_in_order(to_classify):
+
+    shards = [cp.get_shard(to_classify, i, 3) for i in range(3)]
+
+    assert [len(shard) for shard in shards] == [3, 3, 2]
+    assert [p for shard in shards for p in shard] == list(to_classify.keys())
+
+
+def test_merge_ner_shards(to_classify, tmp_path):
+
+    # Write the part files out of order to make sure merge order is fixed
+    for i in [2, 0, 1]:
+        shard = cp.get_shard(to_classify, i, 3)
+        with open(cp.get_shard_path(tmp_path, i, 3), 'w') as myf:
+            json.dump({'species': {p: [f'species_{p}'] for p in shard}}, myf)
+
+    result = cp.merge_ner_shards(to_classify, tmp_path, 3)
+
+    assert list(result.keys()) == list(to_classify.keys())
+    assert result['paper5'] == ['species_paper5']
+
+
+def test_merge_ner_shards_skipped(to_classify, tmp_path):
+
+    for i in range(2):
+        shard = cp.get_shard(to_classify, i, 2)
+        with open(cp.get_shard_path(tmp_path, i, 2), 'w') as myf:
+            json.dump(
+                {
+                    'species': {
+                        p: None if p == 'paper2' else []
+                        for p in shard
+                    }
+                }, myf)
+
+    result, skipped = cp.merge_ner_shards(to_classify,
+                                          tmp_path,
+                                          2,
+                                          return_skipped=True)
+
+    assert skipped == {'paper2'}
+    assert result['paper2'] == []
+
+
+def write_ner_shards(to_classify, tmp_path, num_shards, ner_settings):
+    """
+    Write part files with the given settings, as run_ner_shard would.
+    """
+    for i in range(num_shards):
+        shard = cp.get_shard(to_classify, i, num_shards)
+        part = {
+            'settings': ner_settings,
+            'text_hashes': {
+                p: hash_text(cp.get_paper_text(d))
+                for p, d in shard.items()
+            },
+            'species': {p: [f'species_{p}'] for p in shard}
+        }
+        with open(cp.get_shard_path(tmp_path, i, num_shards), 'w') as myf:
+            json.dump(part, myf)
+
+
+def test_is_valid_ner_shard(to_classify, tmp_path):
+
+    settings = {'model': 'ner:en_test-1.0:quantized'}
+    write_ner_shards(to_classify, tmp_path, 2, settings)
+    shard = cp.get_shard(to_classify, 0, 2)
+    shard_path = cp.get_shard_path(tmp_path, 0, 2)
+    changed = {p: dict(d) for p, d in shard.items()}
+    changed['paper1']['abstract'] = 'A corrected abstract.'
+
+    assert cp.is_valid_ner_shard(shard, shard_path, settings)
+    assert not cp.is_valid_ner_shard(shard, shard_path,
+                                     {'model': 'ner:en_test-1.0'})
+    assert not cp.is_valid_ner_shard(changed, shard_path, settings)
+    assert not cp.is_valid_ner_shard(shard, cp.get_shard_path(tmp_path, 2, 3),
+                                     settings)
+
+
+def test_get_species_names_sharded_reused_not_cached(to_classify, tmp_path):
+
+    settings = {'model': 'ner:en_test-1.0'}
+    write_ner_shards(to_classify, tmp_path, 2, settings)
+    cache_path = str(tmp_path / 'cache.db')
+
+    result = cp.get_species_names_sharded(to_classify, 2, str(tmp_path), True,
+                                          False, 32, cache_path, settings)
+
+    ner_cache = ResultCache(cache_path, settings['model'])
+    cached = ner_cache.get_many(
+        {hash_text(cp.get_paper_text(d))
+         for d in to_classify.values()})
+    ner_cache.close()
+    assert result['paper5'] == ['species_paper5']
+    assert cached == {}
+
+
+################################# NER cache ###################################
+
+
+def test_get_species_names_cached(to_classify_batched, ruler_nlp,
+                                  batched_species, tmp_path):
+
+    cache_path = str(tmp_path / 'cache.db')
+    first = cp.get_species_names_cached(to_classify_batched, ruler_nlp,
+                                        cache_path)
+
+    # Take the patterns out of the ruler; cached papers shouldn't be re-run
+    ruler_nlp.get_pipe('entity_ruler').clear()
+    to_classify_batched['paper4'] = {
+        'title': 'New maize paper',
+        'abstract': None
+    }
+    second = cp.get_species_names_cached(to_classify_batched, ruler_nlp,
+                                         cache_path)
+
+    assert first == batched_species
+    assert second == {**batched_species, 'paper4': []}
+
+
+def test_get_species_names_cached_prefilter(to_classify_batched, ruler_nlp,
+                                            batched_species, tmp_path):
+
+    cache_path = str(tmp_path / 'cache.db')
+    prefilter = TaxonPrefilter(['maize'])
+    result = cp.get_species_names_cached(to_classify_batched,
+                                         ruler_nlp,
+                                         cache_path,
+                                         prefilter=prefilter)
+
+    # Skipped papers aren't cached, so a run without the prefilter has to
+    # pass them through NER
+    ner_cache = ResultCache(cache_path, cp.get_ner_namespace(ruler_nlp))
+    cached = ner_cache.get_many([
+        hash_text(cp.get_paper_text(paper_dict))
+        for paper_dict in to_classify_batched.values()
+    ])
+
+    assert result == batched_species
+    assert list(result.keys()) == list(to_classify_batched.keys())
+    assert list(cached.values()) == [batched_species['paper1']]
+
+
+def test_get_species_names_cached_prefilter_keeps_cached(ruler_nlp, tmp_path):
+
+    cache_path = str(tmp_path / 'cache.db')
+    to_classify = {'paper4': {'title': 'New maize paper', 'abstract': None}}
+    _ = cp.get_species_names_cached(to_classify, ruler_nlp, cache_path)
+
+    # The prefilter would skip this paper, but its result is already cached
+    ruler_nlp.get_pipe('entity_ruler').clear()
+    result, skipped = cp.get_species_names_cached(
+        to_classify,
+        ruler_nlp,
+        cache_path,
+        prefilter=TaxonPrefilter([]),
+        return_skipped=True)
+
+    assert result == {'paper4': ['maize']}
+    assert skipped == set()
+
+
+################################# link_taxoniq ################################
+
+
+def test_link_taxoniq_only_unlinked():
+
+    # The linked ID is made up to check it isn't overwritten by taxoniq
+    species_ids = {'Zea mays': '1'}
+    uniq_names = ['Zea mays', 'Saccharomyces cerevisiae', 'not a species']
+
+    result = cp.link_taxoniq(uniq_names, species_ids)
+
+    assert result == {'Zea mays': '1', 'Saccharomyces cerevisiae': 4932}
+
+
 ################################## make_ent_doc ###############################
 
 
@@ -159,11 +502,10 @@ def test_make_ent_docs_one_doc(nlp, uniq_names_one_doc):
     assert result_ent_list == uniq_names_one_doc
     assert result_num_ents == len(uniq_names_one_doc)
 
-def test_make_ent_docs_multi_doc(nlp, uniq_names_multi_doc):
+def test_make_ent_docs_multi_doc(nlp, uniq_names_multi_doc, monkeypatch):
 
-    # NOTE: This test is very memory intensive, takes about an hour in this
-    # form. Another option is to go into classify_papers.py and change all
-    # instances of 1000000 to 100; then change the above 250000 to just 25
+    # Lower the character limit so that 25 names are split into 3 docs
+    monkeypatch.setattr(cp, 'ENT_DOC_MAX_CHARS', 100)
     result = cp.make_ent_docs(uniq_names_multi_doc, nlp)
 
     result_ent_list = [e.text for res in result for e in res.ents]
@@ -175,6 +517,199 @@ def test_make_ent_docs_multi_doc(nlp, uniq_names_multi_doc):
     assert result_num_ents == len(uniq_names_multi_doc)
 
 
+@pytest.fixture
+def blank_nlp():
+    return spacy.blank('en')
+
+
+@pytest.fixture
+def uniq_names_tricky_tokens():
+    return [
+        'E. coli', "Drosophila melanogaster's", 'Mus musculus (mouse)',
+        'Arabidopsis', 'C.elegans'
+    ]
+
+
+def test_make_ent_docs_tricky_tokens(blank_nlp, uniq_names_tricky_tokens):
+
+    result = cp.make_ent_docs(uniq_names_tricky_tokens, blank_nlp)
+
+    assert len(result) == 1
+    assert [e.text for e in result[0].ents] == uniq_names_tricky_tokens
+    assert all(e.label_ == 'ENTITY' for e in result[0].ents)
+
+
+def test_make_ent_docs_keeps_every_name(blank_nlp, uniq_names_multi_doc,
+                                        monkeypatch):
+
+    monkeypatch.setattr(cp, 'ENT_DOC_MAX_CHARS', 100)
+    result = cp.make_ent_docs(uniq_names_multi_doc, blank_nlp)
+
+    assert [len(doc.ents) for doc in result] == [10, 10, 5]
+    assert [e.text for doc in result
+            for e in doc.ents] == uniq_names_multi_doc
+
+
+############################## parallel linking ###############################
+
+
+def fake_linker(doc):
+    # Stands in for the EntityLinker: links every entity to A. thaliana, and
+    # checks that lemmas survive serialization
+    for ent in doc.ents:
+        assert ent[0].lemma_ == ent[0].text.lower()
+        ent._.kb_ents = [('NCBI:3702', ent.text, 1.0)]
+    return doc
+
+
+def test_link_doc_bytes(blank_nlp, uniq_names_tricky_tokens, monkeypatch):
+
+    spacy.tokens.Span.set_extension('kb_ents', default=[], force=True)
+    monkeypatch.setattr(cp, 'link_worker_linker', fake_linker)
+    doc = cp.make_ent_docs(uniq_names_tricky_tokens, blank_nlp)[0]
+    for tok in doc:
+        tok.lemma_ = tok.text.lower()
+
+    result = cp.link_doc_bytes(doc.to_bytes(exclude=['user_data']))
+
+    assert result == [(name, '3702') for name in uniq_names_tricky_tokens]
+
+
+################################# link cache ##################################
+
+
+class RecordingLinker():
+    # Stands in for the EntityLinker: links everything but "Nonsense", and
+    # records which entities it was asked to link
+    def __init__(self):
+        self.seen = []
+        spacy.tokens.Span.set_extension('kb_ents', default=[], force=True)
+
+    def __call__(self, doc):
+        self.seen.extend([ent.text for ent in doc.ents])
+        linked = [ent for ent in doc.ents if ent.text != 'Nonsense']
+        for ent in linked:
+            ent._.kb_ents = [(f'NCBI:{len(ent.text)}', ent.text, 1.0)]
+        doc.set_ents(linked)
+        return doc
+
+
+def test_link_names_cached(blank_nlp, tmp_path):
+
+    cache_path = str(tmp_path / 'cache.db')
+    linker = RecordingLinker()
+    first = cp.link_names_cached(['Zea mays', 'Nonsense'], blank_nlp, linker,
+                                 cache_path)
+    linker.seen = []
+
+    second = cp.link_names_cached(['Zea  mays', 'Nonsense', 'Oryza sativa'],
+                                  blank_nlp, linker, cache_path)
+
+    assert first == {'Zea mays': '8'}
+    assert second == {'Zea  mays': '8', 'Oryza sativa': '12'}
+    assert linker.seen == ['Oryza sativa']
+
+
+######################## incremental reclassification #########################
+
+
+@pytest.fixture
+def incremental_results():
+    return [{
+        'UID':
+        'paperA',
+        'title':
+        'Drought in maize',
+        'abstract':
+        'Maize lost water.',
+        'references': [{
+            'UID': 'paperB',
+            'title': 'Desiccation of seeds',
+            'abstract': 'Dry seeds survive.'
+        }]
+    }, {
+        'UID': 'paperC',
+        'title': 'Tardigrade anhydrobiosis',
+        'abstract': None,
+        'references': []
+    }]
+
+
+def test_generate_classified_dict_incremental(incremental_results, ruler_nlp,
+                                              tmp_path, monkeypatch):
+
+    calls = {'ner': [], 'classify': []}
+    get_species_names_cached = cp.get_species_names_cached
+    map_paper_species = cp.map_paper_species
+
+    def record_ner(to_run, *args):
+        calls['ner'].append(sorted(to_run))
+        return get_species_names_cached(to_run, *args)
+
+    def record_classify(to_classify, *args):
+        calls['classify'].append(sorted(to_classify))
+        return map_paper_species(to_classify, *args)
+
+    monkeypatch.setattr(cp, 'get_species_names_cached', record_ner)
+    monkeypatch.setattr(cp, 'map_paper_species', record_classify)
+    monkeypatch.setattr(cp, 'map_specs_to_kings',
+                        lambda ids, cache_path='': {n: 'Plant' for n in ids})
+
+    def run(generic_dict, use_intermed):
+        return cp.generate_classified_dict(incremental_results, None,
+                                           ruler_nlp, RecordingLinker(),
+                                           str(tmp_path), use_intermed,
+                                           generic_dict, 'UID', False)
+
+    first = run({'seeds': 'Plant'}, False)
+    second = run({'seeds': 'Plant'}, True)
+    third = run({'seeds': 'Plant', 'Tardigrade': 'Animal'}, True)
+
+    assert first == {'paperA': 'Plant', 'paperB': 'Plant', 'paperC': 'NOCLASS'}
+    assert second == first
+    assert third == {'paperA': 'Plant', 'paperB': 'Plant', 'paperC': 'Animal'}
+    # NER only ran the first time, and the term map change only reclassified
+    # the papers without species
+    assert calls['ner'] == [['paperA', 'paperB', 'paperC']]
+    assert calls['classify'] == [['paperA', 'paperB', 'paperC'],
+                                 ['paperB', 'paperC']]
+
+
+def test_generate_classified_dict_missing_evidence(incremental_results,
+                                                   ruler_nlp, tmp_path,
+                                                   monkeypatch):
+
+    calls = []
+    map_paper_species = cp.map_paper_species
+
+    def record_classify(to_classify, *args):
+        calls.append(sorted(to_classify))
+        return map_paper_species(to_classify, *args)
+
+    monkeypatch.setattr(cp, 'map_paper_species', record_classify)
+    monkeypatch.setattr(cp, 'map_specs_to_kings',
+                        lambda ids, cache_path='': {n: 'Plant' for n in ids})
+
+    def run(use_intermed):
+        return cp.generate_classified_dict(incremental_results, None,
+                                           ruler_nlp, RecordingLinker(),
+                                           str(tmp_path), use_intermed,
+                                           {'seeds': 'Plant'}, 'UID', False)
+
+    first = run(False)
+    # As if the classifications were saved before evidence was
+    (tmp_path / 'paper_evidence.json').unlink()
+    second = run(True)
+
+    with open(tmp_path / 'paper_evidence.json') as myf:
+        evidence = json.load(myf)
+    assert second == first
+    assert set(evidence.keys()) == set(first.keys())
+    assert cp.revote_classifications(evidence) == first
+    assert calls == [['paperA', 'paperB', 'paperC'],
+                     ['paperA', 'paperB', 'paperC']]
+
+
 ################################ map_specs_to_kings ###########################
 
 
@@ -275,6 +810,126 @@ def test_map_paper_species_without_generic(paper_spec_names, species_dict,
     assert result == classified_without_generic
 
 
+def test_map_paper_species_dictionary_first(species_dict):
+
+    paper_spec_names = {'paper1': [], 'paper2': ['Unlinked species']}
+    to_classify = {
+        'paper1': {
+            'title': 'Drying of brine shrimp cysts',
+            'abstract': 'We study vegetative tissue too.'
+        },
+        'paper2': {
+            'title': 'Seed storage in maize',
+            'abstract': None
+        }
+    }
+    matcher = DictionaryKingdomMatcher({
+        'brine shrimp': 'Animal',
+        'maize': 'Plant'
+    })
+
+    result = cp.map_paper_species(paper_spec_names, species_dict,
+                                  {'vegetative': 'Plant'}, to_classify,
+                                  matcher)
+
+    assert result == {'paper1': 'Animal', 'paper2': 'Plant'}
+
+
+############################### paper evidence ################################
+
+
+class CountingMatcher(DictionaryKingdomMatcher):
+    """
+    Dictionary matcher that counts how many texts it has searched.
+    """
+    num_calls = 0
+
+    def find_terms(self, text):
+        self.num_calls += 1
+        return super().find_terms(text)
+
+
+class CountingFuzzyMatcher(FuzzyKingdomMatcher):
+    """
+    Fuzzy matcher that counts how many texts it has searched.
+    """
+    num_calls = 0
+
+    def find_terms(self, text):
+        self.num_calls += 1
+        return super().find_terms(text)
+
+
+def test_get_paper_evidence_runs_matchers_once(species_dict):
+
+    paper_dict = {'title': 'Drying vegetative tissue', 'abstract': None}
+    dictionary_matcher = CountingMatcher({'maize': 'Plant'})
+    generic_matcher = CountingFuzzyMatcher({'vegetative': 'Plant'})
+
+    # Species that doesn't map to a kingdom, so both fallbacks run
+    evidence = cp.get_paper_evidence(['Unlinked species'], species_dict,
+                                     paper_dict, generic_matcher,
+                                     dictionary_matcher)
+
+    assert dictionary_matcher.num_calls == 1
+    assert generic_matcher.num_calls == 1
+    assert evidence == {
+        'species': [['Unlinked species', None]],
+        'dictionary': [],
+        'fuzzy': [['vegetative', 'Plant']]
+    }
+
+
+def test_get_paper_evidence_skips_fallbacks(species_dict):
+
+    paper_dict = {'title': 'Maize and A. thaliana', 'abstract': None}
+    dictionary_matcher = CountingMatcher({'maize': 'Plant'})
+
+    evidence = cp.get_paper_evidence(['A. thaliana'], species_dict,
+                                     paper_dict, None, dictionary_matcher)
+
+    assert dictionary_matcher.num_calls == 0
+    assert evidence['dictionary'] is None
+    assert evidence['fuzzy'] is None
+
+
+def test_vote_kingdom():
+
+    evidence = {
+        'species': [['a', 'Microbe'], ['b', 'Plant'], ['c', None]],
+        'dictionary': None,
+        'fuzzy': None
+    }
+    fallback = {
+        'species': [['c', None]],
+        'dictionary': [],
+        'fuzzy': [['Tardigrade', 'Animal']]
+    }
+    empty = {'species': [], 'dictionary': [], 'fuzzy': []}
+
+    assert cp.vote_kingdom(evidence) == 'Microbe'
+    assert cp.vote_kingdom(fallback) == 'Animal'
+    assert cp.vote_kingdom(empty) == 'NOCLASS'
+
+
+def test_revote_from_saved_evidence(paper_spec_names, species_dict,
+                                    to_classify_with_names,
+                                    classified_with_generic):
+
+    classified, paper_evidence = cp.map_paper_species(
+        paper_spec_names, species_dict, {'vegetative': 'Plant'},
+        to_classify_with_names, return_evidence=True)
+    saved = json.loads(json.dumps(paper_evidence))
+
+    assert classified == classified_with_generic
+    assert saved['paper3']['fuzzy'] == [['vegetative', 'Plant']]
+    assert cp.revote_classifications(saved) == classified
+    assert cp.revote_classifications(
+        saved, lambda ev: 'NOCLASS' if ev['fuzzy'] else ev['kingdom']) == {
+            **classified, 'paper3': 'NOCLASS'
+        }
+
+
 ############################fuzzy_match_kingdoms ############################
 @pytest.fixture
 def generic_dict():
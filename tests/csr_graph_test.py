@@ -0,0 +1,139 @@
+"""
+Tests for csr_graph.py
+
+Author: Serena G. Lotreck
+"""
+import pytest
+import sys
+import networkx as nx
+import numpy as np
+
+sys.path.append('../desiccation_network/conference_recommendation')
+from csr_graph import CSRCitationGraph
+
+
+@pytest.fixture
+def nx_graph():
+    nodes = [('p1', {
+        'study_system': 'Plant',
+        'title': 'Paper 1'
+    }), ('p2', {
+        'study_system': 'Plant'
+    }), ('a1', {
+        'study_system': 'Animal',
+        'title': 'Paper 3'
+    }), ('m1', {
+        'study_system': 'Microbe'
+    }), ('n1', {})]
+    edges = [('p1', 'p2'), ('p1', 'a1'), ('p1', 'a1'), ('a1', 'm1'),
+             ('m1', 'p1'), ('n1', 'p1')]
+    graph = nx.MultiDiGraph()
+    _ = graph.add_nodes_from(nodes)
+    _ = graph.add_edges_from(edges)
+
+    return graph
+
+
+@pytest.fixture
+def csr_graph(nx_graph):
+    return CSRCitationGraph.from_networkx(nx_graph)
+
+
+############################### construction ###################################
+
+
+def test_from_networkx_nodes(nx_graph, csr_graph):
+
+    assert csr_graph.nodes(data=True) == list(nx_graph.nodes(data=True))
+    assert csr_graph.number_of_nodes() == nx_graph.number_of_nodes()
+    assert csr_graph.number_of_edges() == nx_graph.number_of_edges()
+
+
+def test_from_networkx_categorical(csr_graph):
+
+    codes, categories = csr_graph.get_codes('study_system')
+
+    assert codes.tolist() == [0, 0, 1, 2, -1]
+    assert categories == ['Plant', 'Animal', 'Microbe']
+    assert 'title' in csr_graph.node_attrs
+
+
+def test_from_arrays(nx_graph, csr_graph):
+
+    node_ids = ['p1', 'p2', 'a1', 'm1', 'n1']
+    node_attrs = {
+        'study_system': ['Plant', 'Plant', 'Animal', 'Microbe', None],
+        'title': ['Paper 1', None, 'Paper 3', None, None]
+    }
+    src = np.array([0, 0, 0, 2, 3, 4])
+    dst = np.array([1, 2, 2, 3, 0, 0])
+
+    result = CSRCitationGraph.from_arrays(node_ids, node_attrs, src, dst)
+
+    assert result.nodes(data=True) == csr_graph.nodes(data=True)
+    assert (result.adjacency != csr_graph.adjacency).nnz == 0
+
+
+def test_to_networkx(nx_graph, csr_graph):
+
+    result = csr_graph.to_networkx()
+
+    assert list(result.nodes(data=True)) == list(nx_graph.nodes(data=True))
+    assert sorted(result.edges()) == sorted(nx_graph.edges())
+
+
+############################## graph operations ################################
+
+
+def test_degrees(nx_graph, csr_graph):
+
+    for node in nx_graph.nodes:
+        assert csr_graph.out_degree(node) == nx_graph.out_degree(node)
+        assert csr_graph.in_degree(node) == nx_graph.in_degree(node)
+    assert csr_graph.out_degree().tolist() == [
+        nx_graph.out_degree(n) for n in nx_graph.nodes
+    ]
+    assert csr_graph.in_degree().tolist() == [
+        nx_graph.in_degree(n) for n in nx_graph.nodes
+    ]
+
+
+def test_in_degree_cached(nx_graph, csr_graph):
+
+    degrees = csr_graph.in_degree()
+    degrees[:] = 0
+
+    # Changing the returned array doesn't change the cached in-degrees
+    assert csr_graph.in_degree().tolist() == [
+        nx_graph.in_degree(n) for n in nx_graph.nodes
+    ]
+    for node in nx_graph.nodes:
+        assert csr_graph.in_degree(node) == nx_graph.in_degree(node)
+
+
+def test_neighbors(nx_graph, csr_graph):
+
+    for node in nx_graph.nodes:
+        assert sorted(csr_graph.neighbors(node)) == sorted(
+            nx_graph.neighbors(node))
+
+
+def test_edges(nx_graph, csr_graph):
+
+    assert sorted(csr_graph.edges()) == sorted(nx_graph.edges)
+    assert sorted(csr_graph.iter_edge_counts()) == [('a1', 'm1', 1),
+                                                    ('m1', 'p1', 1),
+                                                    ('n1', 'p1', 1),
+                                                    ('p1', 'a1', 2),
+                                                    ('p1', 'p2', 1)]
+
+
+def test_subgraph(nx_graph, csr_graph):
+
+    keep = ['p1', 'a1', 'm1', 'not_a_node']
+
+    result = csr_graph.subgraph(keep)
+    expected = nx_graph.subgraph(keep)
+
+    assert result.nodes(data=True) == list(expected.nodes(data=True))
+    assert sorted(result.edges()) == sorted(expected.edges)
@@ -0,0 +1,56 @@
+"""
+Spot checks for graph_builder.py
+
+Author: Serena G. Lotreck
+"""
+import pytest
+import sys
+
+sys.path.append('../desiccation_network/build_citation_network/')
+from graph_builder import CitationGraphBuilder
+
+
+@pytest.fixture
+def builder():
+    builder = CitationGraphBuilder()
+    builder.add_paper('paper1', {'title': 'one'}, [('paper2', {
+        'title': 'two'
+    }), ('paper3', {
+        'title': 'three'
+    })])
+    builder.add_paper('paper2', {'title': 'two, again'},
+                      [('paper3', {
+                          'title': 'three'
+                      }), ('paper3', {
+                          'title': 'three'
+                      })])
+    return builder
+
+
+def test_nodes_are_deduplicated(builder):
+
+    assert builder.get_nodes() == [('paper1', {
+        'title': 'one'
+    }), ('paper2', {
+        'title': 'two, again'
+    }), ('paper3', {
+        'title': 'three'
+    })]
+
+
+def test_to_networkx(builder):
+
+    citenet = builder.to_networkx()
+
+    assert list(citenet.edges(keys=True)) == [('paper1', 'paper2', 0),
+                                              ('paper1', 'paper3', 1),
+                                              ('paper2', 'paper3', 2),
+                                              ('paper2', 'paper3', 3)]
+
+
+def test_to_sparse(builder):
+
+    adjacency, node_ids = builder.to_sparse()
+
+    assert node_ids == ['paper1', 'paper2', 'paper3']
+    assert adjacency.toarray().tolist() == [[0, 1, 1], [0, 0, 2], [0, 0, 0]]
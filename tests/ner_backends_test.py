@@ -0,0 +1,77 @@
+"""
+Tests for ner_backends.py
+
+Author: Serena G. Lotreck
+"""
+import pytest
+import sys
+import torch
+from thinc.api import PyTorchWrapper
+
+sys.path.append('../desiccation_network/build_citation_network')
+from ner_backends import quantize_thinc_model, compare_ner_outputs
+
+################################ quantize_thinc_model ##########################
+
+
+@pytest.fixture
+def wrapped_model():
+    torch.manual_seed(1234)
+    module = torch.nn.Sequential(torch.nn.Linear(16, 32), torch.nn.ReLU(),
+                                 torch.nn.Linear(32, 4))
+    return PyTorchWrapper(module)
+
+
+def test_quantize_thinc_model(wrapped_model):
+
+    X = torch.randn(8, 16)
+    before = wrapped_model.shims[0]._model(X).detach()
+
+    num_quantized = quantize_thinc_model(wrapped_model)
+
+    after = wrapped_model.shims[0]._model(X).detach()
+    assert num_quantized == 1
+    assert all(not isinstance(layer, torch.nn.Linear) or
+               type(layer).__module__.startswith('torch.ao.nn.quantized')
+               for layer in wrapped_model.shims[0]._model)
+    assert torch.allclose(before, after, atol=0.05)
+
+
+################################ compare_ner_outputs ###########################
+
+
+@pytest.fixture
+def reference():
+    return {
+        'paper1': ['Arabidopsis thaliana', 'maize'],
+        'paper2': ['E. coli', 'E. coli'],
+        'paper3': []
+    }
+
+
+def test_compare_ner_outputs_identical(reference):
+
+    metrics = compare_ner_outputs(reference, reference)
+
+    assert metrics['precision'] == 1.0
+    assert metrics['recall'] == 1.0
+    assert metrics['f1'] == 1.0
+    assert metrics['identical_papers'] == 1.0
+
+
+def test_compare_ner_outputs_different(reference):
+
+    predicted = {
+        'paper1': ['Arabidopsis thaliana'],
+        'paper2': ['E. coli', 'yeast'],
+        'paper3': []
+    }
+
+    metrics = compare_ner_outputs(reference, predicted)
+
+    assert metrics['num_reference_names'] == 4
+    assert metrics['num_predicted_names'] == 3
+    assert metrics['precision'] == pytest.approx(2 / 3)
+    assert metrics['recall'] == pytest.approx(2 / 4)
+    assert metrics['f1'] == pytest.approx(4 / 7)
+    assert metrics['identical_papers'] == pytest.approx(1 / 3)
@@ -0,0 +1,61 @@
+"""
+Spot checks for network_io.py
+
+Author: Serena G. Lotreck
+"""
+import pytest
+import sys
+import networkx as nx
+
+sys.path.append('../desiccation_network/build_citation_network/')
+import network_io as nio
+
+
+@pytest.fixture
+def citenet():
+    citenet = nx.MultiDiGraph()
+    citenet.add_nodes_from([('paper1', {
+        'title': 'Drought in maïze',
+        'study_system': 'Plant'
+    }), ('paper2', {
+        'title': '',
+        'study_system': 'NOCLASS'
+    }), ('paper3', {
+        'title': 'No class attribute'
+    })])
+    citenet.add_edges_from([('paper1', 'paper2', 0), ('paper1', 'paper3', 1),
+                            ('paper1', 'paper3', 2)])
+    return citenet
+
+
+def test_encode_decode_strings():
+
+    strings = ['maïze', '', 'Arabidopsis thaliana']
+
+    blob, offsets = nio.encode_strings(strings)
+
+    assert nio.decode_strings(blob, offsets) == strings
+
+
+def test_npz_round_trip(citenet, tmp_path):
+
+    path = str(tmp_path / 'citenet.npz')
+    nio.write_network(citenet, path)
+
+    result = nio.read_network(path)
+
+    assert list(result.nodes(data=True)) == list(citenet.nodes(data=True))
+    assert list(result.edges(keys=True)) == list(citenet.edges(keys=True))
+
+
+def test_graphml_export(citenet, tmp_path):
+
+    npz_path = str(tmp_path / 'citenet.npz')
+    graphml_path = str(tmp_path / 'citenet.graphml')
+    nio.write_network(citenet, npz_path)
+
+    nio.main(npz_path, graphml_path)
+    result = nio.read_network(graphml_path)
+
+    assert list(result.nodes(data=True)) == list(citenet.nodes(data=True))
+    assert result.number_of_edges() == citenet.number_of_edges()
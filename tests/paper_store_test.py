@@ -0,0 +1,136 @@
+"""
+Tests for paper_store.py
+
+Author: Serena G. Lotreck
+"""
+import pytest
+import sys
+import os
+from random import sample
+import jsonlines
+
+sys.path.append('../desiccation_network/build_citation_network')
+from paper_store import PaperStore, PaperSubset, load_papers
+
+
+@pytest.fixture
+def papers():
+    return [{
+        'UID': 'WOS:1',
+        'title': 'Desiccation tolerance in mosses',
+        'abstract': 'Mosses survive drying.',
+        'authors': [{
+            'wos_standard': 'Lotreck, S'
+        }]
+    }, {
+        'UID': 'WOS:2',
+        'title': 'Tardigrades',
+        'references': [{
+            'UID': 'WOS:1'
+        }]
+    }, {
+        'UID': 'WOS:3',
+        'title': 'Anhydrobiosis',
+        'abstract': 'Nematodes survive drying.',
+        'authors': []
+    }]
+
+
+@pytest.fixture
+def jsonl_path(papers, tmp_path):
+    path = tmp_path / 'papers.jsonl'
+    with jsonlines.open(path, 'w') as writer:
+        writer.write_all(papers)
+    return str(path)
+
+
+@pytest.fixture
+def store(jsonl_path, tmp_path):
+    store = PaperStore.from_jsonl(jsonl_path, str(tmp_path / 'papers.db'))
+    yield store
+    store.close()
+
+
+def test_store_sequence(papers, store):
+
+    assert len(store) == 3
+    assert list(store) == papers
+    assert store[1] == papers[1]
+    assert store[-1] == papers[-1]
+    assert store[:2] == papers[:2]
+    with pytest.raises(IndexError):
+        store[3]
+
+
+def test_store_get(papers, store):
+
+    assert store.get('WOS:2') == papers[1]
+    assert store.get('WOS:4') is None
+
+
+def test_store_columns(store):
+
+    assert list(store.iter_uids()) == ['WOS:1', 'WOS:2', 'WOS:3']
+    assert list(store.iter_abstracts()) == [
+        'Mosses survive drying.', None, 'Nematodes survive drying.'
+    ]
+    assert list(store.iter_authors()) == [[{
+        'wos_standard': 'Lotreck, S'
+    }], None, []]
+
+
+def test_store_views_are_copies(papers, store):
+
+    paper = store[0]
+    paper['title'] = 'Changed'
+
+    assert store[0] == papers[0]
+
+
+def test_store_sample(papers, store):
+
+    assert all(p in papers for p in sample(store, 2))
+
+
+def test_from_jsonl_reuses_store(papers, jsonl_path, tmp_path, capsys):
+
+    store_path = str(tmp_path / 'papers.db')
+    PaperStore.from_jsonl(jsonl_path, store_path).close()
+    _ = capsys.readouterr()
+
+    # Unchanged file isn't rebuilt
+    PaperStore.from_jsonl(jsonl_path, store_path).close()
+    assert capsys.readouterr().out == ''
+
+    # Changed file is
+    with jsonlines.open(jsonl_path, 'a') as writer:
+        writer.write({'UID': 'WOS:4', 'title': 'New paper'})
+    os.utime(jsonl_path, ns=(0, 0))
+    store = PaperStore.from_jsonl(jsonl_path, store_path)
+    assert 'Building paper store' in capsys.readouterr().out
+    assert len(store) == 4
+    store.close()
+
+
+def test_load_papers(papers, jsonl_path, tmp_path):
+
+    assert load_papers(jsonl_path) == papers
+    store = load_papers(jsonl_path, str(tmp_path / 'papers.db'))
+    assert isinstance(store, PaperStore)
+    assert list(store) == papers
+    store.close()
+
+
+################################ PaperSubset ##################################
+
+
+def test_paper_subset(papers, store):
+
+    subset = PaperSubset(store, [0, 2], lambda paper: paper['UID'])
+
+    assert len(subset) == 2
+    assert list(subset) == ['WOS:1', 'WOS:3']
+    assert subset[1] == 'WOS:3'
+    assert subset[-1] == 'WOS:3'
+    assert subset[:1] == ['WOS:1']
+    assert list(PaperSubset(store, [1])) == [papers[1]]
@@ -0,0 +1,61 @@
+"""
+Spot checks for result_cache.py
+
+Author: Serena G. Lotreck
+"""
+import pytest
+import sys
+
+sys.path.append('../desiccation_network/build_citation_network/')
+from result_cache import ResultCache, hash_text
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'cache.db')
+
+
+def test_hash_text():
+
+    assert hash_text('maize') == hash_text('maize')
+    assert hash_text('maize') != hash_text('Maize')
+
+
+def test_get_many_missing_keys(cache_path):
+
+    cache = ResultCache(cache_path, 'ner:test')
+    cache.put_many({'key1': ['maize'], 'key2': []})
+
+    assert cache.get_many(['key1', 'key2', 'key3']) == {
+        'key1': ['maize'],
+        'key2': []
+    }
+
+
+def test_namespaces_are_separate(cache_path):
+
+    cache1 = ResultCache(cache_path, 'ner:model-1.0')
+    cache1.put_many({'key1': ['maize']})
+    cache2 = ResultCache(cache_path, 'ner:model-2.0')
+
+    assert cache2.get_many(['key1']) == {}
+    assert len(cache1) == 1
+
+
+def test_results_persist(cache_path):
+
+    cache = ResultCache(cache_path, 'ner:test')
+    cache.put_many({'key1': ['maize']})
+    cache.close()
+    reopened = ResultCache(cache_path, 'ner:test')
+
+    assert reopened.get_many(['key1']) == {'key1': ['maize']}
+
+
+def test_get_many_large_query(cache_path):
+
+    cache = ResultCache(cache_path, 'ner:test')
+    results = {str(i): [i] for i in range(1200)}
+    cache.put_many(results)
+
+    assert cache.get_many(results.keys()) == results
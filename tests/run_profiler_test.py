@@ -0,0 +1,119 @@
+"""
+Tests for run_profiler.py
+
+Author: Serena G. Lotreck
+"""
+import pytest
+import sys
+import json
+import pstats
+import subprocess
+
+sys.path.append('../desiccation_network/build_citation_network')
+from run_profiler import RunProfiler
+
+
+def busy_work():
+    return sum(i * i for i in range(100000))
+
+
+def test_stage_records():
+
+    profiler = RunProfiler()
+
+    with profiler.stage('first', 10):
+        _ = busy_work()
+    with profiler.stage('second') as record:
+        record['items'] = 3
+
+    assert [s['name'] for s in profiler.stages] == ['first', 'second']
+    assert [s['items'] for s in profiler.stages] == [10, 3]
+    for stage in profiler.stages:
+        assert stage['wall_time'] >= 0
+        assert stage['cpu_time'] >= 0
+        assert stage['peak_rss_mb'] > 0
+    assert profiler.stages[0]['cpu_time'] > 0
+
+
+def test_stage_recorded_on_error():
+
+    profiler = RunProfiler()
+
+    with pytest.raises(ValueError):
+        with profiler.stage('fails'):
+            raise ValueError
+
+    assert profiler.stages[0]['name'] == 'fails'
+
+
+def test_save(tmp_path):
+
+    profiler = RunProfiler()
+    with profiler.stage('load', 5):
+        pass
+    report_path = tmp_path / 'report.json'
+
+    profiler.save(report_path)
+
+    with open(report_path) as myf:
+        report = json.load(myf)
+    assert report['stages'][0]['name'] == 'load'
+    assert report['stages'][0]['items'] == 5
+    assert report['total_wall_time'] >= report['stages'][0]['wall_time']
+
+
+def test_profile_dump(tmp_path):
+
+    profiler = RunProfiler(str(tmp_path))
+
+    with profiler.stage('busy'):
+        _ = busy_work()
+
+    profile_path = profiler.stages[0]['profile_path']
+    assert profile_path == str(tmp_path / '0_busy.prof')
+    stats = pstats.Stats(profile_path)
+    assert any(func[2] == 'busy_work' for func in stats.stats)
+
+
+def test_profile_dir_created(tmp_path):
+
+    profile_dir = tmp_path / 'new' / 'profiles'
+    profiler = RunProfiler(str(profile_dir))
+
+    with profiler.stage('busy'):
+        _ = busy_work()
+
+    assert (profile_dir / '0_busy.prof').is_file()
+
+
+def test_peak_rss_per_stage():
+
+    profiler = RunProfiler()
+
+    with profiler.stage('big'):
+        big = bytearray(200 * 1024 * 1024)
+        big[::4096] = b'x' * len(big[::4096])
+        del big
+    with profiler.stage('small'):
+        _ = busy_work()
+
+    big, small = profiler.stages
+    report = profiler.get_report()
+    assert big['peak_rss_mb'] >= 200
+    assert report['peak_rss_mb'] >= big['peak_rss_mb']
+    if small['peak_rss_scope'] == 'stage':
+        assert small['peak_rss_mb'] < big['peak_rss_mb'] - 100
+
+
+CHILD_CODE = ('big = bytearray(300 * 1024 * 1024); '
+              'big[::4096] = b"x" * len(big[::4096])')
+
+
+def test_peak_child_rss():
+
+    profiler = RunProfiler()
+
+    with profiler.stage('child'):
+        subprocess.run([sys.executable, '-c', CHILD_CODE], check=True)
+
+    assert profiler.stages[0]['peak_child_rss_mb'] >= 300
@@ -0,0 +1,56 @@
+"""
+Spot checks for stage_manifest.py
+
+Author: Serena G. Lotreck
+"""
+import pytest
+import sys
+
+sys.path.append('../desiccation_network/build_citation_network/')
+from stage_manifest import StageManifest
+
+
+@pytest.fixture
+def prev_results():
+    return {'paper1': ['maize'], 'paper2': [], 'paper3': ['yeast']}
+
+
+@pytest.fixture
+def item_hashes():
+    return {'paper1': 'a', 'paper2': 'b', 'paper3': 'c'}
+
+
+def test_get_valid_keys_changed_items(prev_results, item_hashes, tmp_path):
+
+    StageManifest(str(tmp_path)).update('ner', {'model': 'm1'}, item_hashes)
+    manifest = StageManifest(str(tmp_path))
+
+    result = manifest.get_valid_keys('ner', {'model': 'm1'}, {
+        'paper1': 'a',
+        'paper2': 'changed',
+        'paper4': 'd'
+    }, prev_results)
+
+    assert result == {'paper1'}
+
+
+def test_get_valid_keys_changed_settings(prev_results, item_hashes, tmp_path):
+
+    manifest = StageManifest(str(tmp_path))
+    manifest.update('ner', {'model': 'm1'}, item_hashes)
+
+    result = manifest.get_valid_keys('ner', {'model': 'm2'}, item_hashes,
+                                     prev_results)
+
+    assert result == set()
+
+
+def test_get_valid_keys_untracked(prev_results, item_hashes, tmp_path):
+
+    manifest = StageManifest(str(tmp_path))
+
+    untracked = manifest.get_valid_keys('ner', {}, item_hashes, prev_results)
+    unsaved = manifest.get_valid_keys('ner', {}, item_hashes, None)
+
+    assert untracked == {'paper1', 'paper2', 'paper3'}
+    assert unsaved == set()
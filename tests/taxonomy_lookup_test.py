@@ -0,0 +1,76 @@
+"""
+Spot checks for taxonomy_lookup.py
+
+Author: Serena G. Lotreck
+"""
+import pytest
+import sys
+
+sys.path.append('../desiccation_network/build_citation_network/')
+import taxonomy_lookup as tl
+
+
+@pytest.fixture
+def tax_ids():
+    # Arabidopsis thaliana and lyrata share a genus, S. cerevisiae is a fungus,
+    # E. coli a bacterium, Eukaryota has no kingdom and the last isn't an ID
+    return [3702, 59689, 3702, 4932, 562, 2759, 999999999]
+
+
+@pytest.fixture
+def outcomes():
+    return {
+        3702: 'Plant',
+        59689: 'Plant',
+        4932: 'Fungi',
+        562: 'Microbe',
+        2759: tl.NO_SUB_EUKARYOTA,
+        999999999: tl.NOT_FOUND
+    }
+
+
+def test_resolve_many(tax_ids, outcomes):
+
+    resolver = tl.KingdomResolver()
+
+    result = resolver.resolve_many(tax_ids)
+
+    assert result == outcomes
+
+
+def test_resolve_short_circuits_on_ancestor():
+
+    resolver = tl.KingdomResolver()
+    _ = resolver.resolve(3702)
+
+    # The genus and kingdom were memoised on the way up
+    assert resolver.memo[3701] == 'Plant'
+    assert resolver.memo[33090] == 'Plant'
+    # Eukaryota is above the kingdom, so it's not
+    assert 2759 not in resolver.memo
+
+
+def test_resolve_many_persists(tax_ids, outcomes, tmp_path, monkeypatch):
+
+    cache_path = str(tmp_path / 'cache.db')
+    _ = tl.KingdomResolver(cache_path).resolve_many(tax_ids)
+    # Everything should come from the cache without touching the taxonomy
+    monkeypatch.setattr(tl.taxoniq, 'Taxon', None)
+
+    result = tl.KingdomResolver(cache_path).resolve_many(tax_ids)
+
+    assert result == outcomes
+
+
+def test_lookup_scientific_names_cached(tmp_path, monkeypatch):
+
+    cache_path = str(tmp_path / 'cache.db')
+    names = ['Saccharomyces cerevisiae', 'not a species',
+             'Saccharomyces cerevisiae']
+    first = tl.lookup_scientific_names(names, cache_path)
+    monkeypatch.setattr(tl.taxoniq, 'Taxon', None)
+
+    second = tl.lookup_scientific_names(names, cache_path)
+
+    assert first == {'Saccharomyces cerevisiae': 4932, 'not a species': None}
+    assert second == first
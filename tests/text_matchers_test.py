@@ -0,0 +1,208 @@
+"""
+Spot checks for text_matchers.py
+
+Author: Serena G. Lotreck
+"""
+import pytest
+import sys
+import json
+import random
+import string
+import regex
+
+sys.path.append('../desiccation_network/build_citation_network/')
+from text_matchers import (FuzzyKingdomMatcher, TaxonPrefilter,
+                           DictionaryKingdomMatcher, split_common_name,
+                           read_common_names, get_name_forms)
+
+############################ FuzzyKingdomMatcher ##############################
+
+
+@pytest.fixture
+def generic_dict():
+    with open('../desiccation_network/build_citation_network/maps/'
+              'term_map.json') as myf:
+        return json.load(myf)
+
+
+def reference_match(text, generic_dict):
+    """
+    Per-term regex search that FuzzyKingdomMatcher has to agree with.
+    """
+    classes = []
+    for term, king in generic_dict.items():
+        sub_len = len(term) // 3
+        spacejoined = r"\s+".join(term.split())
+        reg = fr'\b({spacejoined}){{e<={sub_len}}}\b'
+        if regex.search(reg, text, flags=regex.IGNORECASE) is not None:
+            classes.append(king)
+    return classes
+
+
+def perturb(term, num_errors):
+    """
+    Randomly substitute, insert or delete characters in a term.
+    """
+    chars = list(term)
+    for _ in range(num_errors):
+        pos = random.randrange(len(chars))
+        op = random.choice(['sub', 'ins', 'del'])
+        if op == 'sub':
+            chars[pos] = random.choice(string.ascii_letters)
+        elif op == 'ins':
+            chars.insert(pos, random.choice(string.ascii_letters))
+        elif len(chars) > 1:
+            del chars[pos]
+    return ''.join(chars)
+
+
+def test_split_term_pieces():
+
+    pieces = FuzzyKingdomMatcher.split_term('Brine  shrimp', 5)
+
+    assert ''.join(pieces) == 'brine shrimp'
+    assert len(pieces) == 5
+
+
+def test_match_multiword_whitespace(generic_dict):
+
+    matcher = FuzzyKingdomMatcher(generic_dict)
+
+    result = matcher.match('Survival of BRINE\n   shrimp cysts')
+
+    assert result == ['Animal']
+
+
+def test_match_agrees_with_reference(generic_dict):
+
+    random.seed(1234)
+    matcher = FuzzyKingdomMatcher(generic_dict)
+    terms = list(generic_dict.keys())
+    texts = []
+    for _ in range(300):
+        words = [
+            perturb(random.choice(terms),
+                    random.randint(0, 3)) if random.random() < 0.3 else
+            ''.join(random.choices(string.ascii_lowercase, k=6))
+            for _ in range(8)
+        ]
+        texts.append(random.choice([' ', '\n', '  ']).join(words))
+
+    for text in texts:
+        assert matcher.match(text) == reference_match(text, generic_dict)
+
+
+############################### common names ##################################
+
+
+def test_split_common_name():
+
+    assert split_common_name('Corn (maize), for cereals') == ['corn', 'maize']
+    assert split_common_name('Satsuma (mandarin/tangerine)') == [
+        'satsuma', 'mandarin', 'tangerine'
+    ]
+    assert split_common_name('Cabbage (red, white, Savoy)') == ['cabbage']
+    assert split_common_name('Lupine (all varieties)') == ['lupine']
+    assert split_common_name('Blackberries of various species') == [
+        'blackberries'
+    ]
+    assert split_common_name('Scorzonera \u2013 black salsify') == [
+        'scorzonera', 'black salsify'
+    ]
+
+
+def test_read_common_names():
+
+    common_names = read_common_names('../desiccation_network/'
+                                     'build_citation_network/maps/'
+                                     'ag_plant_common_names.csv')
+
+    assert common_names['almond'] == 'Prunus dulcis'
+    assert common_names['black salsify'] == 'Scorzonera hispanica'
+    assert 'all varieties' not in common_names
+
+
+############################## TaxonPrefilter #################################
+
+
+@pytest.fixture
+def prefilter():
+    return TaxonPrefilter(['maize', 'brine shrimp', 'strawberry'])
+
+
+def test_has_candidates_common_names(prefilter):
+
+    assert prefilter.has_candidates('Drought tolerance of Maize lines')
+    assert prefilter.has_candidates('Hatching of brine\nshrimp cysts')
+    assert prefilter.has_candidates('Storage of strawberries')
+    assert not prefilter.has_candidates('Water loss in soils')
+
+
+def test_has_candidates_scientific_names(prefilter):
+
+    assert prefilter.has_candidates('Growth of E. coli in dry conditions')
+    assert prefilter.has_candidates('Roots of Arabidopsis thaliana')
+    assert prefilter.has_candidates('Sporobolus spp. from dry grasslands')
+    assert not prefilter.has_candidates('The Effect of Drying on Concrete')
+    assert prefilter.scientific_names['Arabidopsis thaliana'] == 'species'
+
+
+def test_has_candidates_sentence_initial_genus(prefilter):
+
+    # "This" and "Data" are genera in NCBI Taxonomy
+    abstract = ('Soil moisture controls infiltration. This study measures '
+                'water flux in sandy soils. Data were collected over two '
+                'years.')
+
+    assert not prefilter.has_candidates(abstract)
+
+
+######################### DictionaryKingdomMatcher ############################
+
+
+def reference_find_terms(text, term_kingdoms):
+    """
+    Per-form regex search that DictionaryKingdomMatcher has to agree with.
+    """
+    norm_text = ' '.join(text.casefold().split())
+    first = {}
+    for term in term_kingdoms:
+        for form in get_name_forms(term):
+            for match in regex.finditer(
+                    fr'(?<![^\W_]){regex.escape(form)}(?![^\W_])',
+                    norm_text,
+                    overlapped=True):
+                end = match.end()
+                if (term not in first) or (end < first[term][0]):
+                    first[term] = (end, -len(form))
+    return sorted(first, key=lambda term: first[term])
+
+
+def test_find_terms_whole_words(generic_dict):
+
+    matcher = DictionaryKingdomMatcher(generic_dict)
+
+    result = matcher.find_terms('Wheat and BRINE\n  shrimps, not '
+                                'nematodes-free wheatgrass')
+
+    assert result == ['Wheat', 'Brine shrimp', 'Nematode']
+    assert matcher.match('Rotifers and lichens') == ['Animal', 'Fungi']
+
+
+def test_find_terms_agrees_with_reference(generic_dict):
+
+    random.seed(1234)
+    term_kingdoms = {**generic_dict, 'corn': 'Plant', 'sweet corn': 'Plant'}
+    matcher = DictionaryKingdomMatcher(term_kingdoms)
+    terms = list(term_kingdoms.keys())
+    for _ in range(300):
+        words = [
+            random.choice(terms) + random.choice(['', 's', 'es', 'x']) if
+            random.random() < 0.3 else ''.join(
+                random.choices(string.ascii_lowercase, k=4))
+            for _ in range(8)
+        ]
+        text = random.choice([' ', '\n', '  ', '-']).join(words)
+
+        assert sorted(matcher.find_terms(text)) == sorted(
+            reference_find_terms(text, term_kingdoms))
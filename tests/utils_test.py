@@ -8,9 +8,13 @@ import networkx as nx
 import numpy as np
 import pandas as pd
 import sys
+import copy
+import types
+import jsonlines
 
 sys.path.append('../desiccation_network/conference_recommendation')
 import utils
+from csr_graph import CSRCitationGraph
 
 ###################### calculate_dyadic_citation_freqs #########################
 
@@ -96,6 +100,194 @@ def test_calculate_dyadic_citation_freqs(input_graph, dyadic_output):
     assert result == dyadic_output
 
 
+@pytest.mark.parametrize('as_csr', [False, True])
+def test_calculate_dyadic_citation_freqs_multi_edge(input_graph, dyadic_output,
+                                                    as_csr):
+
+    # A repeated citation counts towards both the total and the pair
+    _ = input_graph.add_edge('a1', 'a4')
+    dyadic_output.update({
+        ('Animal', 'Plant'): 1 / 8,
+        ('Animal', 'Microbe'): 2 / 8,
+        ('Animal', 'Animal'): 5 / 8
+    })
+    if as_csr:
+        input_graph = CSRCitationGraph.from_networkx(input_graph)
+
+    result = utils.calculate_dyadic_citation_freqs(input_graph, 'study_system')
+
+    assert result == dyadic_output
+
+
+def test_calculate_dyadic_citation_freqs_batch(input_graph, dyadic_output):
+
+    for node, attrs in input_graph.nodes(data=True):
+        attrs['is_plant'] = 'yes' if attrs['study_system'] == 'Plant' else 'no'
+    plant_output = {
+        ('yes', 'yes'): 2 / 3,
+        ('yes', 'no'): 1 / 3,
+        ('no', 'yes'): 2 / 11,
+        ('no', 'no'): 9 / 11
+    }
+
+    result = utils.calculate_dyadic_citation_freqs_batch(
+        input_graph, ['study_system', 'is_plant'])
+
+    assert result == {
+        'study_system': dyadic_output,
+        'is_plant': plant_output
+    }
+
+
+###################### resample_dyadic_citation_freqs ##########################
+
+
+def test_resample_dyadic_citation_freqs(input_graph, dyadic_output):
+
+    result = utils.resample_dyadic_citation_freqs(input_graph,
+                                                  'study_system',
+                                                  num_bootstrap=200,
+                                                  num_permutations=200,
+                                                  chunk_size=50)
+
+    assert list(result.columns) == [
+        'citing', 'cited', 'freq', 'ci_lower', 'ci_upper', 'p_value'
+    ]
+    freqs = {(row.citing, row.cited): row.freq for row in result.itertuples()}
+    assert freqs.keys() == dyadic_output.keys()
+    for pair, freq in dyadic_output.items():
+        if np.isnan(freq):
+            assert np.isnan(freqs[pair])
+        else:
+            assert freqs[pair] == pytest.approx(freq)
+    has_cites = result[result.citing != 'Fungi']
+    assert (has_cites.ci_lower <= has_cites.freq).all()
+    assert (has_cites.freq <= has_cites.ci_upper).all()
+    assert ((has_cites.p_value > 0) & (has_cites.p_value <= 1)).all()
+    assert result[result.citing == 'Fungi'].p_value.isna().all()
+
+
+def test_resample_dyadic_citation_freqs_processes(input_graph):
+
+    kwargs = {'num_bootstrap': 60, 'num_permutations': 60, 'chunk_size': 20}
+
+    serial = utils.resample_dyadic_citation_freqs(input_graph, 'study_system',
+                                                  **kwargs)
+    parallel = utils.resample_dyadic_citation_freqs(
+        CSRCitationGraph.from_networkx(input_graph),
+        'study_system',
+        processes=2,
+        **kwargs)
+
+    pd.testing.assert_frame_equal(serial, parallel)
+
+
+def test_resample_dyadic_citation_freqs_nan_null():
+
+    # Only one node makes citations, so most permutations move the rare
+    # category onto a node without citations and give it a nan row
+    graph = nx.MultiDiGraph()
+    graph.add_node('c', study_system='Rare')
+    graph.add_nodes_from([(f'n{i}', {
+        'study_system': 'Common'
+    }) for i in range(9)])
+    graph.add_edges_from([('c', f'n{i}') for i in range(9)])
+
+    result = utils.resample_dyadic_citation_freqs(graph,
+                                                  'study_system',
+                                                  num_bootstrap=20,
+                                                  num_permutations=200)
+
+    p_values = {(row.citing, row.cited): row.p_value
+                for row in result.itertuples()}
+    # Every permutation where Rare made citations is as extreme as observed
+    assert p_values[('Rare', 'Common')] == 1.0
+    assert p_values[('Rare', 'Rare')] == 1.0
+
+
+@pytest.mark.parametrize('kwargs', [{
+    'num_bootstrap': 0
+}, {
+    'num_permutations': 0
+}])
+def test_resample_dyadic_citation_freqs_no_replicates(input_graph, kwargs):
+
+    with pytest.raises(AssertionError):
+        utils.resample_dyadic_citation_freqs(input_graph, 'study_system',
+                                             **kwargs)
+
+
+########################## prune_citation_network ##############################
+
+
+@pytest.mark.parametrize('kwargs', [{
+    'main_results_only': ['p1', 'a1', 'a2', 'm2']
+}, {
+    'remove_dead_ends': True
+}, {
+    'threshold_in_degree': 2
+}])
+def test_prune_citation_network_csr(input_graph, kwargs):
+
+    csr_graph = CSRCitationGraph.from_networkx(input_graph)
+
+    result = utils.prune_citation_network(csr_graph, **kwargs)
+    expected = utils.prune_citation_network(input_graph, **kwargs)
+
+    assert sorted(result.nodes()) == sorted(expected.nodes)
+    assert sorted(result.edges()) == sorted(expected.edges)
+
+
+def test_prune_citation_network_combined(input_graph):
+
+    result = utils.prune_citation_network(input_graph,
+                                          remove_dead_ends=True,
+                                          threshold_in_degree=1)
+
+    # Both criteria are evaluated on the unpruned graph
+    assert sorted(result.nodes) == ['a1', 'a2', 'm1', 'm2']
+
+
+@pytest.mark.parametrize('as_csr', [False, True])
+def test_prune_citation_network_until_stable(input_graph, as_csr):
+
+    # f1 only cites a dead end, everything else leads into the m1/m2 cycle
+    _ = input_graph.add_edges_from([('m2', 'm1'), ('f1', 'p2')])
+    if as_csr:
+        input_graph = CSRCitationGraph.from_networkx(input_graph)
+
+    result = utils.prune_citation_network(input_graph,
+                                          remove_dead_ends=True,
+                                          until_stable=True)
+
+    assert sorted(result.nodes()) == ['a1', 'a2', 'm1', 'm2', 'p1']
+
+
+@pytest.mark.parametrize('as_csr', [False, True])
+def test_prune_citation_network_main_results_noclass(input_graph, as_csr):
+
+    input_graph.nodes['a2']['study_system'] = 'NOCLASS'
+    if as_csr:
+        input_graph = CSRCitationGraph.from_networkx(input_graph)
+
+    result = utils.prune_citation_network(
+        input_graph,
+        main_results_only=['p1', 'a1', 'a2', 'm2'],
+        remove_noclass=True)
+
+    assert sorted(result.nodes()) == ['a1', 'm2', 'p1']
+
+
+def test_prune_citation_network_as_view(input_graph):
+
+    result = utils.prune_citation_network(input_graph,
+                                          remove_dead_ends=True,
+                                          as_view=True)
+
+    assert sorted(result.nodes) == ['a1', 'a2', 'm1', 'm2', 'p1']
+    assert input_graph.number_of_nodes() == 12
+
+
 ############################### prune_jsonl ####################################
 
 
@@ -196,6 +388,88 @@ def test_prune_jsonl(input_jsonl, output_jsonl):
     assert result == output_jsonl
 
 
+def test_iter_pruned_jsonl_no_mutation(input_jsonl, output_jsonl):
+
+    original = copy.deepcopy(input_jsonl)
+
+    result = utils.iter_pruned_jsonl(input_jsonl)
+
+    assert isinstance(result, types.GeneratorType)
+    assert list(result) == output_jsonl
+    assert input_jsonl == original
+
+
+def test_prune_jsonl_file(input_jsonl, output_jsonl, tmp_path):
+
+    jsonl_path = tmp_path / 'input.jsonl'
+    output_path = tmp_path / 'output.jsonl'
+    with jsonlines.open(jsonl_path, 'w') as writer:
+        writer.write_all(input_jsonl)
+
+    utils.prune_jsonl_file(jsonl_path, output_path)
+
+    with jsonlines.open(output_path) as reader:
+        assert list(reader) == output_jsonl
+
+
+############################### filter_papers ##################################
+
+
+@pytest.fixture
+def key_df():
+    return pd.DataFrame({'relevant': ['Y', 'N', 'Y', 'N']},
+                        index=['drought', 'cancer', 'seed', 'heart'])
+
+
+@pytest.fixture
+def papers_to_filter():
+    return [{
+        'UID': 'all_relevant',
+        'static_keys': ['drought', 'seed']
+    }, {
+        'UID': 'tied',
+        'static_keys': ['drought', 'cancer']
+    }, {
+        'UID': 'mostly_irrelevant',
+        'static_keys': ['seed', 'cancer', 'heart']
+    }, {
+        'UID': 'no_keys',
+        'static_keys': []
+    }, {
+        'UID': 'unknown_key',
+        'static_keys': ['drought', 'not_labeled']
+    }]
+
+
+@pytest.mark.parametrize('stringency,expected_uids',
+                         [('most', ['all_relevant', 'unknown_key']),
+                          ('middle', ['all_relevant', 'unknown_key']),
+                          ('least', [
+                              'all_relevant', 'tied', 'mostly_irrelevant',
+                              'unknown_key'
+                          ])])
+def test_filter_papers(papers_to_filter, key_df, stringency, expected_uids):
+
+    result = utils.filter_papers(papers_to_filter, key_df, 'static_keys',
+                                 stringency)
+
+    assert [paper['UID'] for paper in result] == expected_uids
+
+
+def test_filter_papers_counts(papers_to_filter, key_df):
+
+    _, counts = utils.filter_papers(papers_to_filter,
+                                    key_df,
+                                    'static_keys',
+                                    return_counts=True)
+
+    assert counts.UID.tolist() == [p['UID'] for p in papers_to_filter]
+    assert counts.num_Y.tolist() == [2, 1, 1, 0, 1]
+    assert counts.num_N.tolist() == [0, 1, 2, 0, 0]
+    assert counts.num_unknown.tolist() == [0, 0, 0, 0, 1]
+    assert counts.middle.tolist() == [True, False, False, False, True]
+
+
 ############################## process_alt_names ###############################
 
 